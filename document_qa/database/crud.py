@@ -1,7 +1,8 @@
 import uuid
+from typing import Dict, List, Tuple
 
-from database.models import Documents
-from database.schemas import DocumentBase, Item
+from database.models import DocumentPages, Documents
+from database.schemas import DocumentBase
 from sqlalchemy.orm import Session
 
 
@@ -12,7 +13,7 @@ def get_document(db: Session, document_id: str):
     :param str document_id: ID of the document
     :return _type_: Document information
     """
-    return db.query(Documents).filter(Item.id == document_id).first()
+    return db.query(Documents).filter(Documents.id == document_id).first()
 
 
 def get_all_documents(db: Session, skip: int = 0, limit: int = 100):
@@ -38,3 +39,80 @@ def create_document_item(db: Session, item: DocumentBase):
     db.commit()
     db.refresh(db_item)
     return db_item
+
+
+def create_document_items(db: Session, items: List[DocumentBase]):
+    """Create many document items in a single transaction
+
+    :param Session db: Database session
+    :param List[DocumentBase] items: Pydantic document information classes
+    :return _type_: Created documents, in the order of the items
+    """
+    db_items = [Documents(**item.model_dump(), id=str(uuid.uuid4())) for item in items]
+    db.add_all(db_items)
+    db.commit()
+    for db_item in db_items:
+        db.refresh(db_item)
+    return db_items
+
+
+def update_document_item(db: Session, document_id: str, **fields):
+    """Update the columns of a document item
+
+    :param Session db: Database session
+    :param str document_id: ID of the document
+    :return _type_: Updated document information
+    """
+    db.query(Documents).filter(Documents.id == document_id).update(fields)
+    db.commit()
+    return get_document(db=db, document_id=document_id)
+
+
+def get_page_hashes(db: Session, document_id: str) -> Dict[int, Tuple[str, str]]:
+    """Get the text hash and split parameters of every page of a document
+
+    :param Session db: Database session
+    :param str document_id: ID of the document
+    :return Dict[int, Tuple[str, str]]: Text hash and split parameters, by page number
+    """
+    rows = db.query(DocumentPages).filter(DocumentPages.doc_id == document_id)
+    return {row.page_number: (row.text_hash, row.split_params) for row in rows}
+
+
+def set_page_hashes(
+    db: Session, document_id: str, page_hashes: Dict[int, str], split_params: str
+):
+    """Replace the page hashes of a document
+
+    :param Session db: Database session
+    :param str document_id: ID of the document
+    :param Dict[int, str] page_hashes: Text hash, by page number
+    :param str split_params: Splitting strategy and parameters of the pages
+    """
+    db.query(DocumentPages).filter(DocumentPages.doc_id == document_id).delete()
+    db.add_all(
+        DocumentPages(
+            doc_id=document_id,
+            page_number=page_number,
+            text_hash=text_hash,
+            split_params=split_params,
+        )
+        for page_number, text_hash in page_hashes.items()
+    )
+    db.commit()
+
+
+def delete_page_hashes(
+    db: Session, document_id: str, page_numbers: List[int] | None = None
+):
+    """Forget the page hashes of a document, so the pages are embedded again
+
+    :param Session db: Database session
+    :param str document_id: ID of the document
+    :param List[int] | None page_numbers: Pages to forget, defaults to None (every page)
+    """
+    query = db.query(DocumentPages).filter(DocumentPages.doc_id == document_id)
+    if page_numbers is not None:
+        query = query.filter(DocumentPages.page_number.in_(page_numbers))
+    query.delete(synchronize_session=False)
+    db.commit()
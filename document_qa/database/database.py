@@ -1,5 +1,6 @@
 from config import settings
-from sqlalchemy import create_engine
+from database.models import Base
+from sqlalchemy import Engine, create_engine, inspect, literal, text
 from sqlalchemy.orm import sessionmaker
 
 DATABASE_URL = settings.sql_db_path
@@ -7,3 +8,44 @@ DATABASE_URL = settings.sql_db_path
 
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def create_tables(bind: Engine):
+    """Create the missing tables and add the columns missing from the existing ones
+
+    create_all never alters a table, databases created before a column was
+    added to the models are migrated here, with the column default filling
+    the existing rows.
+
+    :param Engine bind: Engine of the database
+    """
+    Base.metadata.create_all(bind=bind)
+    inspector = inspect(bind)
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            added = set()
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                statement = (
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                    f"{column.type.compile(dialect=bind.dialect)}"
+                )
+                if column.default is not None and column.default.is_scalar:
+                    default = literal(column.default.arg).compile(
+                        dialect=bind.dialect, compile_kwargs={"literal_binds": True}
+                    )
+                    statement += f" DEFAULT {default}"
+                connection.execute(text(statement))
+                added.add(column.name)
+
+            if table.name == "documents" and "status" in added:
+                # Documents ingested before the status existed are done, or
+                # were interrupted by a restart and never resumed
+                connection.execute(
+                    text(
+                        "UPDATE documents SET status = CASE WHEN processed "
+                        "THEN 'completed' ELSE 'failed' END"
+                    )
+                )
@@ -11,3 +11,20 @@ class Documents(Base):
     id = Column(String, primary_key=True)
     file_name = Column(String)
     processed = Column(Boolean, default=False)
+    status = Column(String, default="queued")
+    total_pages = Column(Integer, nullable=True)
+    pages_done = Column(Integer, default=0)
+    chunks_done = Column(Integer, default=0)
+    cached_chunks = Column(Integer, default=0)
+    error = Column(String, nullable=True)
+
+
+class DocumentPages(Base):
+    __tablename__ = "document_pages"
+
+    doc_id = Column(String, ForeignKey("documents.id"), primary_key=True)
+    page_number = Column(Integer, primary_key=True)
+    # sha256 of the whitespace normalised text of the page
+    text_hash = Column(String)
+    # Splitting strategy and parameters the page was chunked with
+    split_params = Column(String)
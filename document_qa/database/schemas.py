@@ -13,3 +13,42 @@ class Item(DocumentBase):
 
     class Config:
         orm_mode = True
+
+
+class DocumentStatus(Item):
+    status: str
+    total_pages: int | None = None
+    pages_done: int = 0
+    chunks_done: int = 0
+    cached_chunks: int = 0
+    error: str | None = None
+
+
+class ReplaceResult(BaseModel):
+    id: str
+    file_name: str
+    total_pages: int
+    pages_added: list[int]
+    pages_changed: list[int]
+    pages_removed: list[int]
+    pages_unchanged: int
+    full_reingest: bool
+    chunks_inserted: int
+    cached_chunks: int
+    hash_seconds: float
+    delete_seconds: float
+    embed_seconds: float
+    total_seconds: float
+
+
+class BulkFileStatus(BaseModel):
+    file_name: str
+    id: str | None = None
+    status: str
+    error: str | None = None
+
+
+class BulkUploadResult(BaseModel):
+    files: list[BulkFileStatus]
+    queued: int
+    rejected: int
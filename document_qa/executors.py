@@ -0,0 +1,38 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict
+
+
+class Executors:
+    """Named, size bounded thread pools the request handlers offload blocking work to"""
+
+    def __init__(self, sizes: Dict[str, int]) -> None:
+        """Create one thread pool per name
+
+        :param Dict[str, int] sizes: Number of threads of each pool, by pool name
+        """
+        self._pools = {
+            name: ThreadPoolExecutor(max_workers=size, thread_name_prefix=name)
+            for name, size in sizes.items()
+        }
+
+    async def run(self, name: str, fn: Callable, *args, **kwargs) -> Any:
+        """Run a blocking function on a pool without blocking the event loop
+
+        :param str name: Name of the pool
+        :param Callable fn: Function to run
+        :return Any: Return value of the function
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._pools[name], partial(fn, *args, **kwargs)
+        )
+
+    def shutdown(self, wait: bool = True):
+        """Shut every pool down
+
+        :param bool wait: Wait for the running functions to finish, defaults to True
+        """
+        for pool in self._pools.values():
+            pool.shutdown(wait=wait)
@@ -0,0 +1,107 @@
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Tuple
+
+from vector_search.vector_store import VectorStorePool
+
+logger = logging.getLogger(__name__)
+
+
+class InsertBuffer:
+    """Merges the chunk batches of documents ingested together into large inserts
+
+    Workers add their embedded batches and get a Future resolved once the
+    rows are in the vector store. The rows are inserted in one call when
+    max_rows are pending, or when a worker flushes at the end of its
+    document, taking the rows of the other documents along. When a merged
+    insert fails, each document is inserted on its own, so a bad row only
+    fails its own document.
+    """
+
+    def __init__(self, vector_db_pool: VectorStorePool, max_rows: int = 1000) -> None:
+        """Initialise the buffer
+
+        :param VectorStorePool vector_db_pool: Pool to borrow the vector store from
+        :param int max_rows: Pending rows that trigger an insert, defaults to 1000
+        """
+        self.vector_db_pool = vector_db_pool
+        self.max_rows = max_rows
+
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[List[Dict], Future]] = []
+        self._rows = 0
+
+    def add(self, rows: List[Dict]) -> Future:
+        """Queue embedded chunks for insertion, safe to call from any thread
+
+        :param List[Dict] rows: Chunks in the structure of the pdf_documents schema
+        :return Future: Future resolved once the rows are inserted
+        """
+        future = Future()
+        if not rows:
+            future.set_result(None)
+            return future
+        with self._lock:
+            self._pending.append((rows, future))
+            self._rows += len(rows)
+            full = self._rows >= self.max_rows
+        if full:
+            self.flush()
+        return future
+
+    def flush(self):
+        """Insert every pending row with a single call, in the calling thread"""
+        with self._lock:
+            pending, self._pending, self._rows = self._pending, [], 0
+        if not pending:
+            return
+
+        try:
+            self._insert(pending)
+            return
+        except Exception as e:
+            error = e
+
+        by_document: Dict[str, List[Tuple[List[Dict], Future]]] = {}
+        for batch, future in pending:
+            by_document.setdefault(batch[0]["doc_id"], []).append((batch, future))
+        if len(by_document) == 1:
+            logger.error(
+                "Inserting %d buffered batches failed", len(pending), exc_info=error
+            )
+            self._fail(pending, error)
+            return
+
+        logger.warning(
+            "Merged insert of %d documents failed, inserting them one by one",
+            len(by_document),
+            exc_info=error,
+        )
+        for doc_id, document_pending in by_document.items():
+            try:
+                self._insert(document_pending)
+            except Exception as e:
+                logger.exception("Inserting the chunks of %s failed", doc_id)
+                self._fail(document_pending, e)
+
+    def _insert(self, pending: List[Tuple[List[Dict], Future]]):
+        """Insert the rows of pending batches with one call and resolve their futures
+
+        :param List[Tuple[List[Dict], Future]] pending: Batches and their futures
+        """
+        rows = [row for batch, _ in pending for row in batch]
+        with self.vector_db_pool.acquire() as vector_db:
+            vector_db.insert_to_collection(data=rows)
+        for _, future in pending:
+            future.set_result(None)
+
+    @staticmethod
+    def _fail(pending: List[Tuple[List[Dict], Future]], error: Exception):
+        """Fail the futures of pending batches
+
+        :param List[Tuple[List[Dict], Future]] pending: Batches and their futures
+        :param Exception error: Error of their insert
+        """
+        for _, future in pending:
+            future.set_exception(error)
@@ -0,0 +1,199 @@
+"""Split stored documents again with another configuration, into a new collection
+
+Usage, from the document_qa directory::
+
+    python -m ingestion.rechunk --collection pdf_documents_char_1000 \
+        --strategy char --chunk-size 1000 --chunk-overlap 100
+
+The pages are read from the page store, already extracted and normalised, so
+neither PyMuPDF nor textacy run. Only the splitter and the embedding model
+do. The chunks go to the given Milvus collection, or numpy store path with
+the numpy backend, which is created when missing. The live collection is
+untouched, point milvus.collection_name (or vector_store.path) at the new
+one to compare retrieval. Documents without stored pages, ingested before
+the page store was enabled, are skipped.
+"""
+
+import argparse
+import json
+import logging
+import time
+from functools import partial
+from itertools import chain
+from typing import Dict, List
+
+from config import settings
+from database.crud import get_document
+from database.database import SessionLocal
+from text_extracter.page_store import PageTextStore
+from text_extracter.pdf_miners import ExtractionStats, iter_rechunked_batches
+from vector_search.embedding_cache import EmbeddingCache
+from vector_search.text_embedders import TextEmbedding
+from vector_search.text_splitter import SplitStrategy, TextSplitter
+from vector_search.vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+
+def open_target(collection: str) -> VectorStore:
+    """Open the store the chunks are written to, creating the collection if needed
+
+    :param str collection: Milvus collection name, or numpy store path with the numpy backend
+    :return VectorStore: Vector store of the new chunks
+    """
+    if settings.vector_store.backend == "numpy":
+        from vector_search.numpy_store import NumpyVectorStore
+
+        return NumpyVectorStore(
+            dimension=settings.vector_store.dimension,
+            metric=settings.vector_store.metric,
+            path=collection,
+        )
+
+    from vector_search.index_profiles import index_profile_from_settings
+    from vector_search.milvus_client import Milvus, build_schema
+
+    target = Milvus(
+        uri=settings.milvus.uri,
+        token=settings.milvus.token,
+        collection_name=collection,
+        index_profile=index_profile_from_settings(settings.milvus.index),
+    )
+    if collection not in target.list_collection():
+        target.create_collection(
+            collection_name=collection,
+            schema=build_schema(),
+            num_partitions=settings.milvus.num_partitions,
+        )
+    return target
+
+
+def rechunk_documents(
+    doc_ids: List[str],
+    target: VectorStore,
+    page_store: PageTextStore,
+    embedder: TextEmbedding,
+    strategy: SplitStrategy = SplitStrategy.tiktoken,
+    chunk_size: int = 300,
+    chunk_overlap: int = 50,
+    embedding_cache: EmbeddingCache | None = None,
+) -> Dict:
+    """Split, embed and insert the stored pages of documents with a new configuration
+
+    :param List[str] doc_ids: IDs of the documents to split again
+    :param VectorStore target: Store the new chunks are written to
+    :param PageTextStore page_store: Store of the normalised page texts
+    :param TextEmbedding embedder: TextEmbedder object to vectorise the text
+    :param SplitStrategy strategy: Text splitting strategy, defaults to SplitStrategy.tiktoken
+    :param int chunk_size: Size of each chunk, defaults to 300
+    :param int chunk_overlap: Overlap between each chunks, defaults to 50
+    :param EmbeddingCache | None embedding_cache: Cache of chunk embeddings, defaults to None
+    :return Dict: Documents split and skipped, pages, chunks and throughput
+    """
+    # The stored text is normalised already
+    text_splitter = partial(TextSplitter(preprocessing=False).split, strategy)
+    params = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    stats = ExtractionStats()
+    documents, skipped = 0, []
+
+    start = time.perf_counter()
+    db = SessionLocal()
+    try:
+        for doc_id in doc_ids:
+            document = get_document(db=db, document_id=doc_id)
+            pages = page_store.iter_pages(doc_id)
+            first = next(pages, None)
+            if document is None or first is None:
+                logger.warning("No stored pages for %s, skipping it", doc_id)
+                skipped.append(doc_id)
+                continue
+
+            # Reruns replace the chunks of an earlier run
+            target.delete_entity(doc_id=doc_id)
+            for batch in iter_rechunked_batches(
+                file_name=document.file_name,
+                doc_id=doc_id,
+                page_texts=chain([first], pages),
+                text_splitter=text_splitter,
+                params=params,
+                embedder=embedder,
+                batch_size=settings.embedding.batch_size,
+                stats=stats,
+                embedding_cache=embedding_cache,
+            ):
+                target.insert_to_collection(data=batch)
+            documents += 1
+            logger.info("Split %s again, %d chunks so far", doc_id, stats.chunks)
+    finally:
+        db.close()
+
+    seconds = time.perf_counter() - start
+    return {
+        "split_params": {"strategy": strategy.value, **params},
+        "documents": documents,
+        "skipped": skipped,
+        "pages": stats.pages,
+        "chunks": stats.chunks,
+        "cache_hits": stats.cache_hits,
+        "seconds": seconds,
+        "chunks_per_second": stats.chunks / seconds if seconds else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--collection", required=True, help="New collection, or numpy store path"
+    )
+    parser.add_argument(
+        "--strategy",
+        choices=[strategy.value for strategy in SplitStrategy],
+        default=SplitStrategy.tiktoken.value,
+    )
+    parser.add_argument("--chunk-size", type=int, default=300)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument(
+        "--doc-id",
+        action="append",
+        help="Document to split again, repeatable, every stored document by default",
+    )
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    page_store = PageTextStore(
+        path=settings.page_store.path,
+        compression_level=settings.page_store.compression_level,
+    )
+    embedder = TextEmbedding()
+    embedding_cache = (
+        EmbeddingCache(
+            path=settings.embedding_cache.path,
+            model_id=embedder.model_id,
+            max_entries=settings.embedding_cache.max_entries,
+        )
+        if settings.embedding_cache.enabled
+        else None
+    )
+    target = open_target(args.collection)
+    try:
+        report = rechunk_documents(
+            doc_ids=args.doc_id or page_store.documents(),
+            target=target,
+            page_store=page_store,
+            embedder=embedder,
+            strategy=SplitStrategy(args.strategy),
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            embedding_cache=embedding_cache,
+        )
+    finally:
+        target.close_connection()
+        page_store.close()
+        if embedding_cache is not None:
+            embedding_cache.close()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
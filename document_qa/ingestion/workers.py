@@ -0,0 +1,547 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import List, Tuple
+
+from config import settings
+from database.crud import (
+    delete_page_hashes,
+    get_page_hashes,
+    set_page_hashes,
+    update_document_item,
+)
+from database.database import SessionLocal
+from ingestion.insert_buffer import InsertBuffer
+from text_extracter.page_store import PageTextStore
+from text_extracter.pdf_miners import (
+    ExtractionStats,
+    hash_pages,
+    iter_embedded_batches,
+)
+from vector_search.embedding_cache import EmbeddingCache
+from vector_search.text_embedders import TextEmbedding
+from vector_search.text_splitter import (
+    SplitStrategy,
+    TextSplitter,
+    check_split_params,
+)
+from vector_search.vector_store import VectorStorePool
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReplaceSummary:
+    """Pages a new revision of a document changed and the time spent on them"""
+
+    id: str
+    file_name: str
+    total_pages: int = 0
+    pages_added: List[int] = field(default_factory=list)
+    pages_changed: List[int] = field(default_factory=list)
+    pages_removed: List[int] = field(default_factory=list)
+    pages_unchanged: int = 0
+    # No page hashes were stored, every page was embedded again
+    full_reingest: bool = False
+    chunks_inserted: int = 0
+    cached_chunks: int = 0
+    hash_seconds: float = 0.0
+    delete_seconds: float = 0.0
+    embed_seconds: float = 0.0
+    total_seconds: float = 0.0
+
+
+def split_params(strategy: SplitStrategy, chunk_size: int, chunk_overlap: int) -> str:
+    """Key of the splitting a page was chunked with, stored next to its hash
+
+    :param SplitStrategy strategy: Text splitting strategy
+    :param int chunk_size: Size of each chunk
+    :param int chunk_overlap: Overlap between each chunks
+    :return str: Strategy, chunk size and overlap
+    """
+    return f"{strategy.value}:{chunk_size}:{chunk_overlap}"
+
+
+def page_ranges(page_numbers: List[int]) -> List[Tuple[int, int]]:
+    """Group page numbers into contiguous page index ranges
+
+    :param List[int] page_numbers: Page numbers, starting at 1
+    :return List[Tuple[int, int]]: (start, stop) page index range of each run of pages
+    """
+    ranges = []
+    for page_number in sorted(page_numbers):
+        if ranges and ranges[-1][1] == page_number - 1:
+            ranges[-1] = (ranges[-1][0], page_number)
+        else:
+            ranges.append((page_number - 1, page_number))
+    return ranges
+
+
+def ingest_document(
+    doc_id: str,
+    file_name: str,
+    file_path: str,
+    embedder: TextEmbedding,
+    vector_db_pool: VectorStorePool,
+    strategy: SplitStrategy = SplitStrategy.tiktoken,
+    chunk_size: int = 300,
+    chunk_overlap: int = 50,
+    process_pool: Executor | None = None,
+    embedding_cache: EmbeddingCache | None = None,
+    page_store: PageTextStore | None = None,
+    insert_buffer: InsertBuffer | None = None,
+):
+    """Extract, vectorise and store a document, recording progress in SQL
+
+    :param str doc_id: ID of the document, also used as the job id
+    :param str file_name: Name of the pdf document
+    :param str file_path: Path of the spooled pdf document, removed once ingested
+    :param TextEmbedding embedder: TextEmbedder object to vectorise the text
+    :param VectorStorePool vector_db_pool: Pool to borrow the vector store from
+    :param SplitStrategy strategy: Text splitting strategy, defaults to SplitStrategy.tiktoken
+    :param int chunk_size: Size of each chunk, defaults to 300
+    :param int chunk_overlap: Overlap between each chunks, defaults to 50
+    :param Executor | None process_pool: Process pool to extract pages in, defaults to None
+    :param EmbeddingCache | None embedding_cache: Cache of chunk embeddings, defaults to None
+    :param PageTextStore | None page_store: Store of the normalised page texts, defaults to None
+    :param InsertBuffer | None insert_buffer: Buffer merging the inserts of documents ingested together, progress is then only recorded once done, defaults to None
+    """
+    db = SessionLocal()
+    inserts = []
+    try:
+        update_document_item(db=db, document_id=doc_id, status="processing")
+
+        # Normalised once, the page store keeps the text as it was split
+        ts = TextSplitter(preprocessing=False)
+        stats = ExtractionStats()
+        batches = iter_embedded_batches(
+            file_name=file_name,
+            file=file_path,
+            doc_id=doc_id,
+            text_splitter=partial(ts.split, strategy),
+            normalize=TextSplitter().normalizing_text,
+            params={"chunk_size": chunk_size, "chunk_overlap": chunk_overlap},
+            embedder=embedder,
+            batch_size=settings.embedding.batch_size,
+            stats=stats,
+            process_pool=process_pool,
+            shards=settings.ingestion.processes,
+            pages_per_shard=settings.ingestion.pages_per_shard,
+            embedding_cache=embedding_cache,
+            page_store=page_store,
+        )
+
+        # Insert each batch as soon as it is embedded, nothing accumulates
+        for batch in batches:
+            if insert_buffer is not None:
+                inserts.append(insert_buffer.add(batch))
+                continue
+            with vector_db_pool.acquire() as vector_db:
+                vector_db.insert_to_collection(data=batch)
+            update_document_item(
+                db=db,
+                document_id=doc_id,
+                total_pages=stats.total_pages,
+                pages_done=stats.pages,
+                chunks_done=stats.chunks,
+                cached_chunks=stats.cache_hits,
+            )
+        if insert_buffer is not None:
+            insert_buffer.flush()
+            for insert in inserts:
+                insert.result()
+
+        # Baseline of the next revision, see replace_document
+        set_page_hashes(
+            db=db,
+            document_id=doc_id,
+            page_hashes=stats.page_hashes,
+            split_params=split_params(strategy, chunk_size, chunk_overlap),
+        )
+        update_document_item(
+            db=db,
+            document_id=doc_id,
+            processed=True,
+            status="completed",
+            total_pages=stats.total_pages,
+            pages_done=stats.pages,
+            chunks_done=stats.chunks,
+            cached_chunks=stats.cache_hits,
+        )
+    except Exception as e:
+        logger.exception("Ingestion of %s (%s) failed", file_name, doc_id)
+        db.rollback()
+        if inserts:
+            # Buffered rows must land before they are removed, not after
+            insert_buffer.flush()
+            wait(inserts)
+        _remove_partial_document(
+            doc_id=doc_id, vector_db_pool=vector_db_pool, page_store=page_store
+        )
+        update_document_item(db=db, document_id=doc_id, status="failed", error=str(e))
+    finally:
+        db.close()
+        Path(file_path).unlink(missing_ok=True)
+
+
+def replace_document(
+    doc_id: str,
+    file_name: str,
+    file_path: str,
+    embedder: TextEmbedding,
+    vector_db_pool: VectorStorePool,
+    strategy: SplitStrategy = SplitStrategy.tiktoken,
+    chunk_size: int = 300,
+    chunk_overlap: int = 50,
+    process_pool: Executor | None = None,
+    embedding_cache: EmbeddingCache | None = None,
+    page_store: PageTextStore | None = None,
+) -> ReplaceSummary:
+    """Replace a document with a new revision, re-embedding only the pages that changed
+
+    The text hash of every page is compared with the one stored by the last
+    ingestion. The chunks of changed, added and removed pages are deleted,
+    and changed and added pages are split, embedded and inserted again.
+    Documents without stored hashes are ingested again in full.
+
+    :param str doc_id: ID of the document to replace
+    :param str file_name: Name of the new pdf document
+    :param str file_path: Path of the spooled pdf document, removed once ingested
+    :param TextEmbedding embedder: TextEmbedder object to vectorise the text
+    :param VectorStorePool vector_db_pool: Pool to borrow the vector store from
+    :param SplitStrategy strategy: Text splitting strategy, defaults to SplitStrategy.tiktoken
+    :param int chunk_size: Size of each chunk, defaults to 300
+    :param int chunk_overlap: Overlap between each chunks, defaults to 50
+    :param Executor | None process_pool: Process pool to extract pages in, defaults to None
+    :param EmbeddingCache | None embedding_cache: Cache of chunk embeddings, defaults to None
+    :param PageTextStore | None page_store: Store of the normalised page texts, defaults to None
+    :return ReplaceSummary: Pages added, changed and removed, and the timings
+    """
+    start = time.perf_counter()
+    summary = ReplaceSummary(id=doc_id, file_name=file_name)
+    params = split_params(strategy, chunk_size, chunk_overlap)
+    db = SessionLocal()
+    reembed: List[int] = []
+    try:
+        update_document_item(db=db, document_id=doc_id, status="processing", error=None)
+        # Nothing is deleted unless the pages can be split again, building
+        # the splitter also loads its tokenizer or model
+        check_split_params(strategy, chunk_size, chunk_overlap)
+        TextSplitter(preprocessing=False).split(strategy, "", chunk_size, chunk_overlap)
+        stored = get_page_hashes(db=db, document_id=doc_id)
+        page_hashes = hash_pages(file_path)
+        summary.total_pages = len(page_hashes)
+        summary.full_reingest = not stored
+        summary.pages_added = [p for p in page_hashes if p not in stored]
+        summary.pages_changed = [
+            p
+            for p in page_hashes
+            if p in stored and stored[p] != (page_hashes[p], params)
+        ]
+        summary.pages_removed = [p for p in stored if p not in page_hashes]
+        summary.pages_unchanged = (
+            len(page_hashes) - len(summary.pages_added) - len(summary.pages_changed)
+        )
+        reembed = summary.pages_added + summary.pages_changed
+        summary.hash_seconds = time.perf_counter() - start
+
+        # Pages without a hash may hold chunks of an interrupted replace, drop them too
+        checkpoint = time.perf_counter()
+        with vector_db_pool.acquire() as vector_db:
+            if summary.full_reingest:
+                vector_db.delete_entity(doc_id=doc_id)
+            else:
+                vector_db.delete_pages(
+                    doc_id=doc_id, page_numbers=reembed + summary.pages_removed
+                )
+        # Until they are inserted again, the pages must not look up to date
+        delete_page_hashes(
+            db=db, document_id=doc_id, page_numbers=summary.pages_changed
+        )
+        if page_store is not None:
+            page_store.delete(
+                doc_id=doc_id,
+                page_numbers=None if summary.full_reingest else summary.pages_removed,
+            )
+        summary.delete_seconds = time.perf_counter() - checkpoint
+
+        checkpoint = time.perf_counter()
+        # Normalised once, the page store keeps the text as it was split
+        ts = TextSplitter(preprocessing=False)
+        stats = ExtractionStats()
+        for pages in page_ranges(reembed):
+            for batch in iter_embedded_batches(
+                file_name=file_name,
+                file=file_path,
+                doc_id=doc_id,
+                text_splitter=partial(ts.split, strategy),
+                normalize=TextSplitter().normalizing_text,
+                params={"chunk_size": chunk_size, "chunk_overlap": chunk_overlap},
+                embedder=embedder,
+                pages=pages,
+                batch_size=settings.embedding.batch_size,
+                stats=stats,
+                process_pool=process_pool,
+                shards=settings.ingestion.processes,
+                pages_per_shard=settings.ingestion.pages_per_shard,
+                embedding_cache=embedding_cache,
+                page_store=page_store,
+            ):
+                with vector_db_pool.acquire() as vector_db:
+                    vector_db.insert_to_collection(data=batch)
+        summary.chunks_inserted = stats.chunks
+        summary.cached_chunks = stats.cache_hits
+        summary.embed_seconds = time.perf_counter() - checkpoint
+
+        set_page_hashes(
+            db=db, document_id=doc_id, page_hashes=page_hashes, split_params=params
+        )
+        update_document_item(
+            db=db,
+            document_id=doc_id,
+            file_name=file_name,
+            processed=True,
+            status="completed",
+            total_pages=summary.total_pages,
+            pages_done=summary.total_pages,
+        )
+    except Exception as e:
+        logger.exception("Replacing %s (%s) failed", file_name, doc_id)
+        db.rollback()
+        _remove_partial_pages(
+            doc_id=doc_id,
+            page_numbers=reembed,
+            vector_db_pool=vector_db_pool,
+            page_store=page_store,
+        )
+        update_document_item(db=db, document_id=doc_id, status="failed", error=str(e))
+        raise
+    finally:
+        db.close()
+        Path(file_path).unlink(missing_ok=True)
+
+    summary.total_seconds = time.perf_counter() - start
+    logger.info(
+        "Replaced %s (%s): %d pages added, %d changed, %d removed, %d unchanged in %.1fs",
+        file_name,
+        doc_id,
+        len(summary.pages_added),
+        len(summary.pages_changed),
+        len(summary.pages_removed),
+        summary.pages_unchanged,
+        summary.total_seconds,
+    )
+    return summary
+
+
+def _remove_partial_pages(
+    doc_id: str,
+    page_numbers: List[int],
+    vector_db_pool: VectorStorePool,
+    page_store: PageTextStore | None = None,
+):
+    """Delete the chunks and texts a failed replace already stored for some pages
+
+    :param str doc_id: ID of the document
+    :param List[int] page_numbers: Pages that were being embedded again
+    :param VectorStorePool vector_db_pool: Pool to borrow the vector store from
+    :param PageTextStore | None page_store: Store of the page texts, defaults to None
+    """
+    try:
+        with vector_db_pool.acquire() as vector_db:
+            vector_db.delete_pages(doc_id=doc_id, page_numbers=page_numbers)
+        if page_store is not None:
+            page_store.delete(doc_id=doc_id, page_numbers=page_numbers)
+    except Exception:
+        logger.exception("Failed to remove the partial pages of %s", doc_id)
+
+
+def _remove_partial_document(
+    doc_id: str,
+    vector_db_pool: VectorStorePool,
+    page_store: PageTextStore | None = None,
+):
+    """Delete the batches and page texts of a failed ingestion that were already stored
+
+    :param str doc_id: ID of the document
+    :param VectorStorePool vector_db_pool: Pool to borrow the vector store from
+    :param PageTextStore | None page_store: Store of the page texts, defaults to None
+    """
+    try:
+        with vector_db_pool.acquire() as vector_db:
+            vector_db.delete_entity(doc_id=doc_id)
+        if page_store is not None:
+            page_store.delete(doc_id=doc_id)
+    except Exception:
+        logger.exception("Failed to remove the partial chunks of %s", doc_id)
+
+
+class IngestionPool:
+    """Bounded pool of workers running document ingestion in the background"""
+
+    def __init__(
+        self,
+        max_workers: int,
+        embedder: TextEmbedding,
+        vector_db_pool: VectorStorePool,
+        processes: int = 0,
+        embedding_cache: EmbeddingCache | None = None,
+        page_store: PageTextStore | None = None,
+        bulk_workers: int = 4,
+        bulk_insert_rows: int = 1000,
+    ) -> None:
+        """Initialise the worker pool
+
+        :param int max_workers: Maximum number of documents ingested concurrently
+        :param TextEmbedding embedder: TextEmbedder object shared by the workers
+        :param VectorStorePool vector_db_pool: Pool the workers borrow vector stores from
+        :param int processes: Size of the process pool splitting the pages of a document, disabled below 2, defaults to 0
+        :param EmbeddingCache | None embedding_cache: Cache of chunk embeddings shared by the workers, defaults to None
+        :param PageTextStore | None page_store: Store of the normalised page texts shared by the workers, defaults to None
+        :param int bulk_workers: Maximum number of documents of bulk uploads ingested concurrently, defaults to 4
+        :param int bulk_insert_rows: Chunks of bulk uploads merged into a single insert, defaults to 1000
+        """
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ingestion"
+        )
+        # Bulk uploads get their own workers so single uploads are not stuck behind them
+        self.bulk_executor = ThreadPoolExecutor(
+            max_workers=bulk_workers, thread_name_prefix="bulk-ingestion"
+        )
+        self.insert_buffer = InsertBuffer(
+            vector_db_pool=vector_db_pool, max_rows=bulk_insert_rows
+        )
+        self.embedder = embedder
+        self.vector_db_pool = vector_db_pool
+        self.embedding_cache = embedding_cache
+        self.page_store = page_store
+        # Spawned rather than forked, the parent holds model and client threads
+        self.process_pool = (
+            ProcessPoolExecutor(
+                max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+            )
+            if processes > 1
+            else None
+        )
+
+    def submit(
+        self,
+        doc_id: str,
+        file_name: str,
+        file_path: str,
+        strategy: SplitStrategy = SplitStrategy.tiktoken,
+        chunk_size: int = 300,
+        chunk_overlap: int = 50,
+    ) -> Future:
+        """Queue a document for ingestion
+
+        :param str doc_id: ID of the document
+        :param str file_name: Name of the pdf document
+        :param str file_path: Path of the spooled pdf document, removed once ingested
+        :param SplitStrategy strategy: Text splitting strategy, defaults to SplitStrategy.tiktoken
+        :param int chunk_size: Size of each chunk, defaults to 300
+        :param int chunk_overlap: Overlap between each chunks, defaults to 50
+        :return Future: Future resolved once the document is ingested
+        """
+        return self.executor.submit(
+            ingest_document,
+            doc_id=doc_id,
+            file_name=file_name,
+            file_path=file_path,
+            strategy=strategy,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            embedder=self.embedder,
+            vector_db_pool=self.vector_db_pool,
+            process_pool=self.process_pool,
+            embedding_cache=self.embedding_cache,
+            page_store=self.page_store,
+        )
+
+    def replace(
+        self,
+        doc_id: str,
+        file_name: str,
+        file_path: str,
+        strategy: SplitStrategy = SplitStrategy.tiktoken,
+        chunk_size: int = 300,
+        chunk_overlap: int = 50,
+    ) -> Future:
+        """Queue a new revision of an ingested document
+
+        :param str doc_id: ID of the document to replace
+        :param str file_name: Name of the new pdf document
+        :param str file_path: Path of the spooled pdf document, removed once ingested
+        :param SplitStrategy strategy: Text splitting strategy, defaults to SplitStrategy.tiktoken
+        :param int chunk_size: Size of each chunk, defaults to 300
+        :param int chunk_overlap: Overlap between each chunks, defaults to 50
+        :return Future: Future of the ReplaceSummary
+        """
+        return self.executor.submit(
+            replace_document,
+            doc_id=doc_id,
+            file_name=file_name,
+            file_path=file_path,
+            strategy=strategy,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            embedder=self.embedder,
+            vector_db_pool=self.vector_db_pool,
+            process_pool=self.process_pool,
+            embedding_cache=self.embedding_cache,
+            page_store=self.page_store,
+        )
+
+    def submit_bulk(
+        self,
+        documents: List[Tuple[str, str, str]],
+        strategy: SplitStrategy = SplitStrategy.tiktoken,
+        chunk_size: int = 300,
+        chunk_overlap: int = 50,
+    ) -> List[Future]:
+        """Queue the documents of a bulk upload, their chunks are inserted together
+
+        :param List[Tuple[str, str, str]] documents: ID, name and spooled path of each pdf document
+        :param SplitStrategy strategy: Text splitting strategy, defaults to SplitStrategy.tiktoken
+        :param int chunk_size: Size of each chunk, defaults to 300
+        :param int chunk_overlap: Overlap between each chunks, defaults to 50
+        :return List[Future]: Future of each document, in order
+        """
+        return [
+            self.bulk_executor.submit(
+                ingest_document,
+                doc_id=doc_id,
+                file_name=file_name,
+                file_path=file_path,
+                strategy=strategy,
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                embedder=self.embedder,
+                vector_db_pool=self.vector_db_pool,
+                process_pool=self.process_pool,
+                embedding_cache=self.embedding_cache,
+                page_store=self.page_store,
+                insert_buffer=self.insert_buffer,
+            )
+            for doc_id, file_name, file_path in documents
+        ]
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting documents and wait for the running ingestions
+
+        :param bool wait: Block until queued documents are processed, defaults to True
+        """
+        self.executor.shutdown(wait=wait)
+        self.bulk_executor.shutdown(wait=wait)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=wait)
@@ -1,18 +1,162 @@
+import asyncio
+import logging
+import re
+import time
 from contextlib import asynccontextmanager
 
-from database.database import engine
-from database.models import Base
+from config import settings
+from database.database import create_tables, engine
+from executors import Executors
 from fastapi import FastAPI, Response, Request
 from fastapi.middleware.cors import CORSMiddleware
+from ingestion.workers import IngestionPool
+from metrics import REQUEST_SECONDS, REQUESTS_IN_PROGRESS
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from profiling import RequestProfiler
+from starlette.routing import Match
+from text_extracter.page_store import PageTextStore
 from routers.v1 import files, search
+from vector_search.answer_cache import SemanticAnswerCache
+from vector_search.embedding_cache import EmbeddingCache
+from vector_search.embedding_scheduler import EmbeddingScheduler
+from vector_search.index_profiles import index_profile_from_settings
+from vector_search.numpy_store import NumpyVectorStore
 from vector_search.text_embedders import TextEmbedding
+from vector_search.text_splitter import SplitStrategy, TextSplitter
+from vector_search.vector_store import SharedVectorStorePool, VectorStorePool
 
-Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
+
+
+def create_vector_db_pool() -> VectorStorePool:
+    """Create the vector store pool of the configured backend
+
+    :return VectorStorePool: Pool of Milvus clients or the shared in-process store
+    """
+    if settings.vector_store.backend == "numpy":
+        store = NumpyVectorStore(
+            dimension=settings.vector_store.dimension,
+            metric=settings.vector_store.metric,
+            path=settings.vector_store.path or None,
+        )
+        return SharedVectorStorePool(store)
+
+    # pymilvus and grpc are slow to import, only the Milvus backend needs them
+    from vector_search.milvus_pool import MilvusPool
+
+    return MilvusPool(
+        uri=settings.milvus.uri,
+        token=settings.milvus.token,
+        collection_name=settings.milvus.collection_name,
+        size=settings.milvus.pool_size,
+        health_check_interval=settings.milvus.health_check_interval,
+        acquire_timeout=settings.milvus.acquire_timeout,
+        index_profile=index_profile_from_settings(settings.milvus.index),
+    )
+
+
+def load_models(text_embedder: TextEmbedding, warm_up: bool = True):
+    """Load the models and, optionally, run a dummy batch through them
+
+    :param TextEmbedding text_embedder: TextEmbedder object to load
+    :param bool warm_up: Run a dummy batch through the models, defaults to True
+    """
+    start = time.perf_counter()
+    try:
+        text_embedder.load()
+        if warm_up:
+            text_embedder.warm_up()
+            TextSplitter(preprocessing=True).split(
+                SplitStrategy.tiktoken, "Warm up the text splitter.", 300, 50
+            )
+    except Exception:
+        logger.exception("Failed to load the models")
+        raise
+    logger.info("Models ready in %.1fs", time.perf_counter() - start)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    yield {"text_embedder": TextEmbedding()}
+    create_tables(engine)
+    text_embedder = TextEmbedding()
+    embedding_scheduler = None
+    if settings.embedding_scheduler.enabled:
+        embedding_scheduler = EmbeddingScheduler(
+            encode=text_embedder.encode,
+            max_batch_size=settings.embedding_scheduler.max_batch_size,
+            max_wait=settings.embedding_scheduler.max_wait_ms / 1000,
+        )
+        embedding_scheduler.start()
+        text_embedder.scheduler = embedding_scheduler
+    executors = Executors(
+        {
+            "embedding": settings.executors.embedding_workers,
+            "milvus": settings.executors.milvus_workers,
+        }
+    )
+    vector_db_pool = create_vector_db_pool()
+    answer_cache = SemanticAnswerCache(
+        threshold=settings.answer_cache.similarity_threshold,
+        max_size=settings.answer_cache.max_size,
+        ttl=settings.answer_cache.ttl,
+    )
+    embedding_cache = (
+        EmbeddingCache(
+            path=settings.embedding_cache.path,
+            model_id=text_embedder.model_id,
+            max_entries=settings.embedding_cache.max_entries,
+        )
+        if settings.embedding_cache.enabled
+        else None
+    )
+    page_store = (
+        PageTextStore(
+            path=settings.page_store.path,
+            compression_level=settings.page_store.compression_level,
+        )
+        if settings.page_store.enabled
+        else None
+    )
+    ingestion_pool = IngestionPool(
+        max_workers=settings.ingestion.max_workers,
+        embedder=text_embedder,
+        vector_db_pool=vector_db_pool,
+        processes=settings.ingestion.processes,
+        embedding_cache=embedding_cache,
+        page_store=page_store,
+        bulk_workers=settings.ingestion.bulk_workers,
+        bulk_insert_rows=settings.ingestion.bulk_insert_rows,
+    )
+    # Serve liveness right away, /ready turns healthy once the models are loaded
+    models_loaded = asyncio.create_task(
+        executors.run(
+            "embedding",
+            load_models,
+            text_embedder=text_embedder,
+            warm_up=settings.embedding.warm_up,
+        )
+    )
+    yield {
+        "models_loaded": models_loaded,
+        "text_embedder": text_embedder,
+        "vector_db_pool": vector_db_pool,
+        "answer_cache": answer_cache,
+        "executors": executors,
+        "ingestion_pool": ingestion_pool,
+        "embedding_scheduler": embedding_scheduler,
+        "page_store": page_store,
+    }
+    models_loaded.cancel()
+    # Let running ingestions finish their inserts before the clients go away
+    ingestion_pool.shutdown()
+    if embedding_scheduler is not None:
+        embedding_scheduler.close()
+    executors.shutdown()
+    vector_db_pool.close()
+    if embedding_cache is not None:
+        embedding_cache.close()
+    if page_store is not None:
+        page_store.close()
 
 
 tags_metadata = [
@@ -47,7 +191,67 @@ app.add_middleware(
 app.include_router(files.router)
 app.include_router(search.router)
 
+profiler = RequestProfiler(
+    sample_rate=settings.profiling.sample_rate,
+    backend=settings.profiling.backend,
+    output_dir=settings.profiling.output_dir,
+)
+
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """Time every request by route and profile a sample of them
+
+    :param Request request: Web request object
+    :param _type_ call_next: Rest of the application
+    :return _type_: Response of the route
+    """
+    # Resolve the route template up front, labels must not hold raw paths
+    route = next(
+        (r.path for r in app.routes if r.matches(request.scope)[0] == Match.FULL),
+        "unmatched",
+    )
+    in_progress = REQUESTS_IN_PROGRESS.labels(request.method, route)
+    in_progress.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        if profiler.sampled():
+            name = re.sub(r"\W+", "_", f"{request.method}{route}").strip("_")
+            with profiler.profile(name):
+                response = await call_next(request)
+        else:
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        in_progress.dec()
+        REQUEST_SECONDS.labels(request.method, route, str(status)).observe(
+            time.perf_counter() - start
+        )
+
 
 @app.get("/")
 async def health(request: Request):
     return Response("Server is running.")
+
+
+@app.get("/ready")
+async def ready(request: Request):
+    """Readiness probe, healthy once the models are loaded and warmed up
+
+    :param Request request: Web request object
+    :return _type_: 200 when ready, 503 while loading or if loading failed
+    """
+    models_loaded = request.state.models_loaded
+    if not models_loaded.done():
+        return Response("Loading models.", status_code=503)
+    if models_loaded.cancelled() or models_loaded.exception() is not None:
+        return Response("Failed to load the models.", status_code=503)
+    return Response("Server is ready.")
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Export the Prometheus metrics of the app process"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,78 @@
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Upload stages run for seconds and completions for tens of seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "document_qa_stage_seconds",
+    "Time spent in a stage of the ingestion or search pipeline",
+    ["stage"],
+    buckets=BUCKETS,
+)
+STAGE_ITEMS = Counter(
+    "document_qa_stage_items_total",
+    "Pages, chunks or vectors processed by a stage",
+    ["stage"],
+)
+STAGE_ERRORS = Counter(
+    "document_qa_stage_errors_total",
+    "Stage calls that raised",
+    ["stage"],
+)
+REQUEST_SECONDS = Histogram(
+    "document_qa_request_seconds",
+    "Time until the response headers of a request are sent",
+    ["method", "route", "status"],
+    buckets=BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "document_qa_requests_in_progress",
+    "Requests being handled",
+    ["method", "route"],
+)
+
+
+@contextmanager
+def observe_stage(stage: str, items: int = 0) -> Iterator[None]:
+    """Time a pipeline stage and count the items it processed
+
+    Stages running in the ingestion process pool are not exported, only the
+    metrics of the app process are.
+
+    :param str stage: Name of the stage
+    :param int items: Number of pages, chunks or vectors processed, defaults to 0
+    :yield Iterator[None]: Nothing, the stage runs in the with block
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+    if items:
+        STAGE_ITEMS.labels(stage).inc(items)
+
+
+def timed(stage: str) -> Callable:
+    """Decorator timing every call of a function as a pipeline stage
+
+    :param str stage: Name of the stage
+    :return Callable: Decorator
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with observe_stage(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
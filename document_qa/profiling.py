@@ -0,0 +1,86 @@
+import cProfile
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+# The profilers hook the interpreter, only one request is profiled at a time
+_active = threading.Lock()
+
+
+class RequestProfiler:
+    """Profiles a sample of the requests with cProfile or pyinstrument"""
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        backend: str = "cprofile",
+        output_dir: str = "profiles",
+    ) -> None:
+        """Initialise the profiler
+
+        :param float sample_rate: Fraction of the requests to profile, 0 disables profiling, defaults to 0.0
+        :param str backend: "cprofile" or "pyinstrument", defaults to "cprofile"
+        :param str output_dir: Directory the profiles are written to, defaults to "profiles"
+        :raises ValueError: Unknown backend
+        :raises ImportError: pyinstrument is selected but not installed
+        """
+        if backend not in ("cprofile", "pyinstrument"):
+            raise ValueError(f"Unknown profiler {backend}")
+        if backend == "pyinstrument" and sample_rate > 0:
+            import pyinstrument  # noqa: F401
+
+        self.sample_rate = sample_rate
+        self.backend = backend
+        self.output_dir = Path(output_dir)
+
+    def sampled(self) -> bool:
+        """Draw whether the next request is profiled
+
+        :return bool: Whether to profile the request
+        """
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        """Profile the with block unless another request is being profiled
+
+        cProfile only sees the event loop thread, work handed to the executors
+        shows up as waiting. pyinstrument attributes the awaits to the request.
+
+        :param str name: Name of the profile file, without extension
+        :yield Iterator[None]: Nothing, the profiled code runs in the with block
+        """
+        if not _active.acquire(blocking=False):
+            yield
+            return
+
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            stem = self.output_dir / f"{time.time_ns()}-{name}"
+            if self.backend == "pyinstrument":
+                from pyinstrument import Profiler
+
+                profiler = Profiler(async_mode="enabled")
+                profiler.start()
+                try:
+                    yield
+                finally:
+                    profiler.stop()
+                    stem.with_suffix(".html").write_text(profiler.output_html())
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+                    profiler.dump_stats(stem.with_suffix(".prof"))
+            logger.info("Wrote profile %s", stem)
+        finally:
+            _active.release()
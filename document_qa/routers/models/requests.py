@@ -1,8 +1,37 @@
-from typing import List
+from typing import Dict, List, Tuple
 
-from pydantic import BaseModel
+from config import settings
+from pydantic import BaseModel, Field
 
 
 class SearchItem(BaseModel):
     doc_id: str | List[str]
     question: str
+    # Recall and latency knobs, the ANN defaults of the index profile apply when unset
+    limit: int = Field(default=5, ge=1, le=100)
+    nprobe: int | None = Field(default=None, ge=1)
+    ef: int | None = Field(default=None, ge=1)
+
+    def search_params(self) -> Dict[str, int]:
+        """ANN search parameters set on the request
+
+        :return Dict[str, int]: nprobe and ef, when given
+        """
+        return {
+            name: value
+            for name, value in (("nprobe", self.nprobe), ("ef", self.ef))
+            if value is not None
+        }
+
+    def search_key(self) -> Tuple:
+        """Knobs changing the retrieved chunks, answers are only reused when they match
+
+        :return Tuple: Limit and the sorted ANN search parameters
+        """
+        return self.limit, tuple(sorted(self.search_params().items()))
+
+
+class BatchSearchItem(BaseModel):
+    items: List[SearchItem] = Field(
+        min_length=1, max_length=settings.search.batch_max_items
+    )
@@ -6,3 +6,9 @@ from pydantic import BaseModel
 class SearchResult(BaseModel):
     generated_answer: str
     sources: List[str]
+    context_tokens: int | None = None
+    tokens_saved: int | None = None
+
+
+class BatchSearchResult(BaseModel):
+    results: List[SearchResult]
@@ -1,21 +1,15 @@
-from vector_search.milvus_client import Milvus
-from config import settings
 from database.database import SessionLocal
+from fastapi import Request
 
 
-async def get_db():
-    """Create Milvus database session
+def get_db(request: Request):
+    """Borrow a vector store client from the app wide pool
 
+    :param Request request: Client Request
     :yield _type_: database session
     """
-    COLLECTION_NAME = settings.milvus.collection_name
-    URI = settings.milvus.uri
-    TOKEN = settings.milvus.token
-    db = Milvus(uri=URI, token=TOKEN, collection_name=COLLECTION_NAME)
-    try:
+    with request.state.vector_db_pool.acquire() as db:
         yield db
-    finally:
-        db.close_connection()
 
 
 def get_sql_db():
@@ -1,11 +1,34 @@
-from database.crud import create_document_item, get_all_documents
-from database.schemas import DocumentBase, Item
-from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile
+import asyncio
+import shutil
+import uuid
+import zipfile
+from dataclasses import asdict
+from pathlib import Path
+from typing import BinaryIO, List, Tuple
+
+from config import settings
+from database.crud import (
+    create_document_item,
+    create_document_items,
+    delete_page_hashes,
+    get_all_documents,
+    get_document,
+    update_document_item,
+)
+from database.schemas import (
+    BulkFileStatus,
+    BulkUploadResult,
+    DocumentBase,
+    DocumentStatus,
+    Item,
+    ReplaceResult,
+)
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, UploadFile
 from routers.v1.dependencies import get_db, get_sql_db
 from sqlalchemy.orm import Session
-from text_extracter.pdf_miners import extract_text
-from vector_search.milvus_client import Milvus
-from vector_search.text_splitter import TextSplitter
+from starlette.concurrency import run_in_threadpool
+from vector_search.text_splitter import SplitStrategy, check_split_params
+from vector_search.vector_store import DOCUMENT_NAME_MAX_LENGTH, VectorStore
 
 router = APIRouter(
     prefix="/files",
@@ -25,56 +48,356 @@ async def list_files(db: Session = Depends(get_sql_db)):
     return documents
 
 
-@router.post("/", response_model=Item)
+def _document_name(file_name: str | None) -> str:
+    """Name stored with the chunks, shortened to fit the vector store schema
+
+    :param str | None file_name: Name of the uploaded file
+    :return str: Name of at most DOCUMENT_NAME_MAX_LENGTH characters, keeping the extension
+    """
+    name = file_name or ""
+    if len(name) <= DOCUMENT_NAME_MAX_LENGTH:
+        return name
+    suffix = Path(name).suffix[:DOCUMENT_NAME_MAX_LENGTH]
+    return name[: DOCUMENT_NAME_MAX_LENGTH - len(suffix)] + suffix
+
+
+def _check_chunking(strategy: SplitStrategy, chunk_size: int, chunk_overlap: int):
+    """Reject split parameters the splitter would fail on, before anything is stored
+
+    :param SplitStrategy strategy: Text splitting strategy
+    :param int chunk_size: Size of each chunk, in the unit of the strategy
+    :param int chunk_overlap: Overlap between each chunks
+    :raises HTTPException: If the overlap is not smaller than the chunk size the strategy uses
+    """
+    try:
+        check_split_params(strategy, chunk_size, chunk_overlap)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def _spool_upload(src: BinaryIO, path: Path):
+    """Copy an uploaded file to disk in fixed size blocks, removing the partial copy if reading fails
+
+    :param BinaryIO src: Uploaded file or archive member
+    :param Path path: Destination of the file
+    """
+    try:
+        with open(path, "wb") as dst:
+            shutil.copyfileobj(src, dst, length=1024 * 1024)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+
+
+@router.post("/", response_model=DocumentStatus, status_code=202)
 async def upload_file(
     request: Request,
     file: UploadFile,
-    vector_db: Milvus = Depends(get_db),
+    strategy: SplitStrategy = SplitStrategy.tiktoken,
+    chunk_size: int = Query(300, gt=0),
+    chunk_overlap: int = Query(50, ge=0),
     db: Session = Depends(get_sql_db),
 ):
-    """Upload a new document and performs extracting text and uploading it to Milvus db
+    """Upload a new document and queue it for text extraction and uploading it to Milvus db
 
     :param Request request: Client Request
     :param UploadFile file: Uplaoded file object
-    :param Milvus vector_db: Milvus client session, defaults to Depends(get_db)
+    :param SplitStrategy strategy: Text splitting strategy, defaults to SplitStrategy.tiktoken
+    :param int chunk_size: Size of each chunk, in the unit of the strategy, defaults to 300
+    :param int chunk_overlap: Overlap between each chunks, defaults to 50
     :param Session db: SQLite db session, defaults to Depends(get_sql_db)
-    :return _type_: Returns document name, id, processed status
+    :return _type_: Returns document name, id (the job id) and ingestion status
     """
+    _check_chunking(strategy, chunk_size, chunk_overlap)
+
     # Store the document information in SQL
-    item = DocumentBase(file_name=file.filename)
+    item = DocumentBase(file_name=_document_name(file.filename))
     result = create_document_item(db=db, item=item)
 
-    # Extract text and store embeddings in vector db
-    pdf_content: bytes = await file.read()
-    ts = TextSplitter(preprocessing=True)
-    text_splitter = ts.tiktoken_split_by_token
-    params = {"chunk_size": 300, "chunk_overlap": 50}
-    text = extract_text(
-        file_name=file.filename,
-        file_content=pdf_content,
-        doc_id=result.id,
-        text_splitter=text_splitter,
-        params=params,
-        embedder=request.state.text_embedder,
-    )
-    res = vector_db.insert_to_collection(data=text)
+    # Spool the upload to disk, the worker reads the pages from there
+    spool_path = Path(settings.ingestion.spool_dir) / f"{result.id}.pdf"
+    try:
+        await run_in_threadpool(_spool_upload, file.file, spool_path)
+
+        # Extract text and store embeddings in vector db in the background
+        job = request.state.ingestion_pool.submit(
+            doc_id=result.id,
+            file_name=result.file_name,
+            file_path=str(spool_path),
+            strategy=strategy,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+        )
+    except BaseException as e:
+        # No worker will ever pick the document up
+        spool_path.unlink(missing_ok=True)
+        update_document_item(
+            db=db, document_id=result.id, status="failed", error=f"Upload failed: {e}"
+        )
+        raise
+    # Answers generated while the document was partially ingested are stale
+    doc_id, answer_cache = result.id, request.state.answer_cache
+    job.add_done_callback(lambda _: answer_cache.invalidate(doc_id))
 
     return result
 
 
+def _unlink_spooled(entries: List[Tuple[str, Path | None, str | None]]):
+    """Remove the spooled files of bulk upload entries
+
+    :param List[Tuple[str, Path | None, str | None]] entries: Name, spooled path or None, and rejection reason of each file
+    """
+    for _, path, _ in entries:
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+
+def _spool_bulk_upload(file: UploadFile) -> List[Tuple[str, Path | None, str | None]]:
+    """Spool a pdf file, or the pdf files of a zip archive, of a bulk upload
+
+    Files that cannot be read, like corrupt or truncated archive members,
+    are rejected on their own, the other files are still spooled.
+
+    :param UploadFile file: Uploaded pdf file or zip archive
+    :return List[Tuple[str, Path | None, str | None]]: Name, spooled path or None, and rejection reason of each file
+    """
+    spool_dir = Path(settings.ingestion.spool_dir)
+    name = file.filename or ""
+    if name.lower().endswith(".pdf"):
+        path = spool_dir / f"bulk-{uuid.uuid4()}.pdf"
+        try:
+            _spool_upload(file.file, path)
+        except Exception as e:
+            return [(name, None, f"Could not be read: {e}")]
+        return [(name, path, None)]
+    if not name.lower().endswith(".zip"):
+        return [(name, None, "Only pdf files and zip archives are accepted")]
+
+    try:
+        archive = zipfile.ZipFile(file.file)
+    except (zipfile.BadZipFile, OSError):
+        return [(name, None, "Not a valid zip archive")]
+    entries = []
+    try:
+        with archive:
+            members = [
+                info
+                for info in archive.infolist()
+                if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+            ]
+            pdfs = [info for info in members if info.filename.lower().endswith(".pdf")]
+            if len(pdfs) > settings.ingestion.max_archive_files:
+                return [
+                    (
+                        name,
+                        None,
+                        f"More than {settings.ingestion.max_archive_files} files",
+                    )
+                ]
+            # The declared sizes bound what is extracted, whatever the compression ratio
+            if (
+                sum(info.file_size for info in pdfs)
+                > settings.ingestion.max_archive_bytes
+            ):
+                return [
+                    (
+                        name,
+                        None,
+                        f"More than {settings.ingestion.max_archive_bytes} bytes",
+                    )
+                ]
+
+            for info in members:
+                member_name = Path(info.filename).name
+                if not info.filename.lower().endswith(".pdf"):
+                    entries.append((member_name, None, "Not a pdf file"))
+                    continue
+                path = spool_dir / f"bulk-{uuid.uuid4()}.pdf"
+                # Corrupt members raise BadZipFile, zlib.error, EOFError or
+                # OSError, encrypted ones RuntimeError
+                try:
+                    with archive.open(info) as src:
+                        _spool_upload(src, path)
+                except Exception as e:
+                    entries.append((member_name, None, f"Could not be extracted: {e}"))
+                    continue
+                entries.append((member_name, path, None))
+    except BaseException:
+        _unlink_spooled(entries)
+        raise
+    return entries
+
+
+@router.post("/bulk", response_model=BulkUploadResult, status_code=202)
+async def upload_files(
+    request: Request,
+    files: List[UploadFile],
+    strategy: SplitStrategy = SplitStrategy.tiktoken,
+    chunk_size: int = Query(300, gt=0),
+    chunk_overlap: int = Query(50, ge=0),
+    db: Session = Depends(get_sql_db),
+):
+    """Upload many documents, as pdf files or zip archives of pdf files, and queue them together
+
+    The documents are recorded in a single transaction and ingested by the
+    bulk workers, their chunks are inserted in the vector store together.
+
+    :param Request request: Client Request
+    :param List[UploadFile] files: Uploaded pdf files and zip archives
+    :param SplitStrategy strategy: Text splitting strategy, defaults to SplitStrategy.tiktoken
+    :param int chunk_size: Size of each chunk, in the unit of the strategy, defaults to 300
+    :param int chunk_overlap: Overlap between each chunks, defaults to 50
+    :param Session db: SQLite db session, defaults to Depends(get_sql_db)
+    :return _type_: Name, id and status of each file, poll /files/{id}/status for progress
+    """
+    _check_chunking(strategy, chunk_size, chunk_overlap)
+
+    # Nothing spooled is kept if the request fails before the documents are queued
+    entries = []
+    try:
+        for file in files:
+            entries.extend(await run_in_threadpool(_spool_bulk_upload, file))
+        accepted = [
+            (_document_name(name), path)
+            for name, path, _ in entries
+            if path is not None
+        ]
+        documents = create_document_items(
+            db=db, items=[DocumentBase(file_name=name) for name, _ in accepted]
+        )
+    except BaseException:
+        _unlink_spooled(entries)
+        raise
+
+    jobs = request.state.ingestion_pool.submit_bulk(
+        documents=[
+            (document.id, name, str(path))
+            for document, (name, path) in zip(documents, accepted)
+        ],
+        strategy=strategy,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+    answer_cache = request.state.answer_cache
+    for document, job in zip(documents, jobs):
+        job.add_done_callback(
+            lambda _, doc_id=document.id: answer_cache.invalidate(doc_id)
+        )
+
+    queued = iter(documents)
+    statuses = []
+    for name, path, error in entries:
+        if path is None:
+            statuses.append(
+                BulkFileStatus(file_name=name, status="rejected", error=error)
+            )
+            continue
+        document = next(queued)
+        statuses.append(
+            BulkFileStatus(file_name=name, id=document.id, status=document.status)
+        )
+    return BulkUploadResult(
+        files=statuses,
+        queued=len(documents),
+        rejected=len(entries) - len(documents),
+    )
+
+
+@router.get("/{doc_id}/status", response_model=DocumentStatus)
+async def file_status(doc_id: str, db: Session = Depends(get_sql_db)):
+    """Get the ingestion status of a document
+
+    :param str doc_id: ID of the document
+    :param Session db: SQLite db session, defaults to Depends(get_sql_db)
+    :return _type_: Processed status, progress and error of the ingestion
+    """
+    document = get_document(db=db, document_id=doc_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return document
+
+
+@router.put("/{doc_id}", response_model=ReplaceResult)
+async def replace_file(
+    request: Request,
+    doc_id: str,
+    file: UploadFile,
+    strategy: SplitStrategy = SplitStrategy.tiktoken,
+    chunk_size: int = Query(300, gt=0),
+    chunk_overlap: int = Query(50, ge=0),
+    db: Session = Depends(get_sql_db),
+):
+    """Replace a document with a new revision, re-embedding only the pages that changed
+
+    :param Request request: Client Request
+    :param str doc_id: ID of the document to replace
+    :param UploadFile file: Uploaded file object of the new revision
+    :param SplitStrategy strategy: Text splitting strategy, defaults to SplitStrategy.tiktoken
+    :param int chunk_size: Size of each chunk, in the unit of the strategy, defaults to 300
+    :param int chunk_overlap: Overlap between each chunks, defaults to 50
+    :param Session db: SQLite db session, defaults to Depends(get_sql_db)
+    :return _type_: Pages added, changed, removed and unchanged, and the timings
+    """
+    # The old chunks are deleted before the new revision is split
+    _check_chunking(strategy, chunk_size, chunk_overlap)
+    document = get_document(db=db, document_id=doc_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if document.status in ("queued", "processing"):
+        raise HTTPException(status_code=409, detail="Document is being ingested")
+    # Claimed before spooling, so a concurrent replacement gets a conflict
+    status = document.status
+    update_document_item(db=db, document_id=doc_id, status="queued")
+
+    spool_path = Path(settings.ingestion.spool_dir) / f"{doc_id}.pdf"
+    try:
+        await run_in_threadpool(_spool_upload, file.file, spool_path)
+        job = request.state.ingestion_pool.replace(
+            doc_id=doc_id,
+            file_name=_document_name(file.filename),
+            file_path=str(spool_path),
+            strategy=strategy,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+        )
+    except BaseException:
+        # The current revision is untouched, it is released for later replacements
+        spool_path.unlink(missing_ok=True)
+        update_document_item(db=db, document_id=doc_id, status=status)
+        raise
+    try:
+        summary = await asyncio.wrap_future(job)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Replace failed: {e}")
+    finally:
+        request.state.answer_cache.invalidate(doc_id)
+    return asdict(summary)
+
+
 @router.delete("/{doc_id}")
 async def delete_file(
-    doc_id: str, vector_db: Milvus = Depends(get_db), db: Session = Depends(get_sql_db)
+    request: Request,
+    doc_id: str,
+    vector_db: VectorStore = Depends(get_db),
+    db: Session = Depends(get_sql_db),
 ):
     """Delete a document from the db
 
+    :param Request request: Client Request
     :param str doc_id: ID of the document to delete
-    :param Milvus vector_db: Milvus db client, defaults to Depends(get_db)
+    :param VectorStore vector_db: Vector store client, defaults to Depends(get_db)
     :param Session db: SQLite db session, defaults to Depends(get_sql_db)
     :return _type_: status of the operation
     """
     try:
-        vector_db.delete_entity(doc_id=doc_id)
+        await request.state.executors.run(
+            "milvus", vector_db.delete_entity, doc_id=doc_id
+        )
+        # A later revision must not find the deleted pages up to date
+        delete_page_hashes(db=db, document_id=doc_id)
+        if request.state.page_store is not None:
+            request.state.page_store.delete(doc_id=doc_id)
+        request.state.answer_cache.invalidate(doc_id)
         return {"message": "success"}
     except Exception:
         return HTTPException(status_code=500)
@@ -1,8 +1,18 @@
+import asyncio
+import json
+from typing import AsyncIterator, Dict, List, Tuple
+
+from config import settings
 from fastapi import APIRouter, Depends, HTTPException, Request
-from routers.models.requests import SearchItem
-from routers.models.response import SearchResult
+from fastapi.responses import StreamingResponse
+from routers.models.requests import BatchSearchItem, SearchItem
+from routers.models.response import BatchSearchResult, SearchResult
 from routers.v1.dependencies import get_db
-from vector_search.milvus_client import Milvus
+from vector_search.answer_cache import SemanticAnswerCache
+from vector_search.context_builder import BuiltContext
+from vector_search.llm_client import LLMUnavailableError
+from vector_search.text_embedders import TextEmbedding
+from vector_search.vector_store import VectorStore
 
 router = APIRouter(
     prefix="/search",
@@ -11,28 +21,309 @@ router = APIRouter(
 )
 
 
+async def _embed_questions(request: Request, questions: List[str]) -> List[List[float]]:
+    """Vectorise questions, batched with the other requests when the scheduler runs
+
+    :param Request request: Web request object
+    :param List[str] questions: Questions to vectorise
+    :return List[List[float]]: Vectorised questions, in the same order as the input
+    """
+    text_embedder = request.state.text_embedder
+    if text_embedder.scheduler is not None:
+        return await text_embedder.aembed_queries(questions)
+    return await request.state.executors.run(
+        "embedding", text_embedder.embed_queries, questions
+    )
+
+
 @router.post("/", response_model=SearchResult)
 async def vector_search(
-    request: Request, item: SearchItem, vector_db: Milvus = Depends(get_db)
+    request: Request, item: SearchItem, vector_db: VectorStore = Depends(get_db)
 ):
     """Perform vector serach and generate LLM response
 
     :param Request request: Web request object
     :param SearchItem item: Document id and question
-    :param Milvus vector_db: Milvus client session, defaults to Depends(get_db)
+    :param VectorStore vector_db: Vector store client session, defaults to Depends(get_db)
     :return _type_: Generated response and source for the response
     """
-    question_embedding = request.state.text_embedder.embed_query(item.question)
-    results = vector_db.vector_search(
-        question_embedding=question_embedding, doc_id=item.doc_id
+    executors = request.state.executors
+    question_embedding = await _embed_questions(request, [item.question])
+
+    # Reuse the answer of a similar question over the same documents
+    answer_cache = request.state.answer_cache
+    generation = answer_cache.generation(item.doc_id)
+    cached = answer_cache.lookup(
+        question_embedding[0], item.doc_id, params=item.search_key()
+    )
+    if cached is not None:
+        generated_response, source = cached
+        return SearchResult(generated_answer=generated_response, sources=source)
+
+    results = await executors.run(
+        "milvus",
+        vector_db.vector_search,
+        question_embedding=question_embedding,
+        limit=item.limit,
+        doc_id=item.doc_id,
+        include_embeddings=settings.context.mmr,
+        search_params=item.search_params(),
     )
 
     # Get the context and source from the returned results
-    source, context = request.state.text_embedder.get_context_source(entities=results)
+    built = await executors.run(
+        "embedding",
+        request.state.text_embedder.build_context,
+        entities=results,
+        query_embedding=question_embedding[0],
+    )
 
     # Call the LLM to generate the answer
-    generated_response = request.state.text_embedder.generate_response(
-        question=item.question, context=context
+    try:
+        generated_response = await request.state.text_embedder.generate_response(
+            question=item.question, context=built.context
+        )
+    except LLMUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    answer_cache.store(
+        question_embedding[0],
+        item.doc_id,
+        generated_response,
+        built.sources,
+        params=item.search_key(),
+        generation=generation,
+    )
+
+    return SearchResult(
+        generated_answer=generated_response,
+        sources=built.sources,
+        context_tokens=built.tokens,
+        tokens_saved=built.tokens_saved,
+    )
+
+
+def _sse_event(event: str, data: Dict) -> str:
+    """Format a Server-Sent Event
+
+    :param str event: Name of the event
+    :param Dict data: JSON serialisable payload of the event
+    :return str: Event in the text/event-stream format
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _stream_answer(
+    item: SearchItem,
+    question_embedding: List[float],
+    built: BuiltContext,
+    text_embedder: TextEmbedding,
+    answer_cache: SemanticAnswerCache,
+    generation: Tuple[int, ...],
+) -> AsyncIterator[str]:
+    """Stream the sources, the completion deltas and a summary as SSE events
+
+    :param SearchItem item: Document id and question
+    :param List[float] question_embedding: Vectorised question
+    :param BuiltContext built: Relevant context to the question and its sources
+    :param TextEmbedding text_embedder: TextEmbedder object to generate the answer
+    :param SemanticAnswerCache answer_cache: Cache the finished answer is stored in
+    :param Tuple[int, ...] generation: Generation of the documents captured before the cache lookup
+    :yield AsyncIterator[str]: SSE events
+    """
+    yield _sse_event("sources", {"sources": built.sources})
+
+    deltas = []
+    try:
+        async for delta in text_embedder.stream_response(
+            question=item.question, context=built.context
+        ):
+            deltas.append(delta)
+            yield _sse_event("delta", {"content": delta})
+    except Exception as e:
+        yield _sse_event("error", {"detail": str(e)})
+        return
+
+    generated_response = "".join(deltas)
+    answer_cache.store(
+        question_embedding,
+        item.doc_id,
+        generated_response,
+        built.sources,
+        params=item.search_key(),
+        generation=generation,
     )
+    yield _sse_event(
+        "done",
+        SearchResult(
+            generated_answer=generated_response,
+            sources=built.sources,
+            context_tokens=built.tokens,
+            tokens_saved=built.tokens_saved,
+        ).model_dump(),
+    )
+
+
+@router.post("/stream")
+async def stream_vector_search(
+    request: Request, item: SearchItem, vector_db: VectorStore = Depends(get_db)
+):
+    """Perform vector search and stream the LLM response as Server-Sent Events
+
+    The stream starts with a `sources` event, followed by one `delta` event
+    per completion chunk and ends with a `done` event holding the full
+    SearchResult. A failing completion ends the stream with an `error` event.
+
+    :param Request request: Web request object
+    :param SearchItem item: Document id and question
+    :param VectorStore vector_db: Vector store client session, defaults to Depends(get_db)
+    :return _type_: text/event-stream response
+    """
+    text_embedder = request.state.text_embedder
+    answer_cache = request.state.answer_cache
+    executors = request.state.executors
+    question_embedding = await _embed_questions(request, [item.question])
+
+    generation = answer_cache.generation(item.doc_id)
+    cached = answer_cache.lookup(
+        question_embedding[0], item.doc_id, params=item.search_key()
+    )
+    if cached is not None:
+        generated_response, source = cached
+        events = [
+            _sse_event("sources", {"sources": source}),
+            _sse_event("delta", {"content": generated_response}),
+            _sse_event(
+                "done",
+                SearchResult(
+                    generated_answer=generated_response, sources=source
+                ).model_dump(),
+            ),
+        ]
+        return StreamingResponse(iter(events), media_type="text/event-stream")
+
+    # Search before streaming, the Milvus client goes back to the pool with the dependency
+    results = await executors.run(
+        "milvus",
+        vector_db.vector_search,
+        question_embedding=question_embedding,
+        limit=item.limit,
+        doc_id=item.doc_id,
+        include_embeddings=settings.context.mmr,
+        search_params=item.search_params(),
+    )
+    built = await executors.run(
+        "embedding",
+        text_embedder.build_context,
+        entities=results,
+        query_embedding=question_embedding[0],
+    )
+
+    return StreamingResponse(
+        _stream_answer(
+            item=item,
+            question_embedding=question_embedding[0],
+            built=built,
+            text_embedder=text_embedder,
+            answer_cache=answer_cache,
+            generation=generation,
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/batch", response_model=BatchSearchResult)
+async def batch_vector_search(
+    request: Request, batch: BatchSearchItem, vector_db: VectorStore = Depends(get_db)
+):
+    """Answer many questions at once
+
+    The questions are vectorised with a single model call, searched with one
+    vector store call per document set and search knobs, and answered
+    concurrently, with at most search.batch_llm_concurrency completions in
+    flight.
+
+    :param Request request: Web request object
+    :param BatchSearchItem batch: Document ids and questions
+    :param VectorStore vector_db: Vector store client session, defaults to Depends(get_db)
+    :return _type_: Generated response and source of each question, in input order
+    """
+    text_embedder = request.state.text_embedder
+    answer_cache = request.state.answer_cache
+    executors = request.state.executors
+    items = batch.items
+
+    question_embeddings = await _embed_questions(
+        request, [item.question for item in items]
+    )
+
+    # Answer from the cache where possible, group the rest by document set and search knobs
+    results: List[SearchResult | None] = [None] * len(items)
+    groups: Dict[Tuple, List[int]] = {}
+    generations = [answer_cache.generation(item.doc_id) for item in items]
+    for position, item in enumerate(items):
+        cached = answer_cache.lookup(
+            question_embeddings[position], item.doc_id, params=item.search_key()
+        )
+        if cached is not None:
+            generated_response, source = cached
+            results[position] = SearchResult(
+                generated_answer=generated_response, sources=source
+            )
+        else:
+            key = (answer_cache.doc_key(item.doc_id), *item.search_key())
+            groups.setdefault(key, []).append(position)
+
+    contexts: Dict[int, BuiltContext] = {}
+    for (doc_ids, limit, search_params), positions in groups.items():
+        hits = await executors.run(
+            "milvus",
+            vector_db.vector_search,
+            question_embedding=[question_embeddings[p] for p in positions],
+            limit=limit,
+            doc_id=list(doc_ids),
+            include_embeddings=settings.context.mmr,
+            search_params=dict(search_params),
+        )
+        built = await asyncio.gather(
+            *(
+                executors.run(
+                    "embedding",
+                    text_embedder.build_context,
+                    entities=[entities],
+                    query_embedding=question_embeddings[position],
+                )
+                for position, entities in zip(positions, hits)
+            )
+        )
+        contexts.update(zip(positions, built))
+
+    semaphore = asyncio.Semaphore(settings.search.batch_llm_concurrency)
+
+    async def answer(position: int):
+        built = contexts[position]
+        async with semaphore:
+            generated_response = await text_embedder.generate_response(
+                question=items[position].question, context=built.context
+            )
+        answer_cache.store(
+            question_embeddings[position],
+            items[position].doc_id,
+            generated_response,
+            built.sources,
+            params=items[position].search_key(),
+            generation=generations[position],
+        )
+        results[position] = SearchResult(
+            generated_answer=generated_response,
+            sources=built.sources,
+            context_tokens=built.tokens,
+            tokens_saved=built.tokens_saved,
+        )
+
+    try:
+        await asyncio.gather(*(answer(position) for position in contexts))
+    except LLMUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
-    return SearchResult(generated_answer=generated_response, sources=source)
+    return BatchSearchResult(results=results)
@@ -0,0 +1,134 @@
+import sqlite3
+import threading
+import zlib
+from typing import Dict, Iterator, List, Tuple
+
+# Keeps the number of bound parameters under SQLite's limit
+_QUERY_BATCH = 500
+
+
+class PageTextStore:
+    """Compressed store of the normalised text of every page, keyed by document and page number
+
+    Documents can be split again with another configuration from this store,
+    without the original pdf and without parsing or normalising it again.
+    """
+
+    def __init__(self, path: str, compression_level: int = 6) -> None:
+        """Open or create the store database
+
+        :param str path: Path of the SQLite database
+        :param int compression_level: zlib level of the page texts, 1 (fastest) to 9 (smallest), defaults to 6
+        """
+        self.compression_level = compression_level
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages (doc_id TEXT NOT NULL, "
+            "page_number INTEGER NOT NULL, text BLOB NOT NULL, "
+            "PRIMARY KEY (doc_id, page_number))"
+        )
+        self._conn.commit()
+
+    def put_many(self, doc_id: str, pages: Dict[int, str]):
+        """Store the text of many pages of a document, replacing older versions
+
+        :param str doc_id: ID of the document
+        :param Dict[int, str] pages: Normalised text, by page number
+        """
+        rows = [
+            (
+                doc_id,
+                page_number,
+                zlib.compress(text.encode(), self.compression_level),
+            )
+            for page_number, text in pages.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pages (doc_id, page_number, text) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def iter_pages(
+        self, doc_id: str, page_numbers: List[int] | None = None
+    ) -> Iterator[Tuple[int, str]]:
+        """Read the pages of a document in page order, one at a time
+
+        :param str doc_id: ID of the document
+        :param List[int] | None page_numbers: Pages to read, defaults to None (every page)
+        :yield Iterator[Tuple[int, str]]: Page number and normalised text
+        """
+        with self._lock:
+            numbers = [
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT page_number FROM pages WHERE doc_id = ? ORDER BY page_number",
+                    (doc_id,),
+                )
+            ]
+        if page_numbers is not None:
+            wanted = set(page_numbers)
+            numbers = [number for number in numbers if number in wanted]
+
+        # Only a batch of compressed pages is held at once
+        for start in range(0, len(numbers), _QUERY_BATCH):
+            batch = numbers[start : start + _QUERY_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT page_number, text FROM pages WHERE doc_id = ? "
+                    f"AND page_number IN ({placeholders}) ORDER BY page_number",
+                    [doc_id, *batch],
+                ).fetchall()
+            for page_number, text in rows:
+                yield page_number, zlib.decompress(text).decode()
+
+    def documents(self) -> List[str]:
+        """IDs of the documents with stored pages
+
+        :return List[str]: Document ids
+        """
+        with self._lock:
+            return [
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT DISTINCT doc_id FROM pages ORDER BY doc_id"
+                )
+            ]
+
+    def delete(self, doc_id: str, page_numbers: List[int] | None = None):
+        """Delete the pages of a document
+
+        :param str doc_id: ID of the document
+        :param List[int] | None page_numbers: Pages to delete, defaults to None (every page)
+        """
+        with self._lock:
+            if page_numbers is None:
+                self._conn.execute("DELETE FROM pages WHERE doc_id = ?", (doc_id,))
+            else:
+                self._conn.executemany(
+                    "DELETE FROM pages WHERE doc_id = ? AND page_number = ?",
+                    [(doc_id, page_number) for page_number in page_numbers],
+                )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """Number of pages and bytes stored
+
+        :return Dict[str, int]: Documents, pages and compressed bytes
+        """
+        with self._lock:
+            documents, pages, size = self._conn.execute(
+                "SELECT COUNT(DISTINCT doc_id), COUNT(*), COALESCE(SUM(LENGTH(text)), 0) "
+                "FROM pages"
+            ).fetchone()
+        return {"documents": documents, "pages": pages, "compressed_bytes": size}
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
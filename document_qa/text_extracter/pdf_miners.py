@@ -1,10 +1,446 @@
+import hashlib
+import logging
+import math
+import time
+from collections import deque
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
 from io import BytesIO
-from pathlib import Path
-from typing import Callable, Dict, List
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 
 import fitz
+from metrics import STAGE_ITEMS, observe_stage
+from text_extracter.page_store import PageTextStore
+from vector_search.embedding_cache import EmbeddingCache
 from vector_search.text_embedders import TextEmbedding
 
+logger = logging.getLogger(__name__)
+
+# Pages written to the page store at once
+PAGE_STORE_BATCH = 32
+
+
+@dataclass
+class ExtractionStats:
+    """Counters collected while ingesting a single document"""
+
+    total_pages: int = 0
+    pages: int = 0
+    chunks: int = 0
+    cache_hits: int = 0
+    embedding_seconds: float = 0.0
+    total_seconds: float = 0.0
+    # Text hash of every extracted page, by page number
+    page_hashes: Dict[int, str] = field(default_factory=dict)
+
+    @property
+    def chunks_per_second(self) -> float:
+        """Embedding throughput of the document
+
+        :return float: Number of chunks embedded per second
+        """
+        if not self.embedding_seconds:
+            return 0.0
+        return self.chunks / self.embedding_seconds
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        """Share of the chunks whose embedding came from the embedding cache
+
+        :return float: Cache hit ratio between 0 and 1
+        """
+        if not self.chunks:
+            return 0.0
+        return self.cache_hits / self.chunks
+
+
+def shard_pages(start: int, stop: int, shards: int) -> List[Tuple[int, int]]:
+    """Split a page range into contiguous, evenly sized shards
+
+    :param int start: Index of the first page
+    :param int stop: Index after the last page
+    :param int shards: Number of shards to create
+    :return List[Tuple[int, int]]: (start, stop) page index range of each shard, in page order
+    """
+    total = max(stop - start, 0)
+    shards = max(min(shards, total), 1)
+    size, remainder = divmod(total, shards)
+
+    ranges = []
+    for shard in range(shards):
+        stop = start + size + (1 if shard < remainder else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def hash_page_text(text: str) -> str:
+    """Fingerprint of a page, insensitive to whitespace and layout changes
+
+    :param str text: Raw text of the page
+    :return str: sha256 hex digest of the whitespace normalised text
+    """
+    return hashlib.sha256(" ".join(text.split()).encode()).hexdigest()
+
+
+def _open_pdf(file: str | bytes) -> fitz.Document:
+    """Open a pdf from its path, or from its content
+
+    :param str | bytes file: Path of the pdf document, or the pdf document object
+    :return fitz.Document: Opened pdf document
+    """
+    if isinstance(file, bytes):
+        return fitz.open(filetype="pdf", stream=BytesIO(file))
+    return fitz.open(file, filetype="pdf")
+
+
+def hash_pages(file: str | bytes) -> Dict[int, str]:
+    """Hash the text of every page of a pdf, without splitting or embedding it
+
+    :param str | bytes file: Path of the pdf document, or the pdf document object
+    :return Dict[int, str]: Text hash, by page number
+    """
+    page_hashes = {}
+    with _open_pdf(file) as doc:
+        for page_index in range(doc.page_count):
+            with observe_stage("pdf_parse", items=1):
+                text = doc[page_index].get_text("text")
+            page_hashes[page_index + 1] = hash_page_text(text)
+    return page_hashes
+
+
+def _iter_page_chunks(
+    doc: fitz.Document,
+    text_splitter: Callable,
+    params: Dict,
+    pages: Tuple[int, int],
+    normalize: Callable[[str], str] | None = None,
+) -> Iterator[Tuple[int, str, List[str], str]]:
+    """Extract and split the text of a range of pages
+
+    :param fitz.Document doc: Opened pdf document
+    :param Callable text_splitter: Langchain text splitter function
+    :param Dict params: Any parameters for the text splitter function
+    :param Tuple[int, int] pages: (start, stop) page index range
+    :param Callable[[str], str] | None normalize: Normalises the page text before splitting, defaults to None
+    :yield Iterator[Tuple[int, str, List[str], str]]: Page number, hash of the raw text, chunks and text that was split
+    """
+    for page_index in range(*pages):
+        with observe_stage("pdf_parse", items=1):
+            text = doc[page_index].get_text("text")
+        text_hash = hash_page_text(text)
+        if normalize is not None:
+            text = normalize(text)
+        yield page_index + 1, text_hash, text_splitter(text=text, **params), text
+
+
+def split_page_range(
+    file: str | bytes,
+    text_splitter: Callable,
+    params: Dict,
+    pages: Tuple[int, int],
+    normalize: Callable[[str], str] | None = None,
+) -> List[Tuple[int, str, List[str], str]]:
+    """Open a pdf and extract and split a range of its pages, used by the process pool workers
+
+    :param str | bytes file: Path of the pdf document, or the pdf document object
+    :param Callable text_splitter: Langchain text splitter function
+    :param Dict params: Any parameters for the text splitter function
+    :param Tuple[int, int] pages: (start, stop) page index range
+    :param Callable[[str], str] | None normalize: Normalises the page text before splitting, defaults to None
+    :return List[Tuple[int, str, List[str], str]]: Page number, hash of the raw text, chunks and text that was split, in page order
+    """
+    with _open_pdf(file) as doc:
+        return list(_iter_page_chunks(doc, text_splitter, params, pages, normalize))
+
+
+def _iter_pages_parallel(
+    file: str | bytes,
+    text_splitter: Callable,
+    params: Dict,
+    pages: Tuple[int, int],
+    process_pool: Executor,
+    shards: int,
+    pages_per_shard: int,
+    normalize: Callable[[str], str] | None = None,
+) -> Iterator[Tuple[int, str, List[str], str]]:
+    """Extract and split a page range across a process pool
+
+    The shards are planned up front but only a window of them is in flight,
+    so finished shards never pile up ahead of the consumer.
+
+    :param str | bytes file: Path of the pdf document, or the pdf document object
+    :param Callable text_splitter: Langchain text splitter function, must be picklable
+    :param Dict params: Any parameters for the text splitter function
+    :param Tuple[int, int] pages: (start, stop) page index range
+    :param Executor process_pool: Pool the shards are submitted to
+    :param int shards: Number of processes working on the document
+    :param int pages_per_shard: Maximum number of pages of a shard
+    :param Callable[[str], str] | None normalize: Normalises the page text before splitting, must be picklable, defaults to None
+    :yield Iterator[Tuple[int, str, List[str], str]]: Page number, hash of the raw text, chunks and text that was split, in page order
+    """
+    total = pages[1] - pages[0]
+    page_ranges = iter(
+        shard_pages(*pages, shards=max(shards, math.ceil(total / pages_per_shard)))
+    )
+    in_flight = deque()
+
+    def submit_window():
+        while len(in_flight) < 2 * shards:
+            page_range = next(page_ranges, None)
+            if page_range is None:
+                return
+            in_flight.append(
+                process_pool.submit(
+                    split_page_range, file, text_splitter, params, page_range, normalize
+                )
+            )
+
+    try:
+        submit_window()
+        while in_flight:
+            future = in_flight.popleft()
+            submit_window()
+            yield from future.result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def _embed_batch(
+    batch: List[Dict],
+    embedder: TextEmbedding,
+    stats: ExtractionStats,
+    embedding_cache: EmbeddingCache | None = None,
+):
+    """Vectorise a batch of chunks in place with a single model call
+
+    :param List[Dict] batch: Chunks waiting to be vectorised
+    :param TextEmbedding embedder: TextEmbedder object to vectorise the text
+    :param ExtractionStats stats: Stats object to update
+    :param EmbeddingCache | None embedding_cache: Cache looked up before running the model, defaults to None
+    """
+    start = time.perf_counter()
+    texts = [chunk["text"] for chunk in batch]
+    cached = {}
+    if embedding_cache:
+        with observe_stage("embedding_cache_lookup", items=len(texts)):
+            cached = embedding_cache.get_many(texts)
+        STAGE_ITEMS.labels("embedding_cache_hit").inc(len(cached))
+
+    missing = [position for position in range(len(texts)) if position not in cached]
+    if missing:
+        missing_texts = [texts[position] for position in missing]
+        embeddings = embedder.embed_batch(missing_texts)
+        if embedding_cache:
+            embedding_cache.put_many(missing_texts, embeddings)
+        cached.update(zip(missing, embeddings))
+
+    stats.embedding_seconds += time.perf_counter() - start
+    stats.chunks += len(batch)
+    stats.cache_hits += len(batch) - len(missing)
+
+    for position, chunk in enumerate(batch):
+        chunk["embeddings"] = cached[position]
+
+
+def _record_pages(
+    page_chunks: Iterable[Tuple[int, str, List[str], str]],
+    doc_id: str,
+    stats: ExtractionStats,
+    page_store: PageTextStore | None = None,
+) -> Iterator[Tuple[int, List[str]]]:
+    """Record the hash and, with a page store, the text of each page passing through
+
+    :param Iterable[Tuple[int, str, List[str], str]] page_chunks: Page number, text hash, chunks and text of each page
+    :param str doc_id: uuid for the document
+    :param ExtractionStats stats: Stats object to update
+    :param PageTextStore | None page_store: Store of the page texts, defaults to None
+    :yield Iterator[Tuple[int, List[str]]]: Page number and the chunks of that page
+    """
+    page_texts = {}
+    for page_number, text_hash, splitted_text, text in page_chunks:
+        stats.pages += 1
+        stats.page_hashes[page_number] = text_hash
+        if page_store is not None:
+            page_texts[page_number] = text
+            if len(page_texts) >= PAGE_STORE_BATCH:
+                page_store.put_many(doc_id, page_texts)
+                page_texts = {}
+        yield page_number, splitted_text
+    if page_texts:
+        page_store.put_many(doc_id, page_texts)
+
+
+def _embedded_batches(
+    page_chunks: Iterable[Tuple[int, List[str]]],
+    file_name: str,
+    doc_id: str,
+    embedder: TextEmbedding,
+    batch_size: int,
+    stats: ExtractionStats,
+    embedding_cache: EmbeddingCache | None = None,
+) -> Iterator[List[Dict]]:
+    """Group the chunks of consecutive pages into batches and vectorise each batch
+
+    :param Iterable[Tuple[int, List[str]]] page_chunks: Page number and the chunks of each page
+    :param str file_name: name of the pdf document
+    :param str doc_id: uuid for the document
+    :param TextEmbedding embedder: TextEmbedder object to vectorise the text
+    :param int batch_size: Number of chunks vectorised per model call
+    :param ExtractionStats stats: Stats object to update
+    :param EmbeddingCache | None embedding_cache: Cache of chunk embeddings, defaults to None
+    :yield Iterator[List[Dict]]: Batches of chunks with their embeddings, and other meta data
+    """
+    batch = []
+    for page_number, splitted_text in page_chunks:
+        for chunk in splitted_text:
+            batch.append(
+                {
+                    "doc_id": doc_id,
+                    "text": chunk,
+                    "page_number": page_number,
+                    "document_name": file_name,
+                }
+            )
+            if len(batch) >= batch_size:
+                _embed_batch(batch, embedder, stats, embedding_cache)
+                yield batch
+                batch = []
+
+    if batch:
+        _embed_batch(batch, embedder, stats, embedding_cache)
+        yield batch
+
+
+def iter_embedded_batches(
+    file_name: str,
+    file: str | bytes,
+    doc_id: str,
+    text_splitter: Callable,
+    params: Dict,
+    embedder: TextEmbedding,
+    pages: tuple[int, int] | None = None,
+    batch_size: int = 32,
+    stats: ExtractionStats | None = None,
+    process_pool: Executor | None = None,
+    shards: int = 1,
+    pages_per_shard: int = 64,
+    embedding_cache: EmbeddingCache | None = None,
+    normalize: Callable[[str], str] | None = None,
+    page_store: PageTextStore | None = None,
+) -> Iterator[List[Dict]]:
+    """Extract, chunk and vectorise the text from a PDF, one batch of chunks at a time
+
+    Pages are read lazily and only one batch of chunks is held at once, so
+    memory stays flat whatever the size of the document.
+
+    :param str file_name: name of the pdf document
+    :param str | bytes file: Path of the pdf document, or the pdf document object
+    :param str doc_id: uuid for the document
+    :param Callable text_splitter: Langchain text splitter function
+    :param Dict params: Any parameters for the text splitter function
+    :param TextEmbedding embedder: TextEmbedder object to vectorise the text
+    :param tuple[int, int] | None pages: Page index slice to extract, defaults to None
+    :param int batch_size: Number of chunks vectorised per model call, defaults to 32
+    :param ExtractionStats | None stats: Stats object to fill in, defaults to None
+    :param Executor | None process_pool: Process pool to extract and split the pages in, defaults to None
+    :param int shards: Number of processes of the pool working on the document, defaults to 1
+    :param int pages_per_shard: Maximum number of pages handed to a process at once, defaults to 64
+    :param EmbeddingCache | None embedding_cache: Cache of chunk embeddings, defaults to None
+    :param Callable[[str], str] | None normalize: Normalises the page text before splitting, defaults to None
+    :param PageTextStore | None page_store: Store keeping the text of each page as it was split, defaults to None
+    :yield Iterator[List[Dict]]: Batches of chunks with their embeddings, and other meta data
+    """
+    stats = stats if stats is not None else ExtractionStats()
+    start = time.perf_counter()
+
+    with _open_pdf(file) as doc:
+        page_range = pages if pages else (0, doc.page_count)
+        stats.total_pages = len(range(*page_range))
+
+        if process_pool is not None and shards > 1:
+            page_chunks = _iter_pages_parallel(
+                file,
+                text_splitter,
+                params,
+                page_range,
+                process_pool,
+                shards,
+                pages_per_shard,
+                normalize,
+            )
+        else:
+            page_chunks = _iter_page_chunks(
+                doc, text_splitter, params, page_range, normalize
+            )
+
+        yield from _embedded_batches(
+            _record_pages(page_chunks, doc_id, stats, page_store),
+            file_name=file_name,
+            doc_id=doc_id,
+            embedder=embedder,
+            batch_size=batch_size,
+            stats=stats,
+            embedding_cache=embedding_cache,
+        )
+
+    stats.total_seconds = time.perf_counter() - start
+    logger.info(
+        "Extracted %s: %d pages, %d chunks, %.1f chunks/sec (batch size %d), "
+        "%.0f%% embedding cache hits",
+        file_name,
+        stats.pages,
+        stats.chunks,
+        stats.chunks_per_second,
+        batch_size,
+        stats.cache_hit_ratio * 100,
+    )
+
+
+def iter_rechunked_batches(
+    file_name: str,
+    doc_id: str,
+    page_texts: Iterable[Tuple[int, str]],
+    text_splitter: Callable,
+    params: Dict,
+    embedder: TextEmbedding,
+    batch_size: int = 32,
+    stats: ExtractionStats | None = None,
+    embedding_cache: EmbeddingCache | None = None,
+) -> Iterator[List[Dict]]:
+    """Chunk and vectorise stored page texts, one batch of chunks at a time, without the PDF
+
+    :param str file_name: name of the pdf document
+    :param str doc_id: uuid for the document
+    :param Iterable[Tuple[int, str]] page_texts: Page number and normalised text of each page, from the page store
+    :param Callable text_splitter: Langchain text splitter function, without preprocessing
+    :param Dict params: Any parameters for the text splitter function
+    :param TextEmbedding embedder: TextEmbedder object to vectorise the text
+    :param int batch_size: Number of chunks vectorised per model call, defaults to 32
+    :param ExtractionStats | None stats: Stats object to fill in, defaults to None
+    :param EmbeddingCache | None embedding_cache: Cache of chunk embeddings, defaults to None
+    :yield Iterator[List[Dict]]: Batches of chunks with their embeddings, and other meta data
+    """
+    stats = stats if stats is not None else ExtractionStats()
+    start = time.perf_counter()
+
+    def page_chunks() -> Iterator[Tuple[int, List[str]]]:
+        for page_number, text in page_texts:
+            stats.pages += 1
+            yield page_number, text_splitter(text=text, **params)
+
+    yield from _embedded_batches(
+        page_chunks(),
+        file_name=file_name,
+        doc_id=doc_id,
+        embedder=embedder,
+        batch_size=batch_size,
+        stats=stats,
+        embedding_cache=embedding_cache,
+    )
+    stats.total_seconds += time.perf_counter() - start
+
 
 def extract_text(
     file_name: str,
@@ -14,6 +450,12 @@ def extract_text(
     params: Dict,
     embedder: TextEmbedding,
     pages: tuple[int, int] | None = None,
+    batch_size: int = 32,
+    stats: ExtractionStats | None = None,
+    progress_callback: Callable[[ExtractionStats], None] | None = None,
+    process_pool: Executor | None = None,
+    shards: int = 1,
+    embedding_cache: EmbeddingCache | None = None,
 ) -> List[Dict]:
     """Extract, chunk it, vectorise the text from a PDF
 
@@ -23,30 +465,34 @@ def extract_text(
     :param Callable text_splitter: Langchain text splitter function
     :param Dict params: Any parameters for the text splitter function
     :param TextEmbedding embedder: TextEmbedder object to vectorise the text
-    :param tuple[int, int] | None pages: Page number slice to extract, defaults to None
+    :param tuple[int, int] | None pages: Page index slice to extract, defaults to None
+    :param int batch_size: Number of chunks vectorised per model call, defaults to 32
+    :param ExtractionStats | None stats: Stats object to fill in, defaults to None
+    :param Callable[[ExtractionStats], None] | None progress_callback: Called with the stats after every embedded batch, defaults to None
+    :param Executor | None process_pool: Process pool to extract and split the pages in, defaults to None
+    :param int shards: Number of processes of the pool working on the document, defaults to 1
+    :param EmbeddingCache | None embedding_cache: Cache of chunk embeddings, defaults to None
     :return List[Dict]: dictionary of each chunk with its embeddings, and other meta data
     """
+    stats = stats if stats is not None else ExtractionStats()
 
     extracted_text = []
-    with fitz.open(filetype="pdf", stream=BytesIO(file_content)) as doc:
-        if pages:
-            selected_pages = doc.pages(*pages)
-        else:
-            selected_pages = doc
-
-        for idx, page in enumerate(selected_pages):
-            text = page.get_text("text")
-
-            splitted_text = text_splitter(text=text, **params)
-            for doc in splitted_text:
-                extracted_text.append(
-                    {
-                        "doc_id": doc_id,
-                        "text": doc,
-                        "page_number": pages[0] + idx if pages else idx + 1,
-                        "document_name": file_name,
-                        "embeddings": embedder.embed_documents(doc),
-                    }
-                )
+    for batch in iter_embedded_batches(
+        file_name=file_name,
+        file=file_content,
+        doc_id=doc_id,
+        text_splitter=text_splitter,
+        params=params,
+        embedder=embedder,
+        pages=pages,
+        batch_size=batch_size,
+        stats=stats,
+        process_pool=process_pool,
+        shards=shards,
+        embedding_cache=embedding_cache,
+    ):
+        extracted_text.extend(batch)
+        if progress_callback:
+            progress_callback(stats)
 
     return extracted_text
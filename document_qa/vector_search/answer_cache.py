@@ -0,0 +1,196 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+
+@dataclass
+class CachedAnswer:
+    """Answer generated for a question over a set of documents"""
+
+    embedding: np.ndarray
+    doc_ids: Tuple[str, ...]
+    params: Tuple
+    answer: str
+    sources: List[str]
+    created_at: float
+
+
+class SemanticAnswerCache:
+    """Cache of generated answers, looked up by question similarity over the same documents"""
+
+    def __init__(
+        self, threshold: float = 0.95, max_size: int = 512, ttl: float = 86400.0
+    ) -> None:
+        """Initialise the cache
+
+        :param float threshold: Minimum cosine similarity to reuse an answer, defaults to 0.95
+        :param int max_size: Maximum number of cached answers, defaults to 512
+        :param float ttl: Seconds an answer stays valid, defaults to 86400.0
+        """
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        # Entries in least recently used order and their index by document set and search knobs
+        self._entries: OrderedDict[int, CachedAnswer] = OrderedDict()
+        self._by_docs: Dict[Tuple[Tuple[str, ...], Tuple], Set[int]] = {}
+        # Bumped by invalidate, answers generated before a bump are not stored
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def doc_key(doc_id: str | List[str]) -> Tuple[str, ...]:
+        """Key of the document set a question is asked against
+
+        :param str | List[str] doc_id: Document id or list of document ids
+        :return Tuple[str, ...]: Sorted, de-duplicated document ids
+        """
+        doc_ids = [doc_id] if isinstance(doc_id, str) else doc_id
+        return tuple(sorted(set(doc_ids)))
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        """Scale a vector to unit length so a dot product is the cosine similarity
+
+        :param List[float] embedding: Vector to scale
+        :return np.ndarray: Unit length float32 vector
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id: int):
+        """Remove an entry and its document set index, the lock must be held
+
+        :param int entry_id: ID of the entry to remove
+        """
+        entry = self._entries.pop(entry_id)
+        key = (entry.doc_ids, entry.params)
+        ids = self._by_docs[key]
+        ids.discard(entry_id)
+        if not ids:
+            del self._by_docs[key]
+
+    def _expire(self, now: float):
+        """Remove the entries older than the TTL, the lock must be held
+
+        :param float now: Current monotonic time
+        """
+        # Entries are in LRU order, not age order, so every entry is checked
+        expired = [
+            entry_id
+            for entry_id, entry in self._entries.items()
+            if now - entry.created_at > self.ttl
+        ]
+        for entry_id in expired:
+            self._remove(entry_id)
+
+    def generation(self, doc_id: str | List[str]) -> Tuple[int, ...]:
+        """Generation of the documents, to capture before a lookup and pass to store
+
+        :param str | List[str] doc_id: Documents the question is asked against
+        :return Tuple[int, ...]: Number of invalidations of each document
+        """
+        with self._lock:
+            return tuple(self._generations.get(key, 0) for key in self.doc_key(doc_id))
+
+    def lookup(
+        self, embedding: List[float], doc_id: str | List[str], params: Tuple = ()
+    ) -> Tuple[str, List[str]] | None:
+        """Find an answer to a similar question over the same documents
+
+        :param List[float] embedding: Vectorised question
+        :param str | List[str] doc_id: Documents the question is asked against
+        :param Tuple params: Search knobs the answer must have been retrieved with, defaults to ()
+        :return Tuple[str, List[str]] | None: Cached answer and sources, None on a miss
+        """
+        key = (self.doc_key(doc_id), params)
+        query = self._normalize(embedding)
+        with self._lock:
+            self._expire(time.monotonic())
+            entry_ids = list(self._by_docs.get(key, ()))
+            if not entry_ids:
+                self.misses += 1
+                return None
+
+            matrix = np.stack([self._entries[i].embedding for i in entry_ids])
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            entry_id = entry_ids[best]
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            entry = self._entries[entry_id]
+            return entry.answer, list(entry.sources)
+
+    def store(
+        self,
+        embedding: List[float],
+        doc_id: str | List[str],
+        answer: str,
+        sources: List[str],
+        params: Tuple = (),
+        generation: Tuple[int, ...] | None = None,
+    ):
+        """Cache a generated answer, unless a document was invalidated since the lookup
+
+        :param List[float] embedding: Vectorised question
+        :param str | List[str] doc_id: Documents the question was asked against
+        :param str answer: Generated answer
+        :param List[str] sources: Sources of the answer
+        :param Tuple params: Search knobs the answer was retrieved with, defaults to ()
+        :param Tuple[int, ...] | None generation: Generation captured before the lookup, defaults to None (always stored)
+        """
+        entry = CachedAnswer(
+            embedding=self._normalize(embedding),
+            doc_ids=self.doc_key(doc_id),
+            params=params,
+            answer=answer,
+            sources=list(sources),
+            created_at=time.monotonic(),
+        )
+        with self._lock:
+            # The answer was built from chunks that were deleted or replaced since
+            if generation is not None and generation != tuple(
+                self._generations.get(key, 0) for key in entry.doc_ids
+            ):
+                return
+            entry_id = next(self._ids)
+            self._entries[entry_id] = entry
+            self._by_docs.setdefault((entry.doc_ids, params), set()).add(entry_id)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, doc_id: str):
+        """Drop every answer generated over a document
+
+        :param str doc_id: ID of the uploaded or deleted document
+        """
+        with self._lock:
+            self._generations[doc_id] = self._generations.get(doc_id, 0) + 1
+            for key in [key for key in self._by_docs if doc_id in key[0]]:
+                for entry_id in list(self._by_docs.get(key, ())):
+                    self._remove(entry_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of the cache
+
+        :return Dict[str, int]: Size, hits and misses
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
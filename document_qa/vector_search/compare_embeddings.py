@@ -0,0 +1,210 @@
+"""Compare the int8 embedding backend with the fp32 reference
+
+Usage, from the document_qa directory::
+
+    python -m vector_search.compare_embeddings --pdf documents/sample.pdf
+
+Both backends embed the same chunks and questions. The report gives the
+throughput of each, the cosine agreement of their vectors and how many of the
+fp32 top k chunks the int8 questions still retrieve, against fp32 chunks (the
+collection as ingested before switching) and against int8 chunks (after
+re-ingesting).
+"""
+
+import argparse
+import json
+import logging
+import time
+from typing import Dict, List
+
+import numpy as np
+from config import settings
+from vector_search.embedding_backends import BACKENDS, load_embedding_model
+from vector_search.text_embedders import EMBED_INSTRUCTION, QUERY_INSTRUCTION
+
+SAMPLE_TEXTS = [
+    "The quarterly report shows revenue grew by twelve percent year over year.",
+    "Employees must submit expense claims within thirty days of purchase.",
+    "The warranty does not cover damage caused by improper installation.",
+    "Patients should fast for eight hours before the procedure.",
+    "The committee approved the budget after a lengthy debate.",
+    "Data is encrypted at rest and in transit using industry standards.",
+    "The tenant is responsible for minor repairs and routine maintenance.",
+    "Results indicate a strong correlation between sleep and memory.",
+]
+
+
+def load_texts(pdf: str | None, count: int) -> List[str]:
+    """Chunks of a pdf, or the built-in sample sentences
+
+    :param str | None pdf: Path of a pdf document to chunk
+    :param int count: Maximum number of texts
+    :return List[str]: Texts to embed
+    """
+    if pdf is None:
+        return (SAMPLE_TEXTS * (count // len(SAMPLE_TEXTS) + 1))[:count]
+
+    import fitz
+    from vector_search.text_splitter import SplitStrategy, TextSplitter
+
+    splitter = TextSplitter(preprocessing=True)
+    texts = []
+    with fitz.open(pdf, filetype="pdf") as doc:
+        for page in doc:
+            texts.extend(
+                splitter.split(SplitStrategy.tiktoken, page.get_text("text"), 300, 50)
+            )
+            if len(texts) >= count:
+                break
+    return texts[:count]
+
+
+def make_questions(texts: List[str], count: int) -> List[str]:
+    """Questions about evenly spread texts
+
+    :param List[str] texts: Embedded texts
+    :param int count: Number of questions
+    :return List[str]: Questions
+    """
+    step = max(len(texts) // count, 1)
+    return [
+        "What does the document say about " + " ".join(text.split()[:8]) + "?"
+        for text in texts[::step][:count]
+    ]
+
+
+def _normalise(vectors: List[List[float]]) -> np.ndarray:
+    """Scale vectors to unit length
+
+    :param List[List[float]] vectors: Vectors
+    :return np.ndarray: Unit vectors
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def _agreement(reference: np.ndarray, other: np.ndarray) -> Dict:
+    """Cosine similarity of the vectors of the same texts
+
+    :param np.ndarray reference: Unit vectors of the reference backend
+    :param np.ndarray other: Unit vectors of the compared backend
+    :return Dict: Mean, minimum and first percentile
+    """
+    cosine = np.einsum("ij,ij->i", reference, other)
+    return {
+        "mean": float(cosine.mean()),
+        "min": float(cosine.min()),
+        "p1": float(np.percentile(cosine, 1)),
+    }
+
+
+def _recall(
+    queries: np.ndarray, docs: np.ndarray, reference: np.ndarray, k: int
+) -> float:
+    """Share of the reference top k found by another top k
+
+    :param np.ndarray queries: Unit query vectors
+    :param np.ndarray docs: Unit document vectors
+    :param np.ndarray reference: Reference top k indices, one row per query
+    :param int k: Results per query
+    :return float: Mean overlap of the top k sets
+    """
+    top = np.argsort(-(queries @ docs.T), axis=1)[:, :k]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(top, reference)]))
+
+
+def embed(backend: str, texts: List[str], questions: List[str]) -> Dict:
+    """Load a backend and embed the texts and questions with it
+
+    :param str backend: "fp32" or "int8"
+    :param List[str] texts: Documents to embed
+    :param List[str] questions: Queries to embed
+    :return Dict: Timings and unit vectors
+    """
+    start = time.perf_counter()
+    model = load_embedding_model(
+        backend=backend,
+        model_name=settings.embedding.model_name,
+        embed_instruction=EMBED_INSTRUCTION,
+        query_instruction=QUERY_INSTRUCTION,
+        batch_size=settings.embedding.batch_size,
+        threads=settings.embedding.threads,
+        interop_threads=settings.embedding.interop_threads,
+    )
+    load_seconds = time.perf_counter() - start
+    model.embed_documents(texts[: settings.embedding.batch_size])
+
+    start = time.perf_counter()
+    docs = model.embed_documents(texts)
+    doc_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    queries = [model.embed_query(question) for question in questions]
+    query_seconds = time.perf_counter() - start
+
+    return {
+        "load_seconds": load_seconds,
+        "docs_per_second": len(texts) / doc_seconds,
+        "queries_per_second": len(questions) / query_seconds,
+        "docs": _normalise(docs),
+        "queries": _normalise(queries),
+    }
+
+
+def compare(texts: List[str], questions: List[str], k: int = 5) -> Dict:
+    """Compare the int8 backend with the fp32 reference
+
+    :param List[str] texts: Documents to embed
+    :param List[str] questions: Queries to embed
+    :param int k: Results per query of the recall check, defaults to 5
+    :return Dict: Throughput of each backend and agreement of int8 with fp32
+    """
+    runs = {backend: embed(backend, texts, questions) for backend in BACKENDS}
+    fp32, int8 = runs["fp32"], runs["int8"]
+    k = min(k, len(texts))
+    reference = np.argsort(-(fp32["queries"] @ fp32["docs"].T), axis=1)[:, :k]
+
+    return {
+        "texts": len(texts),
+        "questions": len(questions),
+        "throughput": {
+            backend: {
+                name: run[name]
+                for name in ("load_seconds", "docs_per_second", "queries_per_second")
+            }
+            for backend, run in runs.items()
+        },
+        "speedup": {
+            "docs": int8["docs_per_second"] / fp32["docs_per_second"],
+            "queries": int8["queries_per_second"] / fp32["queries_per_second"],
+        },
+        "cosine_agreement": {
+            "docs": _agreement(fp32["docs"], int8["docs"]),
+            "queries": _agreement(fp32["queries"], int8["queries"]),
+        },
+        f"recall_at_{k}": {
+            "int8_queries_fp32_docs": _recall(
+                int8["queries"], fp32["docs"], reference, k
+            ),
+            "int8_queries_int8_docs": _recall(
+                int8["queries"], int8["docs"], reference, k
+            ),
+        },
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", help="Document to chunk, sample sentences if unset")
+    parser.add_argument("--texts", type=int, default=512, help="Chunks to embed")
+    parser.add_argument("--questions", type=int, default=64, help="Queries to embed")
+    parser.add_argument("--k", type=int, default=5, help="Top k of the recall check")
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    texts = load_texts(args.pdf, args.texts)
+    report = compare(texts, make_questions(texts, args.questions), k=args.k)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
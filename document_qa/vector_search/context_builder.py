@@ -0,0 +1,227 @@
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Dict, List, Tuple
+
+import numpy as np
+import tiktoken
+
+# Shortest shared text treated as a chunk overlap rather than a coincidence
+_MIN_OVERLAP = 20
+
+
+@dataclass
+class Passage:
+    """Text of one or more merged chunks from the same page"""
+
+    document_name: str
+    page_number: int
+    text: str
+
+    @property
+    def source(self) -> str:
+        """Source label of the passage"""
+        return f"{self.document_name}, page number {self.page_number}"
+
+
+@dataclass
+class BuiltContext:
+    """Context packed for the LLM and what it cost"""
+
+    sources: List[str]
+    context: str
+    tokens: int
+    raw_tokens: int
+    dropped_chunks: int = 0
+    passages: List[Passage] = field(default_factory=list)
+
+    @property
+    def tokens_saved(self) -> int:
+        """Prompt tokens saved compared to joining every retrieved chunk
+
+        :return int: Number of tokens saved
+        """
+        return max(self.raw_tokens - self.tokens, 0)
+
+
+def _merge_overlap(first: str, second: str) -> str | None:
+    """Merge two chunks when one contains the other or the end of one starts the other
+
+    :param str first: Text of the first chunk
+    :param str second: Text of the second chunk
+    :return str | None: Merged text, None if the chunks do not overlap
+    """
+    if second in first:
+        return first
+    if first in second:
+        return second
+    for a, b in ((first, second), (second, first)):
+        head = b[:_MIN_OVERLAP]
+        if len(head) < _MIN_OVERLAP:
+            continue
+        position = a.find(head, max(len(a) - len(b), 0))
+        while position != -1:
+            if b.startswith(a[position:]):
+                return a + b[len(a) - position :]
+            position = a.find(head, position + 1)
+    return None
+
+
+class ContextBuilder:
+    """Builds a token budgeted LLM context from vector search hits"""
+
+    def __init__(
+        self,
+        token_budget: int = 1500,
+        model: str = "gpt-3.5-turbo",
+        mmr_lambda: float = 0.7,
+        duplicate_threshold: float = 0.95,
+        separator: str = "\n\n",
+    ) -> None:
+        """Initialise the builder
+
+        :param int token_budget: Maximum number of context tokens, defaults to 1500
+        :param str model: OpenAI model whose tokenizer counts the tokens, defaults to "gpt-3.5-turbo"
+        :param float mmr_lambda: Weight of the relevance against the novelty of a chunk in MMR, defaults to 0.7
+        :param float duplicate_threshold: Cosine similarity above which a chunk is a near-duplicate, defaults to 0.95
+        :param str separator: Text placed between passages, defaults to "\\n\\n"
+        """
+        self.token_budget = token_budget
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.separator = separator
+        self.model = model
+
+    @cached_property
+    def encoding(self) -> tiktoken.Encoding:
+        """Tokenizer of the model, loaded on first use
+
+        :return tiktoken.Encoding: Tokenizer
+        """
+        try:
+            return tiktoken.encoding_for_model(self.model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+
+    def count_tokens(self, text: str) -> int:
+        """Count the tokens of a text
+
+        :param str text: Text to count
+        :return int: Number of tokens
+        """
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def _mmr_order(
+        self, hits: List[Dict], query_embedding: List[float]
+    ) -> Tuple[List[Dict], int]:
+        """Order the hits by maximal marginal relevance, dropping near-duplicates
+
+        :param List[Dict] hits: Vector search hits with their embeddings
+        :param List[float] query_embedding: Vectorised question
+        :return Tuple[List[Dict], int]: Ordered hits and the number of dropped hits
+        """
+        vectors = np.asarray(
+            [hit["entity"]["embeddings"] for hit in hits], dtype=np.float32
+        )
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+
+        relevance = vectors @ query
+        similarity = vectors @ vectors.T
+        selected: List[int] = []
+        remaining = list(range(len(hits)))
+        dropped = 0
+        while remaining:
+            if selected:
+                redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype=np.float32)
+            scores = (
+                self.mmr_lambda * relevance[remaining]
+                - (1 - self.mmr_lambda) * redundancy
+            )
+            best = int(np.argmax(scores))
+            candidate = remaining.pop(best)
+            if redundancy[best] >= self.duplicate_threshold:
+                dropped += 1
+                continue
+            selected.append(candidate)
+
+        return [hits[i] for i in selected], dropped
+
+    @staticmethod
+    def _collapse(hits: List[Dict]) -> List[Passage]:
+        """Merge the overlapping chunks of the same page, keeping the rank order
+
+        :param List[Dict] hits: Ordered vector search hits
+        :return List[Passage]: Passages in the order of their best ranked chunk
+        """
+        passages: List[Passage] = []
+        for hit in hits:
+            entity = hit["entity"]
+            text = entity["text"]
+            for passage in passages:
+                if (
+                    passage.document_name != entity["document_name"]
+                    or passage.page_number != entity["page_number"]
+                ):
+                    continue
+                merged = _merge_overlap(passage.text, text)
+                if merged is not None:
+                    passage.text = merged
+                    break
+            else:
+                passages.append(
+                    Passage(
+                        document_name=entity["document_name"],
+                        page_number=entity["page_number"],
+                        text=text,
+                    )
+                )
+        return passages
+
+    def build(
+        self, entities: List[List[Dict]], query_embedding: List[float] | None = None
+    ) -> BuiltContext:
+        """Build the context of the first query of a vector search result
+
+        :param List[List[Dict]] entities: Output from the vector search
+        :param List[float] | None query_embedding: Vectorised question, enables MMR when the hits carry embeddings, defaults to None
+        :return BuiltContext: Sources, packed context and token counts
+        """
+        hits = list(entities[0])
+        raw_tokens = self.count_tokens("".join(hit["entity"]["text"] for hit in hits))
+
+        dropped = 0
+        if (
+            query_embedding is not None
+            and hits
+            and all("embeddings" in hit["entity"] for hit in hits)
+        ):
+            hits, dropped = self._mmr_order(hits, query_embedding)
+
+        separator_tokens = self.count_tokens(self.separator)
+        packed: List[Passage] = []
+        parts: List[str] = []
+        tokens = 0
+        for passage in self._collapse(hits):
+            cost = separator_tokens if parts else 0
+            passage_tokens = self.encoding.encode(passage.text, disallowed_special=())
+            available = self.token_budget - tokens - cost
+            if available <= 0:
+                break
+            if len(passage_tokens) > available:
+                passage.text = self.encoding.decode(passage_tokens[:available])
+                passage_tokens = passage_tokens[:available]
+            parts.append(passage.text)
+            packed.append(passage)
+            tokens += cost + len(passage_tokens)
+
+        return BuiltContext(
+            sources=list(sorted({passage.source for passage in packed})),
+            context=self.separator.join(parts),
+            tokens=tokens,
+            raw_tokens=raw_tokens,
+            dropped_chunks=dropped,
+            passages=packed,
+        )
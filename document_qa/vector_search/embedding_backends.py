@@ -0,0 +1,96 @@
+import logging
+import os
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from langchain_community.embeddings import HuggingFaceInstructEmbeddings
+
+logger = logging.getLogger(__name__)
+
+# fp32 is the reference PyTorch model, int8 quantizes its linear layers for CPU inference
+BACKENDS = ("fp32", "int8")
+
+
+def configure_threads(threads: int = 0, interop_threads: int = 0):
+    """Size the PyTorch thread pools, 0 keeps the PyTorch default
+
+    Every embedding executor worker and ingestion worker runs the model, so
+    the intra-op threads of each call should not add up to more than the cores.
+
+    :param int threads: Threads used inside an operator, defaults to 0
+    :param int interop_threads: Threads running independent operators, defaults to 0
+    """
+    if threads <= 0 and interop_threads <= 0:
+        return
+
+    import torch
+
+    if threads > 0:
+        torch.set_num_threads(threads)
+    if interop_threads > 0:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # Only settable before the first parallel operator ran
+            logger.warning("PyTorch inter-op threads already started, keeping them")
+    logger.info(
+        "PyTorch uses %d threads, %d inter-op threads on %d cpus",
+        torch.get_num_threads(),
+        torch.get_num_interop_threads(),
+        os.cpu_count(),
+    )
+
+
+def quantize_int8(model: "HuggingFaceInstructEmbeddings"):
+    """Quantize the linear layers of the instructor model to int8, in place
+
+    Weights are stored as int8 and activations are quantized on the fly,
+    which cuts the memory of the model by about four and speeds up CPU
+    inference. The tokenizer, pooling and normalisation are untouched.
+
+    :param HuggingFaceInstructEmbeddings model: Loaded fp32 model
+    """
+    import torch
+
+    model.client.eval()
+    torch.ao.quantization.quantize_dynamic(
+        model.client, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+def load_embedding_model(
+    backend: str,
+    model_name: str,
+    embed_instruction: str,
+    query_instruction: str,
+    batch_size: int = 32,
+    threads: int = 0,
+    interop_threads: int = 0,
+) -> "HuggingFaceInstructEmbeddings":
+    """Load the instructor model on the CPU with the given backend
+
+    :param str backend: "fp32" or "int8"
+    :param str model_name: Name of the instructor model
+    :param str embed_instruction: Instruction of the documents
+    :param str query_instruction: Instruction of the queries
+    :param int batch_size: Texts encoded per forward pass, defaults to 32
+    :param int threads: PyTorch intra-op threads, defaults to 0 (PyTorch default)
+    :param int interop_threads: PyTorch inter-op threads, defaults to 0 (PyTorch default)
+    :raises ValueError: Unknown backend
+    :return HuggingFaceInstructEmbeddings: Embedding model
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend}, expected {BACKENDS}")
+
+    from langchain_community.embeddings import HuggingFaceInstructEmbeddings
+
+    configure_threads(threads=threads, interop_threads=interop_threads)
+    model = HuggingFaceInstructEmbeddings(
+        model_name=model_name,
+        embed_instruction=embed_instruction,
+        query_instruction=query_instruction,
+        encode_kwargs={"batch_size": batch_size},
+    )
+    if backend == "int8":
+        quantize_int8(model)
+    return model
@@ -0,0 +1,114 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+# Keeps the number of bound parameters under SQLite's limit
+_QUERY_BATCH = 500
+
+
+class EmbeddingCache:
+    """Persistent cache of chunk embeddings keyed by a hash of the chunk text and the model"""
+
+    def __init__(self, path: str, model_id: str, max_entries: int = 500_000) -> None:
+        """Open or create the cache database
+
+        :param str path: Path of the SQLite database
+        :param str model_id: Identifier of the embedding model and its instruction
+        :param int max_entries: Maximum number of cached embeddings, defaults to 500_000
+        """
+        self.model_id = model_id
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[
+            0
+        ]
+
+    def key(self, text: str) -> str:
+        """Content address of a chunk
+
+        :param str text: Chunk text
+        :return str: SHA-256 of the model id and the whitespace normalised text
+        """
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{self.model_id}\0{normalized}".encode()).hexdigest()
+
+    def get_many(self, texts: List[str]) -> Dict[int, List[float]]:
+        """Look up the embeddings of many chunks at once
+
+        :param List[str] texts: Chunk texts
+        :return Dict[int, List[float]]: Embeddings found, by position in texts
+        """
+        positions: Dict[str, List[int]] = {}
+        for position, text in enumerate(texts):
+            positions.setdefault(self.key(text), []).append(position)
+        keys = list(positions)
+
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _QUERY_BATCH):
+                batch = keys[start : start + _QUERY_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, vector in rows:
+                    embedding = np.frombuffer(vector, dtype=np.float32).tolist()
+                    for position in positions[key]:
+                        found[position] = embedding
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        [time.time(), *(key for key, _ in rows)],
+                    )
+            self._conn.commit()
+        return found
+
+    def put_many(self, texts: List[str], embeddings: List[List[float]]):
+        """Store the embeddings of many chunks, evicting the least recently used beyond max_entries
+
+        :param List[str] texts: Chunk texts
+        :param List[List[float]] embeddings: Embeddings of the chunks, in the same order
+        """
+        now = time.time()
+        rows = [
+            (self.key(text), np.asarray(embedding, dtype=np.float32).tobytes(), now)
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._count += self._conn.total_changes - before
+
+            excess = self._count - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._count -= excess
+            self._conn.commit()
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
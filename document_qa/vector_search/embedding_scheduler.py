@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Deque, List, Tuple
+
+import numpy as np
+from metrics import STAGE_ITEMS, STAGE_SECONDS, observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _EmbedRequest:
+    """Texts of one caller, possibly spread over several batches"""
+
+    instruction: str
+    texts: List[str]
+    future: Future
+    kind: str
+    enqueued_at: float = field(default_factory=time.monotonic)
+    taken: int = 0
+    embeddings: List = field(default_factory=list)
+
+    def __post_init__(self):
+        self.embeddings = [None] * len(self.texts)
+
+
+class EmbeddingScheduler:
+    """Batches the embedding requests of every caller into shared model calls
+
+    A single worker thread owns the model. Callers queue [instruction, text]
+    pairs and get a Future of their vectors. A batch is flushed once it holds
+    max_batch_size texts or its oldest text has waited max_wait seconds.
+    Queries are taken first, documents fill the rest of the batch.
+    """
+
+    def __init__(
+        self,
+        encode: Callable[[List[List[str]]], np.ndarray],
+        max_batch_size: int = 64,
+        max_wait: float = 0.005,
+    ) -> None:
+        """Initialise the scheduler, call start before submitting
+
+        :param Callable[[List[List[str]]], np.ndarray] encode: Model call vectorising [instruction, text] pairs
+        :param int max_batch_size: Maximum number of texts of a model call, defaults to 64
+        :param float max_wait: Seconds the first queued text waits for others to join it, defaults to 0.005
+        """
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._condition = threading.Condition()
+        self._queries: Deque[_EmbedRequest] = deque()
+        self._documents: Deque[_EmbedRequest] = deque()
+        self._pending = 0
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="embedding-scheduler", daemon=True
+        )
+
+    def start(self):
+        """Start the worker thread"""
+        self._thread.start()
+
+    def submit(self, instruction: str, texts: List[str], query: bool = False) -> Future:
+        """Queue texts for embedding, safe to call from any thread
+
+        :param str instruction: Instruction of the texts
+        :param List[str] texts: Texts to vectorise
+        :param bool query: Whether the texts are queries, served before documents, defaults to False
+        :raises RuntimeError: If the scheduler is closed
+        :return Future: Future of the vectors, in the same order as the texts
+        """
+        future = Future()
+        if not texts:
+            future.set_result([])
+            return future
+
+        request = _EmbedRequest(
+            instruction=instruction,
+            texts=list(texts),
+            future=future,
+            kind="query" if query else "document",
+        )
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Embedding scheduler is closed")
+            (self._queries if query else self._documents).append(request)
+            self._pending += len(texts)
+            self._condition.notify()
+        return future
+
+    def embed(
+        self, instruction: str, texts: List[str], query: bool = False
+    ) -> List[List[float]]:
+        """Vectorise texts, blocking the calling thread until they are done
+
+        :param str instruction: Instruction of the texts
+        :param List[str] texts: Texts to vectorise
+        :param bool query: Whether the texts are queries, defaults to False
+        :return List[List[float]]: Vectors, in the same order as the texts
+        """
+        return self.submit(instruction, texts, query=query).result()
+
+    async def aembed(
+        self, instruction: str, texts: List[str], query: bool = False
+    ) -> List[List[float]]:
+        """Vectorise texts without blocking the event loop
+
+        :param str instruction: Instruction of the texts
+        :param List[str] texts: Texts to vectorise
+        :param bool query: Whether the texts are queries, defaults to False
+        :return List[List[float]]: Vectors, in the same order as the texts
+        """
+        return await asyncio.wrap_future(self.submit(instruction, texts, query=query))
+
+    def _oldest(self) -> float | None:
+        """Enqueue time of the oldest waiting request, under the condition
+
+        :return float | None: Monotonic time, None if nothing is queued
+        """
+        heads = [
+            queue[0].enqueued_at for queue in (self._queries, self._documents) if queue
+        ]
+        return min(heads) if heads else None
+
+    def _take_batch(self) -> List[Tuple[_EmbedRequest, int, int]]:
+        """Take up to max_batch_size texts, queries first, under the condition
+
+        :return List[Tuple[_EmbedRequest, int, int]]: Requests with the slice of their texts in the batch
+        """
+        batch, size = [], 0
+        for queue in (self._queries, self._documents):
+            while queue and size < self.max_batch_size:
+                request = queue[0]
+                # Cancelled requests are dropped, the others can no longer be
+                # cancelled once their first texts are taken
+                if (
+                    not request.taken
+                    and not request.future.set_running_or_notify_cancel()
+                ):
+                    queue.popleft()
+                    self._pending -= len(request.texts)
+                    continue
+                count = min(
+                    len(request.texts) - request.taken, self.max_batch_size - size
+                )
+                batch.append((request, request.taken, request.taken + count))
+                request.taken += count
+                size += count
+                if request.taken == len(request.texts):
+                    queue.popleft()
+        self._pending -= size
+        return batch
+
+    def _run(self):
+        """Worker loop, flushes batches until closed and drained"""
+        while True:
+            with self._condition:
+                while True:
+                    if self._pending >= self.max_batch_size:
+                        break
+                    oldest = self._oldest()
+                    if oldest is None:
+                        if self._closed:
+                            return
+                        self._condition.wait()
+                        continue
+                    remaining = oldest + self.max_wait - time.monotonic()
+                    if remaining <= 0 or self._closed:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._take_batch()
+            if not batch:
+                continue
+
+            # One bad batch must not take the worker, and every caller, down
+            try:
+                self._flush(batch)
+            except Exception as e:
+                logger.exception("Embedding scheduler batch failed")
+                for request, _, _ in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _flush(self, batch: List[Tuple[_EmbedRequest, int, int]]):
+        """Run one model call for a batch and hand the vectors back
+
+        :param List[Tuple[_EmbedRequest, int, int]] batch: Requests with the slice of their texts in the batch
+        """
+        pairs = [
+            [request.instruction, text]
+            for request, start, stop in batch
+            for text in request.texts[start:stop]
+        ]
+        try:
+            with observe_stage("embed_scheduler_batch", items=len(pairs)):
+                vectors = self.encode(pairs).tolist()
+        except Exception as e:
+            logger.exception("Embedding batch of %d texts failed", len(pairs))
+            for request, _, _ in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        now = time.monotonic()
+        offset = 0
+        for request, start, stop in batch:
+            if request.future.done():
+                offset += stop - start
+                continue
+            request.embeddings[start:stop] = vectors[offset : offset + stop - start]
+            offset += stop - start
+            if stop == len(request.texts):
+                STAGE_SECONDS.labels(f"embed_wait_{request.kind}").observe(
+                    now - request.enqueued_at
+                )
+                STAGE_ITEMS.labels(f"embed_wait_{request.kind}").inc(len(request.texts))
+                request.future.set_result(request.embeddings)
+
+    def close(self):
+        """Stop accepting texts, embed the queued ones and stop the worker"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread.is_alive():
+            self._thread.join()
@@ -0,0 +1,120 @@
+from dataclasses import dataclass, field
+from typing import Dict
+
+# Metrics usable with the normalised instructor embeddings, they rank alike. L2
+# is the metric of the collections created before the index profiles
+METRICS = ("L2", "COSINE", "IP")
+
+
+@dataclass(frozen=True)
+class IndexProfile:
+    """ANN index of the vector field and the parameters it is searched with"""
+
+    index_type: str
+    metric: str = "L2"
+    build_params: Dict[str, int] = field(default_factory=dict)
+    search_defaults: Dict[str, int] = field(default_factory=dict)
+
+    def index_params(self) -> Dict:
+        """Parameters to build the index with
+
+        :return Dict: Metric, index type and build parameters
+        """
+        return {
+            "metric_type": self.metric,
+            "index_type": self.index_type,
+            "params": dict(self.build_params),
+        }
+
+    def search_params(
+        self, limit: int = 5, nprobe: int | None = None, ef: int | None = None
+    ) -> Dict:
+        """Parameters to search the index with, trading recall for latency
+
+        :param int limit: Top k results of the search, defaults to 5
+        :param int | None nprobe: IVF clusters to probe, defaults to None (profile default)
+        :param int | None ef: HNSW search breadth, defaults to None (profile default)
+        :return Dict: Metric and search parameters
+        """
+        params = dict(self.search_defaults)
+        if "nprobe" in params and nprobe is not None:
+            params["nprobe"] = min(nprobe, self.build_params["nlist"])
+        if "ef" in params:
+            # HNSW rejects a search breadth below the number of results
+            params["ef"] = max(ef if ef is not None else params["ef"], limit)
+        return {"metric_type": self.metric, "params": params}
+
+
+def build_index_profile(
+    name: str,
+    metric: str = "L2",
+    m: int = 16,
+    ef_construction: int = 200,
+    ef: int = 64,
+    nlist: int = 1024,
+    nprobe: int = 16,
+    pq_m: int = 16,
+) -> IndexProfile:
+    """Build a named index profile
+
+    :param str name: One of HNSW, IVF_FLAT, IVF_SQ8 or IVF_PQ
+    :param str metric: L2, COSINE or IP, defaults to "L2"
+    :param int m: HNSW graph degree, defaults to 16
+    :param int ef_construction: HNSW build breadth, defaults to 200
+    :param int ef: HNSW search breadth, defaults to 64
+    :param int nlist: IVF clusters, defaults to 1024
+    :param int nprobe: IVF clusters probed per search, defaults to 16
+    :param int pq_m: IVF_PQ sub-quantizers, must divide the vector dimension, defaults to 16
+    :raises ValueError: Unknown profile or metric
+    :return IndexProfile: Index profile
+    """
+    name, metric = name.upper(), metric.upper()
+    if metric not in METRICS:
+        raise ValueError(f"Unsupported metric {metric}, expected one of {METRICS}")
+
+    if name == "HNSW":
+        return IndexProfile(
+            index_type="HNSW",
+            metric=metric,
+            build_params={"M": m, "efConstruction": ef_construction},
+            search_defaults={"ef": ef},
+        )
+    if name in ("IVF_FLAT", "IVF_SQ8"):
+        return IndexProfile(
+            index_type=name,
+            metric=metric,
+            build_params={"nlist": nlist},
+            search_defaults={"nprobe": nprobe},
+        )
+    if name == "IVF_PQ":
+        return IndexProfile(
+            index_type="IVF_PQ",
+            metric=metric,
+            build_params={"nlist": nlist, "m": pq_m, "nbits": 8},
+            search_defaults={"nprobe": nprobe},
+        )
+    raise ValueError(
+        f"Unknown index profile {name}, expected HNSW, IVF_FLAT, IVF_SQ8 or IVF_PQ"
+    )
+
+
+def index_profile_from_settings(
+    config, name: str | None = None, metric: str | None = None
+) -> IndexProfile:
+    """Build the index profile configured in the milvus.index settings
+
+    :param _type_ config: milvus.index settings
+    :param str | None name: Profile overriding the configured one, defaults to None
+    :param str | None metric: Metric overriding the configured one, defaults to None
+    :return IndexProfile: Index profile
+    """
+    return build_index_profile(
+        name=name or config.profile,
+        metric=metric or config.metric,
+        m=config.m,
+        ef_construction=config.ef_construction,
+        ef=config.ef,
+        nlist=config.nlist,
+        nprobe=config.nprobe,
+        pq_m=config.pq_m,
+    )
@@ -0,0 +1,520 @@
+import asyncio
+import logging
+import random
+import re
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Dict, List
+
+from metrics import STAGE_ITEMS, observe_stage
+
+# openai is imported when the client is first used
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+logger = logging.getLogger(__name__)
+
+# Durations of the x-ratelimit-reset-* headers, like "1s", "6m0s" or "20ms"
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class LLMUnavailableError(Exception):
+    """The completion failed on every attempt, or the circuit breaker is open"""
+
+
+class TokenBucket:
+    """Rate limiter refilled continuously, waiters are served in arrival order"""
+
+    def __init__(self, per_minute: float, capacity: float | None = None) -> None:
+        """Initialise a full bucket
+
+        :param float per_minute: Tokens added per minute
+        :param float | None capacity: Largest burst, defaults to None (a minute worth of tokens)
+        """
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        """Add the tokens earned since the last update"""
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self, amount: float = 1):
+        """Take tokens, waiting until the bucket holds enough
+
+        :param float amount: Tokens to take, capped at the capacity, defaults to 1
+        """
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= amount
+
+    def try_acquire(self, amount: float = 1) -> bool:
+        """Take tokens only if they are available now and nobody is waiting
+
+        :param float amount: Tokens to take, defaults to 1
+        :return bool: Whether the tokens were taken
+        """
+        if self._lock.locked():
+            return False
+        self._refill()
+        if self._tokens < amount:
+            return False
+        self._tokens -= amount
+        return True
+
+    def refund(self, amount: float):
+        """Give back tokens taken in excess, or take the shortfall when negative
+
+        :param float amount: Tokens to give back
+        """
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class CircuitBreaker:
+    """Fails calls fast after consecutive failures, then lets a single trial call through"""
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0) -> None:
+        """Initialise a closed breaker
+
+        :param int failure_threshold: Consecutive failures opening the circuit, 0 disables it, defaults to 5
+        :param float reset_seconds: Seconds the circuit stays open before a trial call, defaults to 30.0
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        """State of the circuit
+
+        :return str: "closed", "open" or "half_open"
+        """
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.reset_seconds:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """Whether a call may go through, the first call after the cool down is the trial
+
+        :return bool: Whether to make the call
+        """
+        state = self.state
+        if state == "closed" or not self.failure_threshold:
+            return True
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self):
+        """Close the circuit"""
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        """Count a failure, opening the circuit at the threshold or when the trial failed"""
+        self._failures += 1
+        if self._trial or (
+            self.failure_threshold and self._failures >= self.failure_threshold
+        ):
+            if self._opened_at is None:
+                logger.warning("LLM circuit opened after %d failures", self._failures)
+            self._opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self):
+        """Let another call be the trial, when the trial was cancelled before an outcome"""
+        self._trial = False
+
+
+class LatencyWindow:
+    """Latencies of the most recent successful calls"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20) -> None:
+        """Initialise an empty window
+
+        :param int size: Number of latencies kept, defaults to 200
+        :param int min_samples: Latencies needed before a quantile is given, defaults to 20
+        """
+        self.min_samples = min_samples
+        self._latencies: deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        """Record a latency
+
+        :param float seconds: Latency of a call
+        """
+        self._latencies.append(seconds)
+
+    def quantile(self, q: float) -> float | None:
+        """Quantile of the recorded latencies
+
+        :param float q: Quantile, between 0 and 1
+        :return float | None: Latency, None until min_samples are recorded
+        """
+        if len(self._latencies) < self.min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+def _duration_seconds(value: str) -> float | None:
+    """Parse a duration of the x-ratelimit-reset-* headers
+
+    :param str value: Duration like "1s", "6m0s" or "20ms"
+    :return float | None: Seconds, None if the value is not a duration
+    """
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def retry_after_seconds(headers: Dict[str, str] | None) -> float | None:
+    """Seconds to wait before retrying, as asked by a rate limited response
+
+    :param Dict[str, str] | None headers: Headers of the error response
+    :return float | None: Seconds, None if the response does not say
+    """
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    # Otherwise wait for the exhausted limit to reset
+    resets = [
+        _duration_seconds(headers.get(f"x-ratelimit-reset-{limit}") or "")
+        for limit in ("requests", "tokens")
+        if headers.get(f"x-ratelimit-remaining-{limit}") == "0"
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+def _classify(error: Exception) -> tuple[bool, bool]:
+    """Whether an attempt error is worth retrying, and whether it means the LLM is failing
+
+    :param Exception error: Error raised by the attempt
+    :return tuple[bool, bool]: Retry, count as a circuit breaker failure
+    """
+    import openai
+
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError)):
+        return True, True
+    if isinstance(error, openai.APIStatusError):
+        status = error.status_code
+        # Throttling is handled by waiting, the LLM itself is up
+        if status in (408, 409, 429):
+            return True, False
+        if status >= 500:
+            return True, True
+    return False, False
+
+
+class ResilientLLMClient:
+    """Chat completions with deadlines, retries, rate limits, hedging and a circuit breaker
+
+    Every attempt has a timeout and every call a deadline covering its
+    retries. Transient errors are retried with jittered exponential backoff,
+    or after the wait asked by the rate limit headers. Attempts take from
+    the request and token buckets first. Completions still running after
+    the p95 latency can be hedged with a duplicate request, the first answer
+    wins. Consecutive timeouts, connection and server errors open the
+    circuit breaker, calls then fail fast until a trial call succeeds.
+    """
+
+    def __init__(
+        self,
+        client: "AsyncOpenAI",
+        count_tokens: Callable[[str], int],
+        timeout: float = 30.0,
+        deadline: float = 60.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        completion_tokens: int = 256,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_min_delay: float = 0.5,
+        circuit_failures: int = 5,
+        circuit_reset_seconds: float = 30.0,
+    ) -> None:
+        """Initialise the client
+
+        :param AsyncOpenAI client: OpenAI client, its own retries should be disabled
+        :param Callable[[str], int] count_tokens: Tokenizer counting the prompt tokens
+        :param float timeout: Seconds an attempt, or a pause in a stream, may take, defaults to 30.0
+        :param float deadline: Seconds a call may take over all its attempts, defaults to 60.0
+        :param int max_retries: Retries after the first attempt, defaults to 3
+        :param float backoff_base: Backoff ceiling of the first retry, doubled at each retry, defaults to 0.5
+        :param float backoff_max: Largest backoff ceiling, defaults to 8.0
+        :param float requests_per_minute: Request budget, 0 disables the limit, defaults to 0
+        :param float tokens_per_minute: Token budget, 0 disables the limit, defaults to 0
+        :param int completion_tokens: Completion tokens assumed when taking from the token budget, defaults to 256
+        :param bool hedge: Send a duplicate of completions slower than the hedge quantile, defaults to False
+        :param float hedge_quantile: Latency quantile after which a completion is hedged, defaults to 0.95
+        :param float hedge_min_delay: Shortest wait before hedging, defaults to 0.5
+        :param int circuit_failures: Consecutive failures opening the circuit, 0 disables it, defaults to 5
+        :param float circuit_reset_seconds: Seconds before a trial call when open, defaults to 30.0
+        """
+        self.client = client
+        self.count_tokens = count_tokens
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.completion_tokens = completion_tokens
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+
+        self.request_bucket = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.token_bucket = (
+            TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold=circuit_failures, reset_seconds=circuit_reset_seconds
+        )
+        self.latencies = LatencyWindow()
+
+    def estimate_tokens(self, messages: List[Dict]) -> int:
+        """Tokens a completion is expected to use, taken from the token budget
+
+        :param List[Dict] messages: Chat messages of the completion
+        :return int: Prompt tokens and the assumed completion tokens
+        """
+        prompt = sum(self.count_tokens(message["content"]) for message in messages)
+        return prompt + self.completion_tokens
+
+    async def _acquire(self, tokens: int):
+        """Take a request and the tokens of an attempt from the budgets
+
+        :param int tokens: Estimated tokens of the attempt
+        """
+        if self.request_bucket is None and self.token_bucket is None:
+            return
+        with observe_stage("llm_rate_limit"):
+            if self.request_bucket is not None:
+                await self.request_bucket.acquire()
+            if self.token_bucket is not None:
+                await self.token_bucket.acquire(tokens)
+
+    def _try_acquire(self, tokens: int) -> bool:
+        """Take a request and tokens only if the budgets have them now
+
+        :param int tokens: Estimated tokens of the attempt
+        :return bool: Whether the budgets were taken from
+        """
+        if self.request_bucket is not None and not self.request_bucket.try_acquire():
+            return False
+        if self.token_bucket is not None and not self.token_bucket.try_acquire(tokens):
+            if self.request_bucket is not None:
+                self.request_bucket.refund(1)
+            return False
+        return True
+
+    async def _timed(self, attempt: Awaitable, timeout: float):
+        """Run an attempt within its timeout, recording the latency of successes
+
+        :param Awaitable attempt: Attempt coroutine
+        :param float timeout: Seconds the attempt may take
+        :return _type_: Result of the attempt
+        """
+        start = time.perf_counter()
+        result = await asyncio.wait_for(attempt, timeout)
+        self.latencies.add(time.perf_counter() - start)
+        return result
+
+    async def _hedged(
+        self, attempt: Callable[[float], Awaitable], timeout: float, tokens: int
+    ):
+        """Run an attempt, racing a duplicate against it once it is slower than usual
+
+        :param Callable[[float], Awaitable] attempt: Makes an attempt coroutine from its timeout
+        :param float timeout: Seconds the attempt may take
+        :param int tokens: Estimated tokens of the attempt
+        :return _type_: Result of the first successful attempt
+        """
+        primary = asyncio.ensure_future(self._timed(attempt(timeout), timeout))
+        tasks = [primary]
+        try:
+            p95 = self.latencies.quantile(self.hedge_quantile)
+            delay = max(p95, self.hedge_min_delay) if p95 is not None else None
+            if delay is None or delay >= timeout:
+                return await primary
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            # A duplicate never waits for budget, it would no longer be early
+            if done or not self._try_acquire(tokens):
+                return await primary
+
+            STAGE_ITEMS.labels("llm_hedges").inc()
+            hedge = asyncio.ensure_future(
+                self._timed(attempt(timeout - delay), timeout - delay)
+            )
+            tasks.append(hedge)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            STAGE_ITEMS.labels("llm_hedge_wins").inc()
+                        return task.result()
+            raise primary.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _call(
+        self, attempt: Callable[[float], Awaitable], tokens: int, hedge: bool
+    ):
+        """Run attempts until one succeeds, the deadline passes or the error is final
+
+        :param Callable[[float], Awaitable] attempt: Makes an attempt coroutine from its timeout
+        :param int tokens: Estimated tokens of an attempt
+        :param bool hedge: Whether slow attempts are hedged
+        :raises LLMUnavailableError: If the circuit is open, or every attempt failed
+        :return _type_: Result of the successful attempt
+        """
+        deadline = time.monotonic() + self.deadline
+        for retry in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                STAGE_ITEMS.labels("llm_circuit_rejected").inc()
+                raise LLMUnavailableError("The LLM is failing, retry later")
+            try:
+                await asyncio.wait_for(
+                    self._acquire(tokens), max(0.0, deadline - time.monotonic())
+                )
+            except BaseException as e:
+                # Waiting for budget says nothing about the LLM
+                self.breaker.release()
+                if isinstance(e, asyncio.TimeoutError):
+                    raise LLMUnavailableError(
+                        "The LLM rate limits left no budget before the deadline"
+                    ) from e
+                raise
+            timeout = min(self.timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                self.breaker.release()
+                raise LLMUnavailableError("The LLM call deadline passed")
+            try:
+                if hedge:
+                    result = await self._hedged(attempt, timeout, tokens)
+                else:
+                    result = await self._timed(attempt(timeout), timeout)
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                retryable, failing = _classify(e)
+                if failing:
+                    self.breaker.record_failure()
+                else:
+                    # The LLM answered, only the request was refused
+                    self.breaker.record_success()
+                if not retryable:
+                    raise
+
+                headers = getattr(getattr(e, "response", None), "headers", None)
+                wait = retry_after_seconds(headers)
+                if wait is None:
+                    ceiling = min(self.backoff_max, self.backoff_base * 2**retry)
+                    wait = random.uniform(0, ceiling)
+                else:
+                    # Spread the clients told to come back at the same time
+                    wait += random.uniform(0, self.backoff_base)
+                if retry == self.max_retries or time.monotonic() + wait >= deadline:
+                    raise LLMUnavailableError(
+                        f"LLM call failed after {retry + 1} attempts: {e!r}"
+                    ) from e
+                logger.info("LLM attempt failed (%r), retrying in %.2fs", e, wait)
+                STAGE_ITEMS.labels("llm_retries").inc()
+                await asyncio.sleep(wait)
+            else:
+                self.breaker.record_success()
+                return result
+
+    async def create(self, **kwargs) -> "ChatCompletion":
+        """Create a chat completion
+
+        :return ChatCompletion: Completion, as returned by the OpenAI client
+        """
+        tokens = self.estimate_tokens(kwargs["messages"])
+        completion = await self._call(
+            lambda timeout: self.client.chat.completions.create(
+                **kwargs, timeout=timeout
+            ),
+            tokens=tokens,
+            hedge=self.hedge,
+        )
+        if self.token_bucket is not None and completion.usage is not None:
+            self.token_bucket.refund(tokens - completion.usage.total_tokens)
+        return completion
+
+    async def stream(self, **kwargs) -> AsyncIterator["ChatCompletionChunk"]:
+        """Stream a chat completion, attempts are retried until the stream opens
+
+        Streams are not hedged, nor retried once chunks were yielded.
+
+        :raises LLMUnavailableError: If the stream pauses for longer than the timeout
+        :yield AsyncIterator[ChatCompletionChunk]: Completion chunks
+        """
+        stream = await self._call(
+            lambda timeout: self.client.chat.completions.create(
+                **kwargs, stream=True, timeout=timeout
+            ),
+            tokens=self.estimate_tokens(kwargs["messages"]),
+            hedge=False,
+        )
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), self.timeout)
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError as e:
+                    STAGE_ITEMS.labels("llm_stream_stalls").inc()
+                    raise LLMUnavailableError(
+                        f"LLM stream paused for more than {self.timeout}s"
+                    ) from e
+                yield chunk
+        finally:
+            await stream.close()
@@ -0,0 +1,105 @@
+"""Copy the Milvus collection into one partitioned on doc_id
+
+Usage, from the document_qa directory::
+
+    python -m vector_search.migrate_collection --swap
+
+Collections created before doc_id became the partition key keep every chunk
+in a single partition, so per document searches and deletes scan all of
+them. The chunks are copied page by page into a new collection with the
+partition key layout and the configured index. With --swap, the old
+collection is renamed with a _backup suffix and the new one takes its name.
+
+Stop ingestion while it runs, chunks inserted or deleted in the old
+collection after the copy started are not carried over. Drop the backup
+once the app works against the new collection.
+"""
+
+import argparse
+import logging
+import time
+
+from config import settings
+from vector_search.index_profiles import index_profile_from_settings
+from vector_search.milvus_client import Milvus, build_schema
+
+logger = logging.getLogger(__name__)
+
+
+def migrate_collection(
+    target: str | None = None, batch_size: int = 1000, swap: bool = False
+) -> int:
+    """Copy the configured collection into a partition key collection
+
+    :param str | None target: Name of the new collection, defaults to None (the collection name with a _partitioned suffix)
+    :param int batch_size: Chunks copied per page, defaults to 1000
+    :param bool swap: Give the new collection the name of the old one, defaults to False
+    :raises RuntimeError: If the copy lost or duplicated chunks
+    :return int: Number of chunks copied
+    """
+    source_name = settings.milvus.collection_name
+    target_name = target or f"{source_name}_partitioned"
+    index_profile = index_profile_from_settings(settings.milvus.index)
+
+    def connect(collection_name: str) -> Milvus:
+        return Milvus(
+            uri=settings.milvus.uri,
+            token=settings.milvus.token,
+            collection_name=collection_name,
+            index_profile=index_profile,
+        )
+
+    source, destination = connect(source_name), connect(target_name)
+    try:
+        if source.has_partition_key():
+            logger.info("%s is already partitioned on doc_id", source_name)
+            return 0
+
+        destination.create_collection(
+            collection_name=target_name,
+            schema=build_schema(partition_key=True),
+            num_partitions=settings.milvus.num_partitions,
+        )
+        copied = 0
+        for batch in source.iter_entities(batch_size=batch_size):
+            destination.insert_to_collection(data=batch)
+            copied += len(batch)
+            logger.info("Copied %d chunks", copied)
+
+        expected, actual = source.count_entities(), destination.count_entities()
+        if actual != expected:
+            raise RuntimeError(
+                f"{target_name} holds {actual} chunks, "
+                f"{source_name} holds {expected}, keeping {source_name} in place"
+            )
+
+        if swap:
+            source.rename_collection(f"{source_name}_backup")
+            destination.rename_collection(source_name)
+            logger.info(
+                "%s is now partitioned, the old collection is %s_backup",
+                source_name,
+                source_name,
+            )
+        return copied
+    finally:
+        source.close_connection()
+        destination.close_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--target", help="New collection, <collection>_partitioned by default"
+    )
+    parser.add_argument("--batch-size", type=int, default=1000, help="Chunks per page")
+    parser.add_argument(
+        "--swap", action="store_true", help="Rename the new collection to the old name"
+    )
+    args = parser.parse_args()
+    start = time.perf_counter()
+    copied = migrate_collection(
+        target=args.target, batch_size=args.batch_size, swap=args.swap
+    )
+    logger.info("Migrated %d chunks in %.1fs", copied, time.perf_counter() - start)
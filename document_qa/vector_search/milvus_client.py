@@ -1,29 +1,92 @@
-from typing import Dict, List
+import json
+import logging
+from dataclasses import replace
+from typing import Dict, Iterator, List
 
-from pymilvus import CollectionSchema, DataType, FieldSchema, MilvusClient
+from metrics import observe_stage
+from pymilvus import (
+    Collection,
+    CollectionSchema,
+    DataType,
+    FieldSchema,
+    MilvusClient,
+    utility,
+)
+from vector_search.index_profiles import IndexProfile
+from vector_search.vector_store import (
+    DOCUMENT_NAME_MAX_LENGTH,
+    TEXT_MAX_LENGTH,
+    VectorStore,
+)
 
-# Scheme for the pdf_documents collection
-fields = [
-    FieldSchema(name="id", dtype=DataType.INT64, is_primary=True),
-    FieldSchema(name="doc_id", dtype=DataType.VARCHAR, max_length=36),
-    FieldSchema(name="document_name", dtype=DataType.VARCHAR, max_length=100),
-    FieldSchema(name="page_number", dtype=DataType.INT32),
-    FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=4096),
-    FieldSchema(name="embeddings", dtype=DataType.FLOAT_VECTOR, dim=768),
-]
+logger = logging.getLogger(__name__)
 
-schema = CollectionSchema(fields=fields)
+# Fields of the chunks, without the auto generated primary key
+ENTITY_FIELDS = ["doc_id", "document_name", "page_number", "text", "embeddings"]
+# Documents per delete expression, keeps the expressions short
+DELETE_BATCH_SIZE = 1000
 
 
-class Milvus:
+def build_schema(partition_key: bool = True) -> CollectionSchema:
+    """Scheme for the pdf_documents collection
+
+    With doc_id as partition key, Milvus hashes each document to one of the
+    collection partitions, and searches and deletes filtered on doc_id only
+    visit the partitions of the matching documents.
+
+    :param bool partition_key: Use doc_id as partition key, defaults to True
+    :return CollectionSchema: Schema of the collection
+    """
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True),
+        FieldSchema(
+            name="doc_id",
+            dtype=DataType.VARCHAR,
+            max_length=36,
+            is_partition_key=partition_key,
+        ),
+        FieldSchema(
+            name="document_name",
+            dtype=DataType.VARCHAR,
+            max_length=DOCUMENT_NAME_MAX_LENGTH,
+        ),
+        FieldSchema(name="page_number", dtype=DataType.INT32),
+        FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=TEXT_MAX_LENGTH),
+        FieldSchema(name="embeddings", dtype=DataType.FLOAT_VECTOR, dim=768),
+    ]
+    return CollectionSchema(fields=fields)
+
+
+schema = build_schema()
+
+
+def doc_id_filter(doc_id: str | List[str]) -> str:
+    """Filter expression matching the chunks of one or many documents
+
+    :param str | List[str] doc_id: Document id or ids
+    :return str: Milvus boolean expression with quoted and escaped ids
+    """
+    if isinstance(doc_id, str):
+        return f"doc_id == {json.dumps(doc_id)}"
+    return f"doc_id in {json.dumps(list(doc_id))}"
+
+
+class Milvus(VectorStore):
     """Milvus client"""
 
-    def __init__(self, uri: str, token: str, collection_name: str) -> None:
+    def __init__(
+        self,
+        uri: str,
+        token: str,
+        collection_name: str,
+        index_profile: IndexProfile | None = None,
+    ) -> None:
         """Initialise the milvus client
 
         :param str uri: Cluster endpoint
         :param str token: API key or a colon-separated cluster username and password
         :param str collection_name: Name of the collection to work with
+        :param IndexProfile | None index_profile: Index the collection is built and searched with, defaults to None (Milvus defaults)
         """
         self.client = MilvusClient(
             uri=uri,
@@ -31,6 +94,7 @@ class Milvus:
         )
 
         self.collection_name = collection_name
+        self.index_profile = index_profile
 
     def set_collection_name(self, collection_name: str):
         """Set the default collection name to work with
@@ -50,21 +114,29 @@ class Milvus:
         self,
         collection_name: str,
         schema: CollectionSchema,
-        index_params: dict = {
-            "metric_type": "L2",
-            "index_type": "IVF_FLAT",
-            "params": {"nlist": 1024},
-        },
+        index_params: dict | None = None,
         dimension: int = 768,
+        num_partitions: int | None = None,
     ) -> bool:
         """Create a new collection
 
         :param str collection_name: Name of the collection
         :param CollectionSchema schema: Schema of the collection
-        :param _type_ index_params: Parameters to index each documents, defaults to { "metric_type": "L2", "index_type": "IVF_FLAT", "params": {"nlist": 1024}, }
+        :param dict | None index_params: Parameters to index each documents, defaults to None (the index profile, else IVF_FLAT with nlist 1024 and L2)
         :param int dimension: Dimension of the vector field, defaults to 768
+        :param int | None num_partitions: Partitions the partition key hashes into, defaults to None (Milvus default of 64)
         :return bool: Status of the operation
         """
+        if index_params is None:
+            index_params = (
+                self.index_profile.index_params()
+                if self.index_profile is not None
+                else {
+                    "metric_type": "L2",
+                    "index_type": "IVF_FLAT",
+                    "params": {"nlist": 1024},
+                }
+            )
         try:
             self.client.create_collection_with_schema(
                 collection_name=collection_name,
@@ -72,6 +144,11 @@ class Milvus:
                 schema=schema,
                 auto_id=True,
                 index_params=index_params,
+                **(
+                    {"num_partitions": num_partitions}
+                    if num_partitions and schema.partition_key_field
+                    else {}
+                ),
             )
             self.collection_name = collection_name
             return True
@@ -94,51 +171,198 @@ class Milvus:
         """
         return self.client.describe_collection(collection_name=self.collection_name)
 
-    def insert_to_collection(self, data: List[Dict] | Dict):
-        """Insert data into collection
+    def has_partition_key(self) -> bool:
+        """Whether the collection is partitioned on doc_id
 
-        :param List[Dict] | Dict data: Data in the structure specified in the schema
-        :return _type_: List of index for the respective inserted data
+        :return bool: Whether doc_id is the partition key
         """
-        return self.client.insert(
-            collection_name=self.collection_name, data=data, progress_bar=True
+        return any(
+            field.get("is_partition_key", False)
+            for field in self.list_collection_info()["fields"]
+            if field["name"] == "doc_id"
         )
 
-    def delete_entity(self, doc_id: str | int | List[str | int]):
-        """Delete Entities from the collection
+    def count_entities(self) -> int:
+        """Number of chunks in the collection, deleted ones excluded
 
-        :param str | int | List[str  |  int] doc_id: List of doc id to delete
-        :return _type_: _description_
+        :return int: Number of chunks
         """
-        # query to get the list of primary keys to delete
         res = self.client.query(
             collection_name=self.collection_name,
-            filter=f"doc_id == '{doc_id}'",
-            output_fields=["id"],
+            filter="",
+            output_fields=["count(*)"],
+            consistency_level="Strong",
+        )
+        return res[0]["count(*)"]
+
+    def iter_entities(self, batch_size: int = 1000) -> Iterator[List[Dict]]:
+        """Page through every chunk of the collection, without primary keys
+
+        :param int batch_size: Chunks per page, defaults to 1000
+        :yield Iterator[List[Dict]]: Chunks in the structure of the pdf_documents schema
+        """
+        collection = Collection(self.collection_name, using=self.client._using)
+        iterator = collection.query_iterator(
+            batch_size=batch_size, output_fields=ENTITY_FIELDS
         )
-        id_list = [item["id"] for item in res]
-        return self.client.delete(collection_name=self.collection_name, pks=id_list)
+        try:
+            while batch := iterator.next():
+                yield [{field: row[field] for field in ENTITY_FIELDS} for row in batch]
+        finally:
+            iterator.close()
+
+    def rename_collection(self, new_name: str):
+        """Rename the collection and keep working with it under the new name
+
+        :param str new_name: New name of the collection
+        """
+        utility.rename_collection(
+            self.collection_name, new_name, using=self.client._using
+        )
+        self.collection_name = new_name
+
+    def rebuild_index(
+        self, index_profile: IndexProfile, field_name: str = "embeddings"
+    ):
+        """Replace the index of the vector field, searches fail until it is loaded again
+
+        :param IndexProfile index_profile: Index to build
+        :param str field_name: Vector field to index, defaults to "embeddings"
+        """
+        # MilvusClient cannot manage indexes, the ORM collection shares its connection
+        collection = Collection(self.collection_name, using=self.client._using)
+        collection.flush()
+        collection.release()
+        collection.drop_index()
+        collection.create_index(
+            field_name=field_name, index_params=index_profile.index_params()
+        )
+        collection.load()
+        self.index_profile = index_profile
+
+    def vector_index(self, field_name: str = "embeddings") -> Dict | None:
+        """Parameters the vector field is indexed with
+
+        :param str field_name: Vector field, defaults to "embeddings"
+        :return Dict | None: Index type, metric type and build parameters, None without a collection or index
+        """
+        if not utility.has_collection(self.collection_name, using=self.client._using):
+            return None
+        collection = Collection(self.collection_name, using=self.client._using)
+        for index in collection.indexes:
+            if index.field_name == field_name:
+                return index.params
+        return None
+
+    def match_index_metric(self):
+        """Search with the metric the collection is indexed with, when it is not the profile metric
+
+        Searching with another metric than the index fails, for example a
+        collection indexed with L2 before the index profiles existed.
+        """
+        if self.index_profile is None:
+            return
+        index = self.vector_index()
+        if index is None:
+            return
+        metric = index.get("metric_type")
+        index_type = index.get("index_type")
+        if metric != self.index_profile.metric or (
+            index_type != self.index_profile.index_type
+        ):
+            logger.warning(
+                "Collection %s is indexed as %s with %s, not as the configured %s with %s, "
+                "run vector_search.rebuild_index or update milvus.index",
+                self.collection_name,
+                index_type,
+                metric,
+                self.index_profile.index_type,
+                self.index_profile.metric,
+            )
+        if metric and metric != self.index_profile.metric:
+            self.index_profile = replace(self.index_profile, metric=metric)
+
+    def insert_to_collection(self, data: List[Dict] | Dict):
+        """Insert data into collection
+
+        :param List[Dict] | Dict data: Data in the structure specified in the schema
+        :return _type_: List of index for the respective inserted data
+        """
+        with observe_stage(
+            "milvus_insert", items=len(data) if isinstance(data, list) else 1
+        ):
+            return self.client.insert(collection_name=self.collection_name, data=data)
+
+    def delete_entity(self, doc_id: str | List[str]):
+        """Delete every chunk of one or many documents with a single filter
+
+        :param str | List[str] doc_id: Document id or ids to delete
+        """
+        if not doc_id:
+            return
+        with observe_stage(
+            "milvus_delete", items=1 if isinstance(doc_id, str) else len(doc_id)
+        ):
+            self.client.delete(
+                collection_name=self.collection_name, filter=doc_id_filter(doc_id)
+            )
+
+    def delete_pages(self, doc_id: str, page_numbers: List[int]):
+        """Delete the chunks of some pages of a document with a single filter
+
+        :param str doc_id: ID of the document
+        :param List[int] page_numbers: Page numbers, starting at 1, to delete
+        """
+        if not page_numbers:
+            return
+        with observe_stage("milvus_delete", items=1):
+            self.client.delete(
+                collection_name=self.collection_name,
+                filter=f"{doc_id_filter(doc_id)} and "
+                f"page_number in {json.dumps(sorted(page_numbers))}",
+            )
+
+    def delete_entities(self, doc_ids: List[str]):
+        """Delete every chunk of many documents, DELETE_BATCH_SIZE ids per filter
+
+        :param List[str] doc_ids: Document ids to delete
+        """
+        for start in range(0, len(doc_ids), DELETE_BATCH_SIZE):
+            self.delete_entity(doc_ids[start : start + DELETE_BATCH_SIZE])
 
     def vector_search(
         self,
         question_embedding: List[float],
         limit: int = 5,
         doc_id: str | None = None,
+        include_embeddings: bool = False,
+        search_params: Dict | None = None,
     ):
         """Perform vector search and retrieve relavant entities
 
         :param List[float] question_embedding: Vectorized question to query against
         :param int limit: Top k results, defaults to 5
         :param str | None doc_id: List of document to perform search against, defaults to None
+        :param bool include_embeddings: Return the chunk vectors in the entity as well, defaults to False
+        :param Dict | None search_params: nprobe or ef overriding the index profile defaults, defaults to None
         :return _type_: Top k entities including document name, page number and text
         """
-        return self.client.search(
-            collection_name=self.collection_name,
-            data=question_embedding,
-            filter=f"doc_id in {str(doc_id)}" if doc_id else None,
-            output_fields=["document_name", "page_number", "text"],
-            limit=limit,
-        )
+        with observe_stage("milvus_search", items=len(question_embedding)):
+            return self.client.search(
+                collection_name=self.collection_name,
+                data=question_embedding,
+                filter=doc_id_filter(doc_id) if doc_id else None,
+                output_fields=["document_name", "page_number", "text"]
+                + (["embeddings"] if include_embeddings else []),
+                limit=limit,
+                search_params=(
+                    self.index_profile.search_params(
+                        limit=limit, **(search_params or {})
+                    )
+                    if self.index_profile is not None
+                    else None
+                ),
+            )
 
     def close_connection(self):
         """Close the Milvus client connection
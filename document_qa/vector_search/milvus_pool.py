@@ -0,0 +1,164 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+from vector_search.index_profiles import IndexProfile
+from vector_search.milvus_client import Milvus
+from vector_search.vector_store import VectorStorePool
+
+logger = logging.getLogger(__name__)
+
+
+class MilvusPool(VectorStorePool):
+    """Fixed size pool of Milvus clients shared for the lifetime of the app"""
+
+    def __init__(
+        self,
+        uri: str,
+        token: str,
+        collection_name: str,
+        size: int = 4,
+        health_check_interval: float = 30.0,
+        acquire_timeout: float | None = None,
+        index_profile: IndexProfile | None = None,
+    ) -> None:
+        """Initialise the pool, clients are connected lazily on first use
+
+        :param str uri: Cluster endpoint
+        :param str token: API key or a colon-separated cluster username and password
+        :param str collection_name: Name of the collection to work with
+        :param int size: Maximum number of open clients, defaults to 4
+        :param float health_check_interval: Seconds an idle client is trusted before it is checked again, defaults to 30.0
+        :param float | None acquire_timeout: Seconds to wait for a free client, defaults to None (wait forever)
+        :param IndexProfile | None index_profile: Index the clients build and search the collection with, defaults to None
+        """
+        self.uri = uri
+        self.token = token
+        self.collection_name = collection_name
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.index_profile = index_profile
+
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        # Idle clients with the time they were last known to be healthy
+        self._idle: List[Tuple[Milvus, float]] = []
+        self._closed = False
+
+    def _connect(self) -> Milvus:
+        """Open a new client connection
+
+        :return Milvus: Connected Milvus client
+        """
+        client = Milvus(
+            uri=self.uri,
+            token=self.token,
+            collection_name=self.collection_name,
+            index_profile=self.index_profile,
+        )
+        try:
+            client.match_index_metric()
+        except Exception:
+            logger.warning(
+                "Could not read the index of %s", self.collection_name, exc_info=True
+            )
+        return client
+
+    @staticmethod
+    def _discard(client: Milvus):
+        """Close a client without raising
+
+        :param Milvus client: Client to close
+        """
+        try:
+            client.close_connection()
+        except Exception:
+            logger.debug("Failed to close Milvus client", exc_info=True)
+
+    @staticmethod
+    def is_healthy(client: Milvus) -> bool:
+        """Check that the client can still talk to the server
+
+        :param Milvus client: Client to check
+        :return bool: Whether the server answered
+        """
+        try:
+            client.list_collection()
+            return True
+        except Exception:
+            return False
+
+    def _checkout(self) -> Milvus:
+        """Take an idle client, reconnecting it if it fails its health check
+
+        :return Milvus: Healthy Milvus client
+        """
+        with self._lock:
+            idle = self._idle.pop() if self._idle else None
+
+        if idle is not None:
+            client, checked_at = idle
+            if time.monotonic() - checked_at < self.health_check_interval:
+                return client
+            if self.is_healthy(client):
+                return client
+            logger.warning("Milvus client failed its health check, reconnecting")
+            self._discard(client)
+
+        return self._connect()
+
+    @contextmanager
+    def acquire(self) -> Iterator[Milvus]:
+        """Borrow a client from the pool
+
+        :raises RuntimeError: If the pool is closed
+        :raises TimeoutError: If no client is freed within acquire_timeout
+        :yield Iterator[Milvus]: Milvus client, returned to the pool on exit
+        """
+        if self._closed:
+            raise RuntimeError("Milvus pool is closed")
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError("Timed out waiting for a Milvus client")
+
+        client = None
+        # A client interrupted mid call, e.g. by GeneratorExit or a cancellation,
+        # may have a request in flight and is never reused
+        keep = False
+        try:
+            client = self._checkout()
+            try:
+                yield client
+            except Exception:
+                # Only keep the client if the failure was not the connection itself
+                keep = self.is_healthy(client)
+                raise
+            keep = True
+        finally:
+            if client is not None:
+                if keep:
+                    self._release(client)
+                else:
+                    self._discard(client)
+            self._slots.release()
+
+    def _release(self, client: Milvus):
+        """Return a client to the idle list
+
+        :param Milvus client: Client to return
+        """
+        with self._lock:
+            if not self._closed:
+                self._idle.append((client, time.monotonic()))
+                return
+        self._discard(client)
+
+    def close(self):
+        """Close every idle client, borrowed clients are closed when returned"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for client, _ in idle:
+            self._discard(client)
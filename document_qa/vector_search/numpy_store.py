@@ -0,0 +1,429 @@
+import json
+import os
+import threading
+from typing import Dict, List
+
+import numpy as np
+from vector_search.vector_store import VectorStore
+
+OUTPUT_FIELDS = ("document_name", "page_number", "text")
+
+
+class NumpyVectorStore(VectorStore):
+    """In-process vector store backed by a contiguous float32 matrix"""
+
+    def __init__(
+        self,
+        dimension: int = 768,
+        metric: str = "L2",
+        path: str | None = None,
+        capacity: int = 1024,
+        checkpoint_rows: int = 10_000,
+    ) -> None:
+        """Initialise the store, loading it from disk when a path is given
+
+        :param int dimension: Dimension of the vectors, defaults to 768
+        :param str metric: L2, IP or COSINE, defaults to "L2"
+        :param str | None path: Base path of the memory-mapped matrix and its metadata, defaults to None (in memory only)
+        :param int capacity: Initial number of rows allocated, defaults to 1024
+        :param int checkpoint_rows: Logged rows before the metadata is rewritten, at least the rows of the last rewrite, defaults to 10_000
+        """
+        if metric not in ("L2", "IP", "COSINE"):
+            raise ValueError(f"Unsupported metric {metric}")
+        self.dimension = dimension
+        self.metric = metric
+        self.path = path
+        self.checkpoint_rows = checkpoint_rows
+
+        self._lock = threading.RLock()
+        self._size = 0
+        self._next_id = 0
+        # Row metadata, the row index is the position in the matrix
+        self._ids: List[int] = []
+        self._doc_ids: List[str | None] = []
+        self._entities: List[Dict | None] = []
+        self._rows_by_doc: Dict[str, List[int]] = {}
+        self._deleted = 0
+        # Writes since the last checkpoint are appended to the log of its generation
+        self._generation = 0
+        self._checkpointed_rows = 0
+        self._logged_rows = 0
+
+        if path and os.path.exists(self._meta_path):
+            self._load()
+        elif path and os.path.exists(self._matrix_path):
+            # Allocating would truncate a matrix whose rows are unknown
+            raise ValueError(
+                f"{self._matrix_path} has no metadata file {self._meta_path}"
+            )
+        else:
+            self._vectors = self._allocate(capacity)
+            self._checkpoint()
+
+    @property
+    def _matrix_path(self) -> str:
+        """Path of the memory-mapped matrix"""
+        return f"{self.path}.f32"
+
+    @property
+    def _meta_path(self) -> str:
+        """Path of the row metadata"""
+        return f"{self.path}.json"
+
+    def _log_path(self, generation: int) -> str:
+        """Path of the write log following a checkpoint
+
+        :param int generation: Generation of the checkpoint
+        :return str: Path of the log
+        """
+        return f"{self.path}.{generation}.log"
+
+    def _allocate(self, capacity: int, path: str | None = None) -> np.ndarray:
+        """Allocate the matrix, memory-mapped when the store has a path
+
+        :param int capacity: Number of rows
+        :param str | None path: File of the memory map, defaults to None (the matrix path)
+        :return np.ndarray: Zeroed (capacity, dimension) float32 matrix
+        """
+        shape = (max(capacity, 1), self.dimension)
+        if self.path:
+            return np.lib.format.open_memmap(
+                path or self._matrix_path, mode="w+", dtype=np.float32, shape=shape
+            )
+        return np.zeros(shape, dtype=np.float32)
+
+    def _load(self):
+        """Load the last checkpoint, replay the log written since and memory-map the matrix"""
+        with open(self._meta_path) as f:
+            meta = json.load(f)
+        self._vectors = np.load(self._matrix_path, mmap_mode="r+")
+        self._next_id = meta["next_id"]
+        self._generation = meta.get("generation", 0)
+        for row in meta["rows"]:
+            self._append_row(row["id"], row["doc_id"], row["entity"])
+        self._checkpointed_rows = self._size
+        # Left behind by a crash right after the last checkpoint
+        if os.path.exists(self._log_path(self._generation - 1)):
+            os.remove(self._log_path(self._generation - 1))
+
+        log_path = self._log_path(self._generation)
+        if not os.path.exists(log_path):
+            return
+        with open(log_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Only the last write can be torn by a crash
+                    break
+                self._replay(entry)
+
+    def _replay(self, entry: Dict):
+        """Apply a write of the log, the lock must be held
+
+        :param Dict entry: Logged insert or delete
+        """
+        if entry["op"] == "insert":
+            for row in entry["rows"]:
+                self._append_row(row["id"], row["doc_id"], row["entity"])
+            self._next_id = max(self._next_id, entry["next_id"])
+            self._logged_rows += len(entry["rows"])
+        else:
+            self._delete_rows(entry["doc_id"], entry["pages"])
+            self._logged_rows += 1
+
+    def _log(self, entry: Dict, rows: int):
+        """Append a write to the log, checkpointing once the log outgrows the metadata
+
+        The matrix rows are written through the memory map before their
+        metadata is logged, the page cache keeps both across a process crash.
+        The lock must be held.
+
+        :param Dict entry: Insert or delete to log
+        :param int rows: Number of rows the write touched
+        """
+        if not self.path:
+            return
+        with open(self._log_path(self._generation), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        self._logged_rows += rows
+        # Rewriting at most once per doubling keeps the rewrites linear overall
+        if self._logged_rows > max(self._checkpointed_rows, self.checkpoint_rows):
+            self._checkpoint()
+
+    def _checkpoint(self):
+        """Flush the matrix, rewrite the metadata of its rows and start a new log
+
+        The lock must be held.
+        """
+        if not self.path:
+            return
+        self._vectors.flush()
+        rows = [
+            {"id": pk, "doc_id": doc_id, "entity": entity}
+            for pk, doc_id, entity in zip(self._ids, self._doc_ids, self._entities)
+        ]
+        # Written aside then renamed, a crash never leaves half a file. The
+        # new generation ignores the old log even if removing it fails
+        generation = self._generation + 1
+        temporary = f"{self._meta_path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(
+                {"next_id": self._next_id, "generation": generation, "rows": rows}, f
+            )
+        os.replace(temporary, self._meta_path)
+        old_log = self._log_path(self._generation)
+        self._generation = generation
+        self._checkpointed_rows = self._size
+        self._logged_rows = 0
+        if os.path.exists(old_log):
+            os.remove(old_log)
+
+    def _append_row(self, pk: int, doc_id: str | None, entity: Dict | None) -> int:
+        """Register the metadata of the next row, the lock must be held
+
+        :param int pk: Primary key of the chunk
+        :param str | None doc_id: ID of the document of the chunk, None once deleted
+        :param Dict | None entity: Output fields of the chunk, None once deleted
+        :return int: Row index
+        """
+        row = self._size
+        self._ids.append(pk)
+        self._doc_ids.append(doc_id)
+        self._entities.append(entity)
+        if doc_id is None:
+            self._deleted += 1
+        else:
+            self._rows_by_doc.setdefault(doc_id, []).append(row)
+        self._size += 1
+        return row
+
+    def _prepare(self, vectors: np.ndarray) -> np.ndarray:
+        """Normalise vectors when the metric is cosine
+
+        :param np.ndarray vectors: (n, dimension) float32 vectors
+        :return np.ndarray: Vectors ready to be stored or queried
+        """
+        if self.metric != "COSINE":
+            return vectors
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _grow(self, rows: int):
+        """Make room for more rows by doubling the matrix, the lock must be held
+
+        :param int rows: Number of rows about to be added
+        """
+        capacity = self._vectors.shape[0]
+        if self._size + rows <= capacity:
+            return
+        while capacity < self._size + rows:
+            capacity *= 2
+        if not self.path:
+            vectors = self._allocate(capacity)
+            vectors[: self._size] = self._vectors[: self._size]
+            self._vectors = vectors
+            return
+        # The saved matrix stays intact until the larger copy replaces it
+        temporary = f"{self._matrix_path}.tmp"
+        vectors = self._allocate(capacity, temporary)
+        vectors[: self._size] = self._vectors[: self._size]
+        vectors.flush()
+        os.replace(temporary, self._matrix_path)
+        self._vectors = vectors
+
+    def _compact(self):
+        """Drop the rows of deleted chunks, the lock must be held"""
+        alive = [row for row in range(self._size) if self._doc_ids[row] is not None]
+        vectors = np.array(self._vectors[alive])
+        ids = [self._ids[row] for row in alive]
+        doc_ids = [self._doc_ids[row] for row in alive]
+        entities = [self._entities[row] for row in alive]
+
+        self._size = 0
+        self._deleted = 0
+        self._ids, self._doc_ids, self._entities = [], [], []
+        self._rows_by_doc = {}
+        for pk, doc_id, entity in zip(ids, doc_ids, entities):
+            self._append_row(pk, doc_id, entity)
+        self._vectors[: len(alive)] = vectors
+
+    def insert_to_collection(self, data: List[Dict] | Dict) -> List[int]:
+        """Insert chunks with their embeddings
+
+        :param List[Dict] | Dict data: Chunks in the structure of the pdf_documents schema
+        :return List[int]: Primary keys of the inserted chunks
+        """
+        data = [data] if isinstance(data, dict) else data
+        if not data:
+            return []
+        vectors = self._prepare(
+            np.asarray([item["embeddings"] for item in data], dtype=np.float32)
+        )
+
+        with self._lock:
+            self._grow(len(data))
+            start = self._size
+            pks = []
+            for item in data:
+                pk = self._next_id
+                self._next_id += 1
+                self._append_row(
+                    pk, item["doc_id"], {field: item[field] for field in OUTPUT_FIELDS}
+                )
+                pks.append(pk)
+            self._vectors[start : self._size] = vectors
+            self._log(
+                {
+                    "op": "insert",
+                    "next_id": self._next_id,
+                    "rows": [
+                        {
+                            "id": pk,
+                            "doc_id": self._doc_ids[row],
+                            "entity": self._entities[row],
+                        }
+                        for row, pk in zip(range(start, self._size), pks)
+                    ],
+                },
+                rows=len(pks),
+            )
+        return pks
+
+    def _delete_rows(self, doc_id: str, page_numbers: List[int] | None):
+        """Mark the rows of a document as deleted, the lock must be held
+
+        :param str doc_id: ID of the document
+        :param List[int] | None page_numbers: Page numbers to delete, None for every page
+        """
+        pages = None if page_numbers is None else set(page_numbers)
+        kept = []
+        for row in self._rows_by_doc.pop(doc_id, []):
+            if pages is None or self._entities[row]["page_number"] in pages:
+                self._doc_ids[row] = None
+                self._entities[row] = None
+                self._deleted += 1
+            else:
+                kept.append(row)
+        if kept:
+            self._rows_by_doc[doc_id] = kept
+
+    def _delete(self, doc_id: str, page_numbers: List[int] | None):
+        """Delete rows, log it and compact once most rows are deleted
+
+        :param str doc_id: ID of the document
+        :param List[int] | None page_numbers: Page numbers to delete, None for every page
+        """
+        with self._lock:
+            self._delete_rows(doc_id, page_numbers)
+            self._log({"op": "delete", "doc_id": doc_id, "pages": page_numbers}, rows=1)
+            if self._deleted > self._size // 2:
+                # The rows move, the logged positions no longer hold
+                self._compact()
+                self._checkpoint()
+
+    def delete_entity(self, doc_id: str):
+        """Delete every chunk of a document
+
+        :param str doc_id: ID of the document to delete
+        """
+        self._delete(doc_id, None)
+
+    def delete_pages(self, doc_id: str, page_numbers: List[int]):
+        """Delete the chunks of some pages of a document
+
+        :param str doc_id: ID of the document
+        :param List[int] page_numbers: Page numbers, starting at 1, to delete
+        """
+        self._delete(doc_id, list(page_numbers))
+
+    def _candidate_rows(self, doc_id: str | List[str] | None) -> np.ndarray:
+        """Rows a search is restricted to, the lock must be held
+
+        :param str | List[str] | None doc_id: Documents to perform search against
+        :return np.ndarray: Row indexes
+        """
+        if doc_id is None:
+            if not self._deleted:
+                return np.arange(self._size)
+            return np.array(
+                [row for row in range(self._size) if self._doc_ids[row] is not None],
+                dtype=np.int64,
+            )
+        doc_ids = [doc_id] if isinstance(doc_id, str) else doc_id
+        rows = [row for d in doc_ids for row in self._rows_by_doc.get(d, [])]
+        return np.asarray(sorted(rows), dtype=np.int64)
+
+    def vector_search(
+        self,
+        question_embedding: List[List[float]],
+        limit: int = 5,
+        doc_id: str | List[str] | None = None,
+        include_embeddings: bool = False,
+        search_params: Dict | None = None,
+    ) -> List[List[Dict]]:
+        """Retrieve the top k chunks of each query vector
+
+        :param List[List[float]] question_embedding: Vectorised questions to query against
+        :param int limit: Top k results, defaults to 5
+        :param str | List[str] | None doc_id: Documents to perform search against, defaults to None
+        :param bool include_embeddings: Return the chunk vectors in the entity as well, defaults to False
+        :param Dict | None search_params: ANN recall and latency knobs, nprobe or ef, ignored by exact stores, defaults to None
+        :return List[List[Dict]]: Hits of each query with id, distance and the document name, page number and text entity
+        """
+        queries = self._prepare(
+            np.atleast_2d(np.asarray(question_embedding, dtype=np.float32))
+        )
+
+        with self._lock:
+            rows = self._candidate_rows(doc_id)
+            if not len(rows):
+                return [[] for _ in queries]
+            vectors = (
+                self._vectors[rows]
+                if len(rows) < self._size
+                else self._vectors[: self._size]
+            )
+
+            if self.metric == "L2":
+                # Squared distances like Milvus, smaller is closer
+                scores = (
+                    np.einsum("ij,ij->i", vectors, vectors)[None, :]
+                    - 2 * queries @ vectors.T
+                    + np.einsum("ij,ij->i", queries, queries)[:, None]
+                )
+            else:
+                # Larger is closer, negated so the same top k selection applies
+                scores = -(queries @ vectors.T)
+
+            k = min(limit, len(rows))
+            top = np.argpartition(scores, k - 1, axis=1)[:, :k]
+            results = []
+            for query, candidates in enumerate(top):
+                candidates = candidates[np.argsort(scores[query, candidates])]
+                hits = []
+                for candidate in candidates:
+                    row = int(rows[candidate])
+                    score = float(scores[query, candidate])
+                    entity = dict(self._entities[row])
+                    if include_embeddings:
+                        entity["embeddings"] = self._vectors[row].tolist()
+                    hits.append(
+                        {
+                            "id": self._ids[row],
+                            "distance": (
+                                max(score, 0.0) if self.metric == "L2" else -score
+                            ),
+                            "entity": entity,
+                        }
+                    )
+                results.append(hits)
+            return results
+
+    def close_connection(self):
+        """Compact the store and flush it to disk"""
+        if not self.path:
+            return
+        with self._lock:
+            self._compact()
+            self._checkpoint()
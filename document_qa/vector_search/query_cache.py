@@ -0,0 +1,209 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Tuple
+
+
+class QueryEmbeddingCache:
+    """LRU cache of query embeddings with TTL and single-flight computation"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0) -> None:
+        """Initialise the cache
+
+        :param int max_size: Maximum number of cached queries, defaults to 1024
+        :param float ttl: Seconds an embedding stays valid, defaults to 3600.0
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, Tuple[float, List[float]]] = OrderedDict()
+        # Futures are set running, a waiter giving up cannot cancel them
+        self._in_flight: Dict[str, Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Normalise the question text used as the cache key
+
+        :param str text: Question text
+        :return str: Case folded text with collapsed whitespace
+        """
+        return " ".join(text.casefold().split())
+
+    def get_or_compute(
+        self, text: str, compute: Callable[[str], List[float]]
+    ) -> List[float]:
+        """Return the cached embedding of the text, computing it once if missing
+
+        Concurrent callers asking for the same missing text wait for the
+        first caller's computation instead of running the model again.
+
+        :param str text: Question text
+        :param Callable[[str], List[float]] compute: Function vectorising the text
+        :return List[float]: Vectorised text
+        """
+        key = self.normalize(text)
+        owner = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, embedding = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return embedding
+                del self._entries[key]
+
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                future = self._in_flight[key] = Future()
+                future.set_running_or_notify_cancel()
+                self.misses += 1
+                owner = True
+
+        if not owner:
+            return future.result()
+
+        try:
+            embedding = compute(text)
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._in_flight.pop(key, None)
+        future.set_result(embedding)
+        return embedding
+
+    def get_many(self, texts: List[str]) -> Dict[int, List[float]]:
+        """Look up the cached embeddings of many texts without computing the missing ones
+
+        :param List[str] texts: Question texts
+        :return Dict[int, List[float]]: Embeddings found, by position in texts
+        """
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for position, text in enumerate(texts):
+                key = self.normalize(text)
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    found[position] = entry[1]
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, texts: List[str], embeddings: List[List[float]]):
+        """Cache the embeddings of many texts
+
+        :param List[str] texts: Question texts
+        :param List[List[float]] embeddings: Embeddings of the texts, in the same order
+        """
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = self.normalize(text)
+                self._entries[key] = (expires_at, embedding)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def claim_many(
+        self, texts: List[str]
+    ) -> Tuple[Dict[int, List[float]], Dict[int, Future], List[int]]:
+        """Look up many texts, claiming the computation of the missing ones nobody computes yet
+
+        The caller computes the claimed texts and hands them to resolve_many,
+        or to fail_many, the other callers asking for them wait on futures.
+
+        :param List[str] texts: Question texts
+        :return Tuple[Dict[int, List[float]], Dict[int, Future], List[int]]: Embeddings found and futures of the texts computed elsewhere, by position in texts, and the claimed positions
+        """
+        found: Dict[int, List[float]] = {}
+        waiting: Dict[int, Future] = {}
+        claimed: List[int] = []
+        now = time.monotonic()
+        with self._lock:
+            for position, text in enumerate(texts):
+                key = self.normalize(text)
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    found[position] = entry[1]
+                    self.hits += 1
+                    continue
+
+                future = self._in_flight.get(key)
+                if future is not None:
+                    # Also a repeat of a text claimed earlier in this call
+                    waiting[position] = future
+                    self.coalesced += 1
+                else:
+                    future = self._in_flight[key] = Future()
+                    future.set_running_or_notify_cancel()
+                    claimed.append(position)
+                    self.misses += 1
+        return found, waiting, claimed
+
+    def resolve_many(self, texts: List[str], embeddings: List[List[float]]):
+        """Cache the embeddings of claimed texts and hand them to the waiting callers
+
+        :param List[str] texts: Claimed question texts
+        :param List[List[float]] embeddings: Embeddings of the texts, in the same order
+        """
+        self.put_many(texts, embeddings)
+        with self._lock:
+            futures = [
+                self._in_flight.pop(self.normalize(text), None) for text in texts
+            ]
+        for future, embedding in zip(futures, embeddings):
+            if future is not None:
+                future.set_result(embedding)
+
+    def fail_many(self, texts: List[str], error: BaseException):
+        """Release claimed texts whose computation failed, failing the waiting callers
+
+        :param List[str] texts: Claimed question texts
+        :param BaseException error: Error of the computation
+        """
+        if not isinstance(error, Exception):
+            # A cancelled owner must not look like a cancellation of the waiters
+            error = RuntimeError(f"Query embedding interrupted: {error!r}")
+        with self._lock:
+            futures = [
+                self._in_flight.pop(self.normalize(text), None) for text in texts
+            ]
+        for future in futures:
+            if future is not None:
+                future.set_exception(error)
+
+    def clear(self):
+        """Drop every cached embedding"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of the cache
+
+        :return Dict[str, int]: Size, hits, misses and coalesced lookups
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
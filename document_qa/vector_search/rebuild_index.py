@@ -0,0 +1,61 @@
+"""Rebuild the index of the Milvus collection in place
+
+Usage, from the document_qa directory::
+
+    python -m vector_search.rebuild_index --profile IVF_SQ8 --metric IP
+
+The profile and metric default to the milvus.index settings. The collection
+is released while the index is rebuilt, so searches fail until it is loaded
+again. Update milvus.index to match before restarting the app.
+"""
+
+import argparse
+import logging
+import time
+
+from config import settings
+from vector_search.index_profiles import index_profile_from_settings
+from vector_search.milvus_client import Milvus
+
+logger = logging.getLogger(__name__)
+
+
+def rebuild_index(profile: str | None = None, metric: str | None = None) -> float:
+    """Drop and rebuild the index of the configured collection
+
+    :param str | None profile: Index profile to build, defaults to None (milvus.index.profile)
+    :param str | None metric: L2, COSINE or IP, defaults to None (milvus.index.metric)
+    :return float: Seconds the collection was unavailable
+    """
+    index_profile = index_profile_from_settings(
+        settings.milvus.index, name=profile, metric=metric
+    )
+    client = Milvus(
+        uri=settings.milvus.uri,
+        token=settings.milvus.token,
+        collection_name=settings.milvus.collection_name,
+    )
+    try:
+        start = time.perf_counter()
+        client.rebuild_index(index_profile=index_profile)
+        elapsed = time.perf_counter() - start
+    finally:
+        client.close_connection()
+
+    logger.info(
+        "Rebuilt %s as %s",
+        settings.milvus.collection_name,
+        index_profile.index_params(),
+    )
+    return elapsed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profile", help="HNSW, IVF_FLAT, IVF_SQ8 or IVF_PQ")
+    parser.add_argument("--metric", help="L2, COSINE or IP")
+    args = parser.parse_args()
+    logger.info(
+        "Done in %.1fs", rebuild_index(profile=args.profile, metric=args.metric)
+    )
@@ -1,19 +1,161 @@
-from typing import List, Dict, Tuple
+import asyncio
+import threading
+import time
+from functools import cached_property
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Tuple
 
 import numpy as np
-from langchain_community.embeddings import HuggingFaceInstructEmbeddings
-from openai import OpenAI
 from config import settings
+from metrics import STAGE_ITEMS, STAGE_SECONDS, observe_stage
+from vector_search.context_builder import BuiltContext, ContextBuilder
+from vector_search.embedding_backends import load_embedding_model
+from vector_search.embedding_scheduler import EmbeddingScheduler
+from vector_search.llm_client import ResilientLLMClient
+from vector_search.query_cache import QueryEmbeddingCache
+
+# langchain, torch and openai are imported when the model and client are first used
+if TYPE_CHECKING:
+    from langchain_community.embeddings import HuggingFaceInstructEmbeddings
+    from openai import AsyncOpenAI
+
+# Instructions of the instructor model, the document one is part of the embedding identity
+EMBED_INSTRUCTION = "Represent the document for retrieval: "
+QUERY_INSTRUCTION = "Represent the query for retrieval: "
 
 
 class TextEmbedding:
     """Text Embedder to vectorise text and to generate response"""
 
-    def __init__(self) -> None:
-        self.model = HuggingFaceInstructEmbeddings(
-            query_instruction="Represent the query for retrieval: "
+    def __init__(self, model: "HuggingFaceInstructEmbeddings | None" = None) -> None:
+        """Initialise the embedder, the model is loaded on first use or by load
+
+        :param HuggingFaceInstructEmbeddings | None model: Embedding model, defaults to None (the instructor model)
+        """
+        self._model = model
+        self._model_lock = threading.Lock()
+        self.model_name = (
+            model.model_name if model is not None else settings.embedding.model_name
+        )
+        self.embed_instruction = (
+            model.embed_instruction if model is not None else EMBED_INSTRUCTION
         )
-        self.open_ai = OpenAI(api_key=settings.open_ai.api_key)
+        self.query_instruction = (
+            model.query_instruction if model is not None else QUERY_INSTRUCTION
+        )
+        self.backend = settings.embedding.backend if model is None else "fp32"
+        # Bounds the completions in flight across every request
+        self.llm_semaphore = asyncio.Semaphore(settings.open_ai.max_concurrency)
+        self.query_cache = QueryEmbeddingCache(
+            max_size=settings.embedding.query_cache_size,
+            ttl=settings.embedding.query_cache_ttl,
+        )
+        self.context_builder = ContextBuilder(
+            token_budget=settings.context.token_budget,
+            model=settings.open_ai.model,
+            mmr_lambda=settings.context.mmr_lambda,
+            duplicate_threshold=settings.context.duplicate_threshold,
+        )
+        # Set by the app lifespan, callers then share model calls through it
+        self.scheduler: EmbeddingScheduler | None = None
+
+    @property
+    def model(self) -> "HuggingFaceInstructEmbeddings":
+        """Embedding model, loaded by the first caller while the others wait
+
+        :return HuggingFaceInstructEmbeddings: Embedding model
+        """
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    with observe_stage("model_load"):
+                        self._model = load_embedding_model(
+                            backend=self.backend,
+                            model_name=self.model_name,
+                            embed_instruction=EMBED_INSTRUCTION,
+                            query_instruction=QUERY_INSTRUCTION,
+                            batch_size=settings.embedding.batch_size,
+                            threads=settings.embedding.threads,
+                            interop_threads=settings.embedding.interop_threads,
+                        )
+        return self._model
+
+    @cached_property
+    def open_ai(self) -> "AsyncOpenAI":
+        """OpenAI client
+
+        :return AsyncOpenAI: Async OpenAI client
+        """
+        from openai import AsyncOpenAI
+
+        return AsyncOpenAI(
+            api_key=settings.open_ai.api_key,
+            base_url=settings.open_ai.base_url or None,
+            # Retries are left to the llm client, with its deadline and breaker
+            max_retries=0,
+        )
+
+    @cached_property
+    def llm(self) -> ResilientLLMClient:
+        """Completion client with timeouts, retries, rate limits and hedging
+
+        :return ResilientLLMClient: Wrapper of the OpenAI client
+        """
+        return ResilientLLMClient(
+            client=self.open_ai,
+            count_tokens=self.context_builder.count_tokens,
+            timeout=settings.open_ai.timeout,
+            deadline=settings.open_ai.deadline,
+            max_retries=settings.open_ai.max_retries,
+            backoff_base=settings.open_ai.backoff_base,
+            backoff_max=settings.open_ai.backoff_max,
+            requests_per_minute=settings.open_ai.requests_per_minute,
+            tokens_per_minute=settings.open_ai.tokens_per_minute,
+            completion_tokens=settings.open_ai.completion_tokens,
+            hedge=settings.open_ai.hedge,
+            hedge_quantile=settings.open_ai.hedge_quantile,
+            hedge_min_delay=settings.open_ai.hedge_min_delay,
+            circuit_failures=settings.open_ai.circuit_failures,
+            circuit_reset_seconds=settings.open_ai.circuit_reset_seconds,
+        )
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the embedding model is loaded
+
+        :return bool: Whether the model is loaded
+        """
+        return self._model is not None
+
+    def load(self):
+        """Load the embedding model, the OpenAI client and the tokenizer"""
+        self.model
+        self.llm
+        self.context_builder.count_tokens("")
+
+    def warm_up(self):
+        """Run a dummy batch and query through the model, outside the caches"""
+        self.model.embed_documents(
+            ["Warm up the embedding model."] * settings.embedding.batch_size
+        )
+        self.model.embed_query("Warm up the embedding model?")
+
+    @property
+    def model_id(self) -> str:
+        """Identifier of the document embeddings, the model and its instruction
+
+        :return str: Model name, document instruction and the backend unless fp32
+        """
+        model_id = f"{self.model_name}|{self.embed_instruction}"
+        # Quantized vectors are close to but not the same as the fp32 ones
+        return model_id if self.backend == "fp32" else f"{model_id}|{self.backend}"
+
+    def encode(self, instruction_pairs: List[List[str]]) -> np.ndarray:
+        """Run the model on [instruction, text] pairs, the scheduler batch call
+
+        :param List[List[str]] instruction_pairs: Instructions and texts to vectorise
+        :return np.ndarray: Vectorised texts, one row per pair
+        """
+        return self.model.client.encode(instruction_pairs, **self.model.encode_kwargs)
 
     def embed_documents(self, text: List[str]) -> List[float]:
         """Vectorise a chunk of text
@@ -23,13 +165,115 @@ class TextEmbedding:
         """
         return np.ravel(self.model.embed_documents([text])).tolist()
 
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Vectorise a batch of chunks with a single model call
+
+        :param List[str] texts: Chunks of text to vectorise
+        :return List[List[float]]: Vectorised chunks, in the same order as the input
+        """
+        if self.scheduler is not None:
+            return self.scheduler.embed(self.embed_instruction, texts)
+        with observe_stage("embed_documents", items=len(texts)):
+            return self.model.embed_documents(texts)
+
     def embed_query(self, query: str) -> List[float]:
         """Vectorise the query text
 
         :param str query: Query text to vectorise
         :return List[float]: Vectorised query
         """
-        return [self.model.embed_query(query)]
+        return [self.query_cache.get_or_compute(query, self._embed_query_uncached)]
+
+    def _embed_query_uncached(self, query: str) -> List[float]:
+        """Run the model on a query missing from the cache
+
+        :param str query: Query text to vectorise
+        :return List[float]: Vectorised query
+        """
+        if self.scheduler is not None:
+            return self.scheduler.embed(self.query_instruction, [query], query=True)[0]
+        with observe_stage("embed_query", items=1):
+            return self.model.embed_query(query)
+
+    def _encode_queries(self, queries: List[str]) -> List[List[float]]:
+        """Run the model once on query texts missing from the cache
+
+        :param List[str] queries: Query texts to vectorise
+        :return List[List[float]]: Vectorised queries, in the same order as the input
+        """
+        if self.scheduler is not None:
+            return self.scheduler.embed(self.query_instruction, queries, query=True)
+        instruction_pairs = [[self.query_instruction, query] for query in queries]
+        with observe_stage("embed_query", items=len(queries)):
+            return self.encode(instruction_pairs).tolist()
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Vectorise many query texts, running the model once for the uncached ones
+
+        Queries another request is already vectorising are waited for rather
+        than computed again.
+
+        :param List[str] queries: Query texts to vectorise
+        :return List[List[float]]: Vectorised queries, in the same order as the input
+        """
+        embeddings, waiting, claimed = self.query_cache.claim_many(queries)
+        if claimed:
+            claimed_queries = [queries[position] for position in claimed]
+            try:
+                computed = self._encode_queries(claimed_queries)
+            except BaseException as e:
+                self.query_cache.fail_many(claimed_queries, e)
+                raise
+            self.query_cache.resolve_many(claimed_queries, computed)
+            embeddings.update(zip(claimed, computed))
+        for position, future in waiting.items():
+            embeddings[position] = future.result()
+
+        return [embeddings[position] for position in range(len(queries))]
+
+    async def aembed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Vectorise many query texts through the scheduler, from the event loop
+
+        Cached queries return right away, the others wait for a shared model
+        call, or for the request already vectorising them, without holding a
+        thread.
+
+        :param List[str] queries: Query texts to vectorise
+        :raises RuntimeError: If no scheduler is attached
+        :return List[List[float]]: Vectorised queries, in the same order as the input
+        """
+        if self.scheduler is None:
+            raise RuntimeError("No embedding scheduler attached")
+
+        embeddings, waiting, claimed = self.query_cache.claim_many(queries)
+        if claimed:
+            claimed_queries = [queries[position] for position in claimed]
+            try:
+                computed = await self.scheduler.aembed(
+                    self.query_instruction, claimed_queries, query=True
+                )
+            except BaseException as e:
+                self.query_cache.fail_many(claimed_queries, e)
+                raise
+            self.query_cache.resolve_many(claimed_queries, computed)
+            embeddings.update(zip(claimed, computed))
+        for position, future in waiting.items():
+            embeddings[position] = await asyncio.wrap_future(future)
+
+        return [embeddings[position] for position in range(len(queries))]
+
+    def build_context(
+        self, entities: List[List[Dict]], query_embedding: List[float] | None = None
+    ) -> BuiltContext:
+        """Pack the hits of a vector search into a token budgeted context
+
+        :param List[List[Dict]] entities: Output from the vector search
+        :param List[float] | None query_embedding: Vectorised question, enables MMR when the hits carry embeddings, defaults to None
+        :return BuiltContext: Sources, packed context and token counts
+        """
+        return self.context_builder.build(
+            entities=entities, query_embedding=query_embedding
+        )
 
     def get_context_source(self, entities: List[Dict]) -> Tuple[List[Dict], str]:
         """Get the source and context from the given Dictionary
@@ -37,33 +281,75 @@ class TextEmbedding:
         :param List[Dict] entities: Output from Milvus vector search
         :return Tuple[List[Dict], str]: Source and context
         """
-        sources = []
-        context = ""
-        for entity in entities[0]:
-            sources.append(
-                f"{entity['entity']['document_name']}, page number {entity['entity']['page_number']}"
-            )
-            context += entity["entity"]["text"]
+        built = self.build_context(entities=entities)
+        return built.sources, built.context
+
+    @staticmethod
+    def build_messages(question: str, context: str) -> List[Dict]:
+        """Build the chat messages sent to the LLM
 
-        return list(sorted(set(sources))), context
+        :param str question: Query text
+        :param str context: Relevant context to the query
+        :return List[Dict]: System and user messages
+        """
+        return [
+            {
+                "role": "system",
+                "content": "You are a Question answering agent, skilled in answering questions from the context provided.\
+                        If the answer doesn't exist in the context, you would say 'Couldn't find the answer in the document'",
+            },
+            {"role": "user", "content": f"{question} \n\n {context} "},
+        ]
 
-    def generate_response(self, question: str, context: str) -> str:
-        """_summary_
+    async def generate_response(self, question: str, context: str) -> str:
+        """Generate an answer to the question from the context
 
         :param str question: Query text
         :param str context: Relevant context to the query
         :return str: Generated response
         """
-        completion = self.open_ai.chat.completions.create(
-            model=settings.open_ai.model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a Question answering agent, skilled in answering questions from the context provided.\
-                        If the answer doesn't exist in the context, you would say 'Couldn't find the answer in the document'",
-                },
-                {"role": "user", "content": f"{question} \n\n {context} "},
-            ],
-        )
+        with observe_stage("llm_queue"):
+            await self.llm_semaphore.acquire()
+        try:
+            with observe_stage("llm_completion"):
+                completion = await self.llm.create(
+                    model=settings.open_ai.model,
+                    messages=self.build_messages(question=question, context=context),
+                )
+        finally:
+            self.llm_semaphore.release()
+        if completion.usage is not None:
+            STAGE_ITEMS.labels("llm_prompt_tokens").inc(completion.usage.prompt_tokens)
+            STAGE_ITEMS.labels("llm_completion_tokens").inc(
+                completion.usage.completion_tokens
+            )
 
         return completion.choices[0].message.content
+
+    async def stream_response(self, question: str, context: str) -> AsyncIterator[str]:
+        """Generate an answer to the question, yielding it as the LLM produces it
+
+        :param str question: Query text
+        :param str context: Relevant context to the query
+        :yield AsyncIterator[str]: Completion deltas
+        """
+        with observe_stage("llm_queue"):
+            await self.llm_semaphore.acquire()
+        try:
+            start = time.perf_counter()
+            first_token = True
+            with observe_stage("llm_completion"):
+                stream = self.llm.stream(
+                    model=settings.open_ai.model,
+                    messages=self.build_messages(question=question, context=context),
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token:
+                            STAGE_SECONDS.labels("llm_first_token").observe(
+                                time.perf_counter() - start
+                            )
+                            first_token = False
+                        yield chunk.choices[0].delta.content
+        finally:
+            self.llm_semaphore.release()
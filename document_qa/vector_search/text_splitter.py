@@ -1,14 +1,161 @@
-from functools import partial
-from typing import List
+from enum import Enum
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, Callable, List
 
-from langchain.text_splitter import (
-    RecursiveCharacterTextSplitter,
-    SentenceTransformersTokenTextSplitter,
-    TokenTextSplitter,
-)
-from langchain_core.documents import Document
-from textacy import preprocessing
-from transformers import GPT2TokenizerFast
+from metrics import STAGE_ITEMS, observe_stage
+
+# Slow to import, the builders below import them on first use
+if TYPE_CHECKING:
+    from langchain.text_splitter import (
+        RecursiveCharacterTextSplitter,
+        SentenceTransformersTokenTextSplitter,
+    )
+    from langchain.text_splitter import TextSplitter as LangchainTextSplitter
+    from langchain.text_splitter import TokenTextSplitter
+    from transformers import GPT2TokenizerFast
+
+
+class SplitStrategy(str, Enum):
+    """Text splitting strategies, by the name exposed on the API"""
+
+    char = "char"
+    sentence_transformers = "sentence_transformers"
+    huggingface = "huggingface"
+    tiktoken = "tiktoken"
+
+
+# Longest chunk given to the sentence transformers splitter, in tokens
+ST_MAX_TOKENS_PER_CHUNK = 384
+
+
+def effective_chunk_size(strategy: SplitStrategy | str, chunk_size: int) -> int:
+    """Chunk size a strategy actually splits with
+
+    :param SplitStrategy | str strategy: Name of the splitting strategy
+    :param int chunk_size: Requested size of each chunk, in the unit of the strategy
+    :return int: Chunk size after the caps of the strategy
+    """
+    if SplitStrategy(strategy) is SplitStrategy.sentence_transformers:
+        return min(chunk_size, ST_MAX_TOKENS_PER_CHUNK)
+    return chunk_size
+
+
+def check_split_params(
+    strategy: SplitStrategy | str, chunk_size: int, chunk_overlap: int
+):
+    """Reject split parameters a strategy cannot split with
+
+    :param SplitStrategy | str strategy: Name of the splitting strategy
+    :param int chunk_size: Requested size of each chunk, in the unit of the strategy
+    :param int chunk_overlap: Overlap between each chunks
+    :raises ValueError: If the size is not positive, or the overlap not smaller than the size used
+    """
+    if chunk_size <= 0 or chunk_overlap < 0:
+        raise ValueError("chunk_size must be positive and chunk_overlap not negative")
+    size = effective_chunk_size(strategy, chunk_size)
+    if chunk_overlap >= size:
+        raise ValueError(
+            f"chunk_overlap must be smaller than the chunk size of {size} "
+            f"the {SplitStrategy(strategy).value} strategy splits with"
+        )
+
+
+# The objects below are built once per configuration and reused across pages and documents
+
+
+@lru_cache(maxsize=None)
+def _preprocessing_pipeline() -> Callable[[str], str]:
+    """Textacy pipeline normalising the text
+
+    :return Callable[[str], str]: Preprocessing pipeline
+    """
+    from textacy import preprocessing
+
+    return preprocessing.make_pipeline(
+        preprocessing.normalize.hyphenated_words,
+        preprocessing.normalize.quotation_marks,
+        partial(preprocessing.normalize.repeating_chars, chars=".", maxn=2),
+        partial(preprocessing.normalize.repeating_chars, chars=",", maxn=2),
+        partial(preprocessing.normalize.repeating_chars, chars=" ", maxn=2),
+        preprocessing.normalize.unicode,
+        preprocessing.normalize.whitespace,
+        preprocessing.remove.html_tags,
+    )
+
+
+@lru_cache(maxsize=None)
+def _gpt2_tokenizer() -> "GPT2TokenizerFast":
+    """GPT2 tokenizer used by the Huggingface splitter
+
+    :return GPT2TokenizerFast: Pretrained tokenizer
+    """
+    from transformers import GPT2TokenizerFast
+
+    return GPT2TokenizerFast.from_pretrained("gpt2")
+
+
+def _split_text(text_splitter: "LangchainTextSplitter", text: str) -> List[str]:
+    """Split a text, timed as the split stage
+
+    :param LangchainTextSplitter text_splitter: Langchain text splitter
+    :param str text: Text to split
+    :return List[str]: List of chunks
+    """
+    with observe_stage("split"):
+        chunks = text_splitter.split_text(text)
+    STAGE_ITEMS.labels("split").inc(len(chunks))
+    return chunks
+
+
+@lru_cache(maxsize=16)
+def _char_splitter(
+    chunk_size: int, chunk_overlap: int, is_separator_regex: bool
+) -> "RecursiveCharacterTextSplitter":
+    """Character splitter of a chunk size and overlap"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        is_separator_regex=is_separator_regex,
+    )
+
+
+@lru_cache(maxsize=16)
+def _st_splitter(
+    model_name: str, tokens_per_chunk: int, chunk_overlap: int
+) -> "SentenceTransformersTokenTextSplitter":
+    """Sentence transformer token splitter, loads the model once per configuration"""
+    from langchain.text_splitter import SentenceTransformersTokenTextSplitter
+
+    return SentenceTransformersTokenTextSplitter(
+        model_name=model_name,
+        tokens_per_chunk=tokens_per_chunk,
+        chunk_overlap=chunk_overlap,
+    )
+
+
+@lru_cache(maxsize=16)
+def _hf_splitter(
+    chunk_size: int, chunk_overlap: int
+) -> "RecursiveCharacterTextSplitter":
+    """Huggingface token splitter sharing the GPT2 tokenizer"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer=_gpt2_tokenizer(),
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+
+
+@lru_cache(maxsize=16)
+def _tiktoken_splitter(chunk_size: int, chunk_overlap: int) -> "TokenTextSplitter":
+    """Tiktoken splitter of a chunk size and overlap"""
+    from langchain.text_splitter import TokenTextSplitter
+
+    return TokenTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
 
 
 class TextSplitter:
@@ -23,22 +170,36 @@ class TextSplitter:
         :param str text: Text to preprocess
         :return str: Preprocessed and normalised text
         """
-        preproc = preprocessing.make_pipeline(
-            preprocessing.normalize.hyphenated_words,
-            preprocessing.normalize.quotation_marks,
-            partial(preprocessing.normalize.repeating_chars, chars=".", maxn=2),
-            partial(preprocessing.normalize.repeating_chars, chars=",", maxn=2),
-            partial(preprocessing.normalize.repeating_chars, chars=" ", maxn=2),
-            preprocessing.normalize.unicode,
-            preprocessing.normalize.whitespace,
-            preprocessing.remove.html_tags,
-        )
-
         try:
-            return preproc(text)
+            with observe_stage("normalize"):
+                return _preprocessing_pipeline()(text)
         except Exception as e:
             raise e
 
+    def split(
+        self,
+        strategy: SplitStrategy | str,
+        text: str,
+        chunk_size: int,
+        chunk_overlap: int,
+    ) -> List[str]:
+        """Split the text with the given strategy
+
+        :param SplitStrategy | str strategy: Name of the splitting strategy
+        :param str text: Text to split
+        :param int chunk_size: Size of each chunk, in the unit of the strategy
+        :param int chunk_overlap: Overlap between each chunks
+        :return List[str]: List of chunks
+        """
+        strategy = SplitStrategy(strategy)
+        if strategy is SplitStrategy.char:
+            return self.split_by_char(text, chunk_size, chunk_overlap)
+        if strategy is SplitStrategy.sentence_transformers:
+            return self.st_split_by_token(text, chunk_size, chunk_overlap)
+        if strategy is SplitStrategy.huggingface:
+            return self.hf_split_by_token(text, chunk_size, chunk_overlap)
+        return self.tiktoken_split_by_token(text, chunk_size, chunk_overlap)
+
     def split_by_char(
         self,
         text: str,
@@ -54,16 +215,11 @@ class TextSplitter:
         :param bool is_separator_regex: _description_, defaults to False
         :return List[str]: List of chunks
         """
-        if preprocessing:
+        if self.preprocessing:
             text = self.normalizing_text(text)
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            is_separator_regex=is_separator_regex,
-        )
+        text_splitter = _char_splitter(chunk_size, chunk_overlap, is_separator_regex)
 
-        return text_splitter.split_text(text)
+        return _split_text(text_splitter, text)
 
     def st_split_by_token(
         self,
@@ -80,16 +236,14 @@ class TextSplitter:
         :param str model_name: Name of the sentencetransformer model, defaults to "sentence-transformers/all-mpnet-base-v2"
         :return List[str]: List of chunks
         """
-        if preprocessing:
+        if self.preprocessing:
             text = self.normalizing_text(text)
-        tokens_per_chunk = tokens_per_chunk if tokens_per_chunk <= 384 else 384
-        text_splitter = SentenceTransformersTokenTextSplitter(
-            model_name=model_name,
-            tokens_per_chunk=tokens_per_chunk,
-            chunk_overlap=chunk_overlap,
+        tokens_per_chunk = effective_chunk_size(
+            SplitStrategy.sentence_transformers, tokens_per_chunk
         )
+        text_splitter = _st_splitter(model_name, tokens_per_chunk, chunk_overlap)
 
-        return text_splitter.split_text(text)
+        return _split_text(text_splitter, text)
 
     # TODO: Find a way to change a seperator
     def hf_split_by_token(
@@ -105,16 +259,11 @@ class TextSplitter:
         :param int chunk_overlap: Overlap between each chunks
         :return List[str]: List of chunks
         """
-        if preprocessing:
+        if self.preprocessing:
             text = self.normalizing_text(text)
-        tokenizer = GPT2TokenizerFast.from_pretrained("gpt2")
-        text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
-            tokenizer=tokenizer,
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-        )
+        text_splitter = _hf_splitter(chunk_size, chunk_overlap)
 
-        return text_splitter.split_text(text)
+        return _split_text(text_splitter, text)
 
     def tiktoken_split_by_token(
         self, text: str, chunk_size: int, chunk_overlap: int
@@ -126,9 +275,7 @@ class TextSplitter:
         :param int chunk_overlap: Overlap between each chunks
         :return List[str]: List of chunks
         """
-        if preprocessing:
+        if self.preprocessing:
             text = self.normalizing_text(text)
-        text_splitter = TokenTextSplitter(
-            chunk_size=chunk_size, chunk_overlap=chunk_overlap
-        )
-        return text_splitter.split_text(text)
+        text_splitter = _tiktoken_splitter(chunk_size, chunk_overlap)
+        return _split_text(text_splitter, text)
@@ -0,0 +1,103 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+# Longest document name and chunk text the pdf_documents schema accepts
+DOCUMENT_NAME_MAX_LENGTH = 100
+TEXT_MAX_LENGTH = 4096
+
+
+class VectorStore(ABC):
+    """Interface of the stores holding the chunk embeddings"""
+
+    @abstractmethod
+    def insert_to_collection(self, data: List[Dict] | Dict):
+        """Insert chunks with their embeddings
+
+        :param List[Dict] | Dict data: Chunks in the structure of the pdf_documents schema
+        """
+
+    @abstractmethod
+    def delete_entity(self, doc_id: str):
+        """Delete every chunk of a document
+
+        :param str doc_id: ID of the document to delete
+        """
+
+    @abstractmethod
+    def delete_pages(self, doc_id: str, page_numbers: List[int]):
+        """Delete the chunks of some pages of a document
+
+        :param str doc_id: ID of the document
+        :param List[int] page_numbers: Page numbers, starting at 1, to delete
+        """
+
+    def delete_entities(self, doc_ids: List[str]):
+        """Delete every chunk of many documents
+
+        :param List[str] doc_ids: IDs of the documents to delete
+        """
+        for doc_id in doc_ids:
+            self.delete_entity(doc_id)
+
+    @abstractmethod
+    def vector_search(
+        self,
+        question_embedding: List[List[float]],
+        limit: int = 5,
+        doc_id: str | List[str] | None = None,
+        include_embeddings: bool = False,
+        search_params: Dict | None = None,
+    ) -> List[List[Dict]]:
+        """Retrieve the top k chunks of each query vector
+
+        :param List[List[float]] question_embedding: Vectorised questions to query against
+        :param int limit: Top k results, defaults to 5
+        :param str | List[str] | None doc_id: Documents to perform search against, defaults to None
+        :param bool include_embeddings: Return the chunk vectors in the entity as well, defaults to False
+        :param Dict | None search_params: ANN recall and latency knobs, nprobe or ef, ignored by exact stores, defaults to None
+        :return List[List[Dict]]: Hits of each query with id, distance and the document name, page number and text entity
+        """
+
+    @abstractmethod
+    def close_connection(self):
+        """Release the resources held by the store"""
+
+
+class VectorStorePool(ABC):
+    """Hands out vector stores to request handlers and workers"""
+
+    @abstractmethod
+    @contextmanager
+    def acquire(self) -> Iterator[VectorStore]:
+        """Borrow a store
+
+        :yield Iterator[VectorStore]: Vector store, returned on exit
+        """
+
+    @abstractmethod
+    def close(self):
+        """Close the stores of the pool"""
+
+
+class SharedVectorStorePool(VectorStorePool):
+    """Pool around a single thread-safe, in-process store"""
+
+    def __init__(self, store: VectorStore) -> None:
+        """Initialise the pool
+
+        :param VectorStore store: Store shared by every borrower
+        """
+        self.store = store
+
+    @contextmanager
+    def acquire(self) -> Iterator[VectorStore]:
+        """Borrow the shared store
+
+        :yield Iterator[VectorStore]: The shared store
+        """
+        yield self.store
+
+    def close(self):
+        """Close the shared store"""
+        self.store.close_connection()
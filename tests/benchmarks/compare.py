@@ -0,0 +1,85 @@
+"""Compare two benchmark result files
+
+Run from the repository root::
+
+    python -m tests.benchmarks.compare baseline.json benchmark.json --threshold 10
+
+Exits with status 1 when a latency grows, or a throughput drops, by more than
+the threshold percentage.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, Tuple
+
+# Metrics where a larger value is an improvement
+HIGHER_IS_BETTER = ("pages_per_second", "chunks_per_second", "throughput_rps")
+COMPARED = HIGHER_IS_BETTER + ("mean_ms", "p50_ms", "p90_ms", "p99_ms")
+
+
+def flatten(report: Dict) -> Dict[str, float]:
+    """Collect the compared metrics of a result file by name
+
+    :param Dict report: Result of tests.benchmarks.run
+    :return Dict[str, float]: Metric values by name
+    """
+    metrics = {}
+    for result in report.get("extract", []):
+        for name in ("pages_per_second", "chunks_per_second"):
+            if name in result:
+                metrics[f"extract/{result['strategy']}/{result['pages']}p/{name}"] = (
+                    result[name]
+                )
+    for operation, summary in report.get("app", {}).items():
+        for name in COMPARED:
+            if name in summary:
+                metrics[f"app/{operation}/{name}"] = summary[name]
+    return metrics
+
+
+def compare(
+    baseline: Dict, current: Dict, threshold: float
+) -> Tuple[Dict[str, Tuple[float, float, float]], Dict[str, float]]:
+    """Compute the change of every metric present in both reports
+
+    :param Dict baseline: Result file to compare against
+    :param Dict current: Result file to compare
+    :param float threshold: Percentage of change reported as a regression
+    :return Tuple[Dict[str, Tuple[float, float, float]], Dict[str, float]]: Baseline, current value and change percentage of each metric, and the regressions
+    """
+    before, after = flatten(baseline), flatten(current)
+    changes, regressions = {}, {}
+    for name in sorted(before.keys() & after.keys()):
+        if not before[name]:
+            continue
+        change = (after[name] - before[name]) / before[name] * 100
+        changes[name] = (before[name], after[name], change)
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        if worse > threshold:
+            regressions[name] = change
+    return changes, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("current", type=Path)
+    parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args()
+
+    changes, regressions = compare(
+        json.loads(args.baseline.read_text()),
+        json.loads(args.current.read_text()),
+        args.threshold,
+    )
+    for name, (before, after, change) in changes.items():
+        flag = "  REGRESSION" if name in regressions else ""
+        print(f"{name:<60} {before:12.2f} {after:12.2f} {change:+8.1f}%{flag}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import fitz
+import numpy as np
+
+# Words the synthetic documents are drawn from, a few repeat often like real text
+VOCABULARY = (
+    "the of and to in a is that for it as with was on be by this are from or "
+    "document question answer vector search embedding index cluster latency "
+    "throughput model token chunk page section table figure result method "
+    "analysis system performance memory storage network request response cache"
+).split()
+
+
+def make_pdf(pages: int, words_per_page: int = 400, seed: int = 0) -> bytes:
+    """Generate a text pdf, the same pages for the same arguments
+
+    :param int pages: Number of pages
+    :param int words_per_page: Number of words written on each page, defaults to 400
+    :param int seed: Seed of the generated text, defaults to 0
+    :return bytes: pdf document object
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_number in range(pages):
+        words = rng.choices(VOCABULARY, k=words_per_page)
+        text = f"Section {page_number + 1}. " + " ".join(words) + "."
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 545, 790), text, fontsize=8)
+    content = doc.tobytes()
+    doc.close()
+    return content
+
+
+class FakeEmbeddings:
+    """Deterministic stand-in for HuggingFaceInstructEmbeddings
+
+    Each text maps to a fixed unit vector derived from its hash, so repeated
+    runs embed the same chunks to the same vectors without loading a model.
+    """
+
+    model_name = "benchmark/fake-embeddings"
+    embed_instruction = "Represent the document for retrieval: "
+    query_instruction = "Represent the query for retrieval: "
+
+    def __init__(self, dimension: int = 768, seconds_per_text: float = 0.0) -> None:
+        """Initialise the embedder
+
+        :param int dimension: Dimension of the vectors, defaults to 768
+        :param float seconds_per_text: Simulated model time per text, defaults to 0.0
+        """
+        self.dimension = dimension
+        self.seconds_per_text = seconds_per_text
+        self.encode_kwargs: Dict = {}
+        self.client = self
+
+    def _vector(self, text: str) -> np.ndarray:
+        """Unit vector of a text
+
+        :param str text: Text to vectorise
+        :return np.ndarray: Vector of the text
+        """
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension)
+        return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+    def encode(self, instruction_pairs: List[List[str]], **kwargs) -> np.ndarray:
+        """Vectorise [instruction, text] pairs like the instructor client
+
+        :param List[List[str]] instruction_pairs: Instruction and text pairs
+        :return np.ndarray: Vectors, one row per pair
+        """
+        time.sleep(self.seconds_per_text * len(instruction_pairs))
+        return np.stack([self._vector(text) for _, text in instruction_pairs])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Vectorise documents
+
+        :param List[str] texts: Texts to vectorise
+        :return List[List[float]]: Vectors, in the same order as the input
+        """
+        pairs = [[self.embed_instruction, text] for text in texts]
+        return self.encode(pairs).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Vectorise a query
+
+        :param str text: Query text to vectorise
+        :return List[float]: Vector of the query
+        """
+        return self.encode([[self.query_instruction, text]])[0].tolist()
+
+
+class _ChatCompletionsHandler(BaseHTTPRequestHandler):
+    """Answers POST /v1/chat/completions like the OpenAI API, streamed or not"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """Keep the benchmark output quiet"""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+
+        server: StubOpenAIServer = self.server.stub
+        failing, slow = server.draw()
+        if failing:
+            self._send_failure(server)
+            return
+        if slow:
+            time.sleep(server.slow_seconds)
+        prompt_tokens = sum(len(m["content"].split()) for m in body["messages"])
+        words = server.answer.split(" ")
+        created = int(time.time())
+        time.sleep(server.first_token_seconds)
+
+        if not body.get("stream"):
+            time.sleep(server.seconds_per_token * len(words))
+            payload = json.dumps(
+                {
+                    "id": "chatcmpl-benchmark",
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": body["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": server.answer},
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": len(words),
+                        "total_tokens": prompt_tokens + len(words),
+                    },
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for position, word in enumerate(words):
+            chunk = {
+                "id": "chatcmpl-benchmark",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": word if not position else f" {word}"},
+                        "finish_reason": None,
+                    }
+                ],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            time.sleep(server.seconds_per_token)
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_failure(self, server: "StubOpenAIServer"):
+        """Answer with the error status of the server, like a throttled or failing API
+
+        :param StubOpenAIServer server: Stub server of the request
+        """
+        payload = json.dumps(
+            {"error": {"message": "Injected failure", "type": "stub_error"}}
+        ).encode()
+        self.send_response(server.failure_status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if server.retry_after is not None:
+            self.send_header("retry-after-ms", str(int(server.retry_after * 1000)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _write_chunk(self, data: str):
+        """Write one chunk of a chunked response
+
+        :param str data: Data of the chunk
+        """
+        encoded = data.encode()
+        self.wfile.write(f"{len(encoded):x}\r\n".encode() + encoded + b"\r\n")
+        self.wfile.flush()
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    """Drops the requests clients gave up on, timed out or hedged, without a traceback"""
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (ConnectionError, ValueError)):
+            super().handle_error(request, client_address)
+
+
+class StubOpenAIServer:
+    """Local OpenAI compatible chat completions server with a fixed answer"""
+
+    def __init__(
+        self,
+        answer: str = "The answer is in the document.",
+        first_token_seconds: float = 0.0,
+        seconds_per_token: float = 0.0,
+        failure_rate: float = 0.0,
+        fail_first: int = 0,
+        failure_status: int = 429,
+        retry_after: float | None = None,
+        slow_rate: float = 0.0,
+        slow_seconds: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        """Initialise the server, it listens once started
+
+        :param str answer: Completion returned for every request, defaults to "The answer is in the document."
+        :param float first_token_seconds: Simulated time to the first token, defaults to 0.0
+        :param float seconds_per_token: Simulated time per generated word, defaults to 0.0
+        :param float failure_rate: Fraction of the requests answered with an error, defaults to 0.0
+        :param int fail_first: Number of first requests answered with an error, defaults to 0
+        :param int failure_status: Status code of the errors, defaults to 429
+        :param float | None retry_after: Seconds sent in the retry-after-ms header of the errors, defaults to None
+        :param float slow_rate: Fraction of the requests delayed further, the latency tail, defaults to 0.0
+        :param float slow_seconds: Extra delay of the slow requests, defaults to 0.0
+        :param int seed: Seed of the failing and slow requests, defaults to 0
+        """
+        self.answer = answer
+        self.first_token_seconds = first_token_seconds
+        self.seconds_per_token = seconds_per_token
+        self.failure_rate = failure_rate
+        self.fail_first = fail_first
+        self.failure_status = failure_status
+        self.retry_after = retry_after
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.requests = 0
+        self.failures = 0
+        # Monotonic arrival time of every request
+        self.arrivals: List[float] = []
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._server = _StubHTTPServer(("127.0.0.1", 0), _ChatCompletionsHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def draw(self) -> tuple[bool, bool]:
+        """Count a request and decide whether it fails, or is slow
+
+        :return tuple[bool, bool]: Whether it fails, whether it is slow
+        """
+        with self._rng_lock:
+            self.requests += 1
+            self.arrivals.append(time.monotonic())
+            failing = (
+                self.requests <= self.fail_first
+                or self._rng.random() < self.failure_rate
+            )
+            slow = self._rng.random() < self.slow_rate
+            self.failures += failing
+        return failing, slow
+
+    @property
+    def base_url(self) -> str:
+        """Base URL to point the OpenAI client at
+
+        :return str: URL of the /v1 API
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self) -> "StubOpenAIServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,446 @@
+"""End-to-end benchmarks of the document_qa app
+
+Run from the repository root::
+
+    python -m tests.benchmarks.run --output benchmark.json
+
+Nothing leaves the machine. The vector store is the in-memory numpy backend,
+the embedder is deterministic and OpenAI is a local stub server, so the
+numbers measure this code rather than the services around it. Compare two
+result files with tests.benchmarks.compare.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import httpx
+import numpy as np
+
+from tests.benchmarks.fixtures import (
+    VOCABULARY,
+    FakeEmbeddings,
+    StubOpenAIServer,
+    make_pdf,
+)
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+APP_DIR = REPO_ROOT / "document_qa"
+
+
+def summarise(samples: List[float], wall_seconds: float | None = None) -> Dict:
+    """Latency percentiles of a list of timings
+
+    :param List[float] samples: Timings in seconds
+    :param float | None wall_seconds: Wall time of the whole run, adds the request rate, defaults to None
+    :return Dict: Count, mean, percentiles and max in milliseconds
+    """
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    summary = {
+        "count": len(samples),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p90_ms": float(np.percentile(values, 90)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+    if wall_seconds:
+        summary["throughput_rps"] = len(samples) / wall_seconds
+    return summary
+
+
+def environment() -> Dict:
+    """Describe the code and machine the benchmark ran on
+
+    :return Dict: Commit, interpreter and platform
+    """
+
+    def git(*args: str) -> str:
+        try:
+            return subprocess.run(
+                ["git", *args], cwd=REPO_ROOT, capture_output=True, text=True
+            ).stdout.strip()
+        except OSError:
+            return ""
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def configure_app(workdir: Path, stub: StubOpenAIServer):
+    """Point the app settings at throwaway local resources
+
+    Must run before the app modules are imported, the settings are read then.
+
+    :param Path workdir: Directory for the databases and spooled uploads
+    :param StubOpenAIServer stub: Stub server answering the completions
+    """
+    (workdir / "spool").mkdir(parents=True, exist_ok=True)
+    os.environ.update(
+        {
+            "DYNACONF_SQL_DB_PATH": f"sqlite:///{workdir / 'document_qa.db'}",
+            "DYNACONF_VECTOR_STORE__BACKEND": "numpy",
+            "DYNACONF_VECTOR_STORE__PATH": "",
+            "DYNACONF_EMBEDDING_CACHE__PATH": str(workdir / "embedding_cache.db"),
+            "DYNACONF_INGESTION__SPOOL_DIR": str(workdir / "spool"),
+            # Every question is new, answers are never reused
+            "DYNACONF_ANSWER_CACHE__SIMILARITY_THRESHOLD": "2.0",
+            "DYNACONF_OPEN_AI__API_KEY": "benchmark",
+            "DYNACONF_OPEN_AI__BASE_URL": stub.base_url,
+        }
+    )
+    os.chdir(APP_DIR)
+    sys.path.insert(0, str(APP_DIR))
+
+
+def bench_extract(
+    sizes: List[int],
+    strategies: List[str],
+    chunk_size: int,
+    chunk_overlap: int,
+    repeat: int,
+    embedder: FakeEmbeddings,
+) -> List[Dict]:
+    """Measure extract_text throughput for each page count and splitter
+
+    :param List[int] sizes: Page counts of the generated documents
+    :param List[str] strategies: Text splitting strategies to measure
+    :param int chunk_size: Size of each chunk
+    :param int chunk_overlap: Overlap between each chunks
+    :param int repeat: Runs per measurement, the fastest is kept
+    :param FakeEmbeddings embedder: Embedding model
+    :return List[Dict]: One result per page count and strategy, with the error if it failed
+    """
+    from text_extracter.pdf_miners import ExtractionStats, extract_text
+    from vector_search.text_embedders import TextEmbedding
+    from vector_search.text_splitter import TextSplitter
+
+    text_embedder = TextEmbedding(model=embedder)
+    splitter = TextSplitter(preprocessing=True)
+    results = []
+    for pages in sizes:
+        content = make_pdf(pages, seed=pages)
+        for strategy in strategies:
+            result = {"strategy": strategy, "pages": pages}
+            try:
+                runs = []
+                for _ in range(repeat):
+                    stats = ExtractionStats()
+                    start = time.perf_counter()
+                    extract_text(
+                        file_name=f"{pages}.pdf",
+                        file_content=content,
+                        doc_id=str(uuid.uuid4()),
+                        text_splitter=partial(splitter.split, strategy),
+                        params={
+                            "chunk_size": chunk_size,
+                            "chunk_overlap": chunk_overlap,
+                        },
+                        embedder=text_embedder,
+                        stats=stats,
+                    )
+                    runs.append((time.perf_counter() - start, stats))
+                seconds, stats = min(runs, key=lambda run: run[0])
+                result.update(
+                    chunks=stats.chunks,
+                    seconds=seconds,
+                    embedding_seconds=stats.embedding_seconds,
+                    pages_per_second=pages / seconds,
+                    chunks_per_second=stats.chunks / seconds,
+                )
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+            results.append(result)
+            print(f"extract {strategy:>21} {pages:>5} pages {_describe(result)}")
+    return results
+
+
+def _describe(result: Dict) -> str:
+    """One line description of an extraction result
+
+    :param Dict result: Result of bench_extract
+    :return str: Throughput or error
+    """
+    if "error" in result:
+        return f"failed: {result['error']}"
+    return (
+        f"{result['pages_per_second']:8.1f} pages/s "
+        f"{result['chunks_per_second']:8.1f} chunks/s"
+    )
+
+
+class AppServer:
+    """Runs the app with uvicorn on a free local port, in a background thread"""
+
+    def __init__(self, app) -> None:
+        """Initialise the server, it listens once entered
+
+        :param _type_ app: ASGI application
+        """
+        import uvicorn
+
+        self._socket = socket.socket()
+        self._socket.bind(("127.0.0.1", 0))
+        self.server = uvicorn.Server(
+            uvicorn.Config(app, log_level="warning", lifespan="on")
+        )
+        self._thread = threading.Thread(
+            target=self.server.run, kwargs={"sockets": [self._socket]}, daemon=True
+        )
+
+    @property
+    def base_url(self) -> str:
+        """URL the app listens on
+
+        :return str: Base URL
+        """
+        host, port = self._socket.getsockname()
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "AppServer":
+        self._thread.start()
+        while not self.server.started:
+            if not self._thread.is_alive():
+                raise RuntimeError("The app failed to start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self._thread.join()
+
+
+def _question(rng: random.Random) -> str:
+    """Random question, distinct questions are never served from a cache
+
+    :param random.Random rng: Random generator
+    :return str: Question
+    """
+    return "What does the document say about " + " ".join(rng.choices(VOCABULARY, k=6))
+
+
+def _timed_concurrently(calls: List[Callable[[], float]], concurrency: int) -> Dict:
+    """Run timed calls with a number of them in flight
+
+    :param List[Callable[[], float]] calls: Calls returning their own timing
+    :param int concurrency: Calls in flight at once
+    :return Dict: Latency summary and request rate
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timings = list(pool.map(lambda call: call(), calls))
+    return summarise(timings, wall_seconds=time.perf_counter() - start)
+
+
+def bench_app(
+    sizes: List[int],
+    uploads: int,
+    searches: int,
+    batch_size: int,
+    concurrency: int,
+    embedder: FakeEmbeddings,
+) -> Dict:
+    """Measure ingestion and search latency through the HTTP API
+
+    :param List[int] sizes: Page counts of the uploaded documents
+    :param int uploads: Uploads of each page count
+    :param int searches: Requests of each search endpoint
+    :param int batch_size: Questions of each batch search request
+    :param int concurrency: Search requests in flight at once
+    :param FakeEmbeddings embedder: Embedding model
+    :return Dict: Latency summaries by operation
+    """
+    import main
+    from vector_search.text_embedders import TextEmbedding
+
+    main.TextEmbedding = partial(TextEmbedding, model=embedder)
+    rng = random.Random(0)
+    results: Dict[str, Dict] = {}
+
+    with AppServer(main.app) as server, httpx.Client(
+        base_url=server.base_url, timeout=300
+    ) as client:
+        doc_ids = []
+        for pages in sizes:
+            upload, ingest = [], []
+            for attempt in range(uploads):
+                # Fresh text for every upload, the embedding cache must not help
+                content = make_pdf(pages, seed=pages * 1000 + attempt)
+                start = time.perf_counter()
+                response = client.post(
+                    "/files/",
+                    files={"file": (f"{pages}.pdf", content, "application/pdf")},
+                )
+                response.raise_for_status()
+                upload.append(time.perf_counter() - start)
+                doc_id = response.json()["id"]
+                while True:
+                    status = client.get(f"/files/{doc_id}/status").json()
+                    if status["status"] == "completed":
+                        break
+                    if status["status"] == "failed":
+                        raise RuntimeError(f"Ingestion failed: {status['error']}")
+                    time.sleep(0.005)
+                ingest.append(time.perf_counter() - start)
+                doc_ids.append(doc_id)
+            results[f"upload_{pages}p"] = summarise(upload)
+            results[f"ingest_{pages}p"] = summarise(ingest)
+            print(
+                f"ingest {pages:>5} pages p50 {results[f'ingest_{pages}p']['p50_ms']:.1f} ms"
+            )
+
+        def search() -> float:
+            start = time.perf_counter()
+            client.post(
+                "/search/",
+                json={"doc_id": rng.choice(doc_ids), "question": _question(rng)},
+            ).raise_for_status()
+            return time.perf_counter() - start
+
+        first_events = []
+
+        def stream() -> float:
+            start = time.perf_counter()
+            with client.stream(
+                "POST",
+                "/search/stream",
+                json={"doc_id": rng.choice(doc_ids), "question": _question(rng)},
+            ) as response:
+                response.raise_for_status()
+                first_delta = None
+                for line in response.iter_lines():
+                    if line == "event: delta" and first_delta is None:
+                        first_delta = time.perf_counter() - start
+            # One time to first delta per request, appends are thread safe
+            if first_delta is not None:
+                first_events.append(first_delta)
+            return time.perf_counter() - start
+
+        def batch() -> float:
+            start = time.perf_counter()
+            client.post(
+                "/search/batch",
+                json={
+                    "items": [
+                        {"doc_id": rng.choice(doc_ids), "question": _question(rng)}
+                        for _ in range(batch_size)
+                    ]
+                },
+            ).raise_for_status()
+            return time.perf_counter() - start
+
+        results["search"] = _timed_concurrently([search] * searches, concurrency)
+        results["search_stream"] = _timed_concurrently([stream] * searches, concurrency)
+        results["search_stream_first_delta"] = summarise(first_events)
+        results[f"search_batch_{batch_size}"] = _timed_concurrently(
+            [batch] * max(searches // batch_size, 1), concurrency
+        )
+        for name in ("search", "search_stream", "search_stream_first_delta"):
+            print(f"{name} p50 {results[name]['p50_ms']:.1f} ms")
+
+    return results
+
+
+def parse_sizes(value: str) -> List[int]:
+    """Parse a comma separated list of page counts
+
+    :param str value: Page counts, e.g. "5,50,200"
+    :return List[int]: Page counts
+    """
+    return [int(size) for size in value.split(",") if size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="benchmark.json", help="JSON result file")
+    parser.add_argument("--sizes", type=parse_sizes, default=[5, 50, 200])
+    parser.add_argument(
+        "--strategies",
+        default="char,tiktoken,huggingface,sentence_transformers",
+        help="Splitters measured by the extraction benchmark",
+    )
+    parser.add_argument("--chunk-size", type=int, default=300)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--uploads", type=int, default=3)
+    parser.add_argument("--searches", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument(
+        "--embed-ms", type=float, default=0.0, help="Simulated model time per text"
+    )
+    parser.add_argument(
+        "--llm-first-token-ms", type=float, default=0.0, help="Simulated LLM latency"
+    )
+    parser.add_argument(
+        "--llm-token-ms", type=float, default=0.0, help="Simulated time per word"
+    )
+    parser.add_argument(
+        "--llm-failure-rate", type=float, default=0.0, help="Fraction answered 429"
+    )
+    parser.add_argument(
+        "--llm-slow-rate", type=float, default=0.0, help="Fraction of slow completions"
+    )
+    parser.add_argument(
+        "--llm-slow-ms", type=float, default=0.0, help="Extra latency of slow ones"
+    )
+    parser.add_argument("--skip-extract", action="store_true")
+    parser.add_argument("--skip-app", action="store_true")
+    args = parser.parse_args()
+
+    output = Path(args.output).resolve()
+    embedder = FakeEmbeddings(seconds_per_text=args.embed_ms / 1000)
+    report = {"environment": environment(), "parameters": vars(args)}
+
+    with tempfile.TemporaryDirectory() as workdir, StubOpenAIServer(
+        first_token_seconds=args.llm_first_token_ms / 1000,
+        seconds_per_token=args.llm_token_ms / 1000,
+        failure_rate=args.llm_failure_rate,
+        slow_rate=args.llm_slow_rate,
+        slow_seconds=args.llm_slow_ms / 1000,
+    ) as stub:
+        configure_app(Path(workdir), stub)
+        if not args.skip_extract:
+            report["extract"] = bench_extract(
+                sizes=args.sizes,
+                strategies=args.strategies.split(","),
+                chunk_size=args.chunk_size,
+                chunk_overlap=args.chunk_overlap,
+                repeat=args.repeat,
+                embedder=embedder,
+            )
+        if not args.skip_app:
+            report["app"] = bench_app(
+                sizes=args.sizes,
+                uploads=args.uploads,
+                searches=args.searches,
+                batch_size=args.batch_size,
+                concurrency=args.concurrency,
+                embedder=embedder,
+            )
+
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+# The app modules import each other from the document_qa directory, and the
+# settings files are read from there too
+APP_DIR = Path(__file__).resolve().parent.parent / "document_qa"
+sys.path.insert(0, str(APP_DIR))
+os.chdir(APP_DIR)
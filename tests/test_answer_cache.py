@@ -0,0 +1,81 @@
+import time
+
+from vector_search.answer_cache import SemanticAnswerCache
+
+
+def test_lookup_returns_answer_of_similar_question():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store([1.0, 0.0], "doc", "answer", ["doc.pdf, page number 1"])
+
+    assert cache.lookup([0.99, 0.05], "doc") == (
+        "answer",
+        ["doc.pdf, page number 1"],
+    )
+    assert cache.lookup([0.0, 1.0], "doc") is None
+    assert cache.lookup([1.0, 0.0], "other") is None
+
+
+def test_lookup_matches_document_sets_in_any_order():
+    cache = SemanticAnswerCache()
+    cache.store([1.0, 0.0], ["b", "a", "a"], "answer", [])
+
+    assert cache.lookup([1.0, 0.0], ["a", "b"]) is not None
+
+
+def test_entries_expire_after_ttl():
+    cache = SemanticAnswerCache(ttl=0.05)
+    cache.store([1.0, 0.0], "doc", "answer", [])
+    time.sleep(0.1)
+
+    assert cache.lookup([1.0, 0.0], "doc") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SemanticAnswerCache(max_size=2)
+    cache.store([1.0, 0.0], "a", "answer a", [])
+    cache.store([1.0, 0.0], "b", "answer b", [])
+    cache.lookup([1.0, 0.0], "a")
+    cache.store([1.0, 0.0], "c", "answer c", [])
+
+    assert cache.lookup([1.0, 0.0], "a") is not None
+    assert cache.lookup([1.0, 0.0], "b") is None
+
+
+def test_invalidate_drops_every_set_holding_the_document():
+    cache = SemanticAnswerCache()
+    cache.store([1.0, 0.0], "a", "answer", [])
+    cache.store([1.0, 0.0], ["a", "b"], "answer", [])
+    cache.store([1.0, 0.0], "b", "answer", [])
+    cache.invalidate("a")
+
+    assert cache.lookup([1.0, 0.0], "a") is None
+    assert cache.lookup([1.0, 0.0], ["a", "b"]) is None
+    assert cache.lookup([1.0, 0.0], "b") is not None
+
+
+def test_store_after_invalidate_is_dropped():
+    cache = SemanticAnswerCache()
+    generation = cache.generation(["a", "b"])
+    assert cache.lookup([1.0, 0.0], ["a", "b"]) is None
+
+    # The document is replaced while the answer is generated from its old chunks
+    cache.invalidate("b")
+    cache.store([1.0, 0.0], ["a", "b"], "stale", [], generation=generation)
+    assert cache.lookup([1.0, 0.0], ["a", "b"]) is None
+
+    generation = cache.generation(["a", "b"])
+    cache.store([1.0, 0.0], ["a", "b"], "fresh", [], generation=generation)
+    assert cache.lookup([1.0, 0.0], ["a", "b"])[0] == "fresh"
+
+
+def test_answers_are_only_reused_with_the_same_search_knobs():
+    cache = SemanticAnswerCache()
+    cache.store([1.0, 0.0], "doc", "top 5", [], params=(5, ()))
+
+    assert cache.lookup([1.0, 0.0], "doc", params=(5, ())) is not None
+    assert cache.lookup([1.0, 0.0], "doc", params=(50, ())) is None
+    assert cache.lookup([1.0, 0.0], "doc", params=(5, (("nprobe", 64),))) is None
+
+    cache.invalidate("doc")
+    assert cache.lookup([1.0, 0.0], "doc", params=(5, ())) is None
@@ -0,0 +1,78 @@
+import pytest
+from vector_search.context_builder import ContextBuilder
+
+
+class WordEncoding:
+    """One token per space separated word, so budgets are easy to count"""
+
+    def encode(self, text, disallowed_special=()):
+        return text.split(" ") if text else []
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+@pytest.fixture
+def builder():
+    builder = ContextBuilder(token_budget=12, separator="\n\n")
+    builder.encoding = WordEncoding()
+    return builder
+
+
+def hit(text, page_number=1, document_name="manual.pdf", embeddings=None):
+    entity = {"document_name": document_name, "page_number": page_number, "text": text}
+    if embeddings is not None:
+        entity["embeddings"] = embeddings
+    return {"entity": entity}
+
+
+def test_passages_are_packed_in_rank_order(builder):
+    built = builder.build([[hit("one two three", 2), hit("four five", 1, "guide.pdf")]])
+
+    assert built.context == "one two three\n\nfour five"
+    assert built.tokens == 6
+    assert built.sources == ["guide.pdf, page number 1", "manual.pdf, page number 2"]
+
+
+def test_overlapping_chunks_of_a_page_are_merged(builder):
+    builder.token_budget = 100
+    first = "the warranty covers parts and labour for two years"
+    second = "parts and labour for two years from the purchase date"
+
+    built = builder.build([[hit(first), hit(second), hit(second, page_number=2)]])
+
+    assert [passage.text for passage in built.passages] == [
+        "the warranty covers parts and labour for two years from the purchase date",
+        second,
+    ]
+    assert built.tokens_saved > 0
+
+
+def test_last_passage_is_truncated_to_the_budget(builder):
+    built = builder.build([[hit("w " * 9 + "w", 1), hit("x y z", 2), hit("q", 3)]])
+
+    # 10 words, a separator token, then 1 of the 3 words fits
+    assert built.context == "w " * 9 + "w\n\nx"
+    assert built.tokens == 12
+    assert len(built.passages) == 2
+
+
+def test_near_duplicates_are_dropped_with_embeddings(builder):
+    hits = [
+        hit("first", 1, embeddings=[1.0, 0.0]),
+        hit("copy", 2, embeddings=[1.0, 0.01]),
+        hit("other", 3, embeddings=[0.0, 1.0]),
+    ]
+
+    built = builder.build([hits], query_embedding=[1.0, -0.2])
+
+    assert built.dropped_chunks == 1
+    assert [passage.text for passage in built.passages] == ["first", "other"]
+
+
+def test_empty_search_result_builds_an_empty_context(builder):
+    built = builder.build([[]], query_embedding=[1.0])
+
+    assert built.context == ""
+    assert built.tokens == 0
+    assert built.sources == []
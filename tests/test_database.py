@@ -0,0 +1,36 @@
+import sqlite3
+
+from database.database import create_tables
+from sqlalchemy import create_engine, inspect
+
+
+def test_documents_created_before_the_status_columns_are_migrated(tmp_path):
+    path = tmp_path / "documents.db"
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "CREATE TABLE documents (id VARCHAR PRIMARY KEY, file_name VARCHAR, "
+            "processed BOOLEAN)"
+        )
+        connection.executemany(
+            "INSERT INTO documents VALUES (?, ?, ?)",
+            [("done", "a.pdf", 1), ("interrupted", "b.pdf", 0)],
+        )
+    engine = create_engine(f"sqlite:///{path}")
+
+    create_tables(engine)
+    # Running it again on an up to date database changes nothing
+    create_tables(engine)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("documents")}
+    assert {"status", "total_pages", "pages_done", "chunks_done", "error"} <= columns
+    assert "cached_chunks" in columns
+    assert inspect(engine).has_table("document_pages")
+    with sqlite3.connect(path) as connection:
+        rows = connection.execute(
+            "SELECT id, status, total_pages, pages_done, chunks_done, cached_chunks, "
+            "error FROM documents ORDER BY id"
+        ).fetchall()
+    assert rows == [
+        ("done", "completed", None, 0, 0, 0, None),
+        ("interrupted", "failed", None, 0, 0, 0, None),
+    ]
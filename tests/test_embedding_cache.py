@@ -0,0 +1,47 @@
+import pytest
+from vector_search.embedding_cache import EmbeddingCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "embeddings.db")
+
+
+def test_embeddings_are_found_by_text_across_reopens(path):
+    cache = EmbeddingCache(path, model_id="model")
+    cache.put_many(["first chunk", "second chunk"], [[1.0, 2.0], [3.0, 4.0]])
+    cache.close()
+
+    cache = EmbeddingCache(path, model_id="model")
+    found = cache.get_many(["second  chunk", "unknown", "first chunk"])
+
+    assert found == {0: [3.0, 4.0], 2: [1.0, 2.0]}
+
+
+def test_embeddings_of_another_model_are_not_found(path):
+    EmbeddingCache(path, model_id="model").put_many(["chunk"], [[1.0]])
+
+    assert EmbeddingCache(path, model_id="other model").get_many(["chunk"]) == {}
+
+
+def test_repeated_texts_share_an_entry(path):
+    cache = EmbeddingCache(path, model_id="model")
+    cache.put_many(["chunk", "chunk"], [[1.0], [1.0]])
+
+    assert cache._count == 1
+    assert cache.get_many(["chunk", "chunk"]) == {0: [1.0], 1: [1.0]}
+
+
+def test_least_recently_used_embeddings_are_evicted(path, monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr("vector_search.embedding_cache.time.time", lambda: next(clock))
+    cache = EmbeddingCache(path, model_id="model", max_entries=2)
+    cache.put_many(["a"], [[1.0]])
+    cache.put_many(["b"], [[2.0]])
+
+    # Reading "a" makes "b" the least recently used
+    cache.get_many(["a"])
+    cache.put_many(["c"], [[3.0]])
+
+    assert cache.get_many(["a", "b", "c"]) == {0: [1.0], 2: [3.0]}
+    assert cache._count == 2
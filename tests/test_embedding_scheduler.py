@@ -0,0 +1,74 @@
+import threading
+from concurrent.futures import CancelledError
+
+import numpy as np
+import pytest
+from vector_search.embedding_scheduler import EmbeddingScheduler
+
+
+def encode(pairs):
+    return np.array(
+        [[float(len(text)), 1.0 if instruction else 0.0] for instruction, text in pairs]
+    )
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = EmbeddingScheduler(encode, max_batch_size=4, max_wait=0.01)
+    scheduler.start()
+    yield scheduler
+    scheduler.close()
+
+
+def test_texts_are_embedded_in_order_across_batches(scheduler):
+    texts = ["a" * n for n in range(1, 11)]
+
+    assert scheduler.embed("doc", texts) == [[float(n), 1.0] for n in range(1, 11)]
+
+
+def test_model_error_fails_the_batch_and_the_worker_survives():
+    calls = []
+
+    def flaky(pairs):
+        calls.append(len(pairs))
+        if len(calls) == 1:
+            raise RuntimeError("model failed")
+        return encode(pairs)
+
+    scheduler = EmbeddingScheduler(flaky, max_batch_size=4, max_wait=0.01)
+    scheduler.start()
+    try:
+        with pytest.raises(RuntimeError):
+            scheduler.embed("doc", ["a"])
+        assert scheduler.embed("doc", ["ab"]) == [[2.0, 1.0]]
+    finally:
+        scheduler.close()
+
+
+def test_cancelled_requests_are_skipped_and_the_worker_survives():
+    started, release = threading.Event(), threading.Event()
+
+    def blocking(pairs):
+        started.set()
+        release.wait()
+        return encode(pairs)
+
+    scheduler = EmbeddingScheduler(blocking, max_batch_size=1, max_wait=0.0)
+    scheduler.start()
+    try:
+        first = scheduler.submit("doc", ["a"])
+        started.wait()
+        # The first request is being embedded, the second is still queued
+        assert not first.cancel()
+        second = scheduler.submit("doc", ["bb"])
+        assert second.cancel()
+        third = scheduler.submit("doc", ["ccc"])
+        release.set()
+
+        assert first.result(timeout=5) == [[1.0, 1.0]]
+        assert third.result(timeout=5) == [[3.0, 1.0]]
+        with pytest.raises(CancelledError):
+            second.result()
+    finally:
+        release.set()
+        scheduler.close()
@@ -0,0 +1,42 @@
+from vector_search.index_profiles import build_index_profile
+from vector_search.milvus_client import Milvus
+
+
+class IndexedCollection(Milvus):
+    """Client of a collection indexed with the given parameters, without a server"""
+
+    def __init__(self, index, index_profile):
+        self.collection_name = "pdf_documents"
+        self.index_profile = index_profile
+        self.index = index
+
+    def vector_index(self, field_name="embeddings"):
+        return self.index
+
+
+def test_default_profile_searches_with_l2():
+    profile = build_index_profile("HNSW")
+
+    assert profile.index_params()["metric_type"] == "L2"
+    assert profile.search_params(limit=5)["metric_type"] == "L2"
+
+
+def test_searches_use_the_metric_of_an_existing_index():
+    client = IndexedCollection(
+        {"index_type": "IVF_FLAT", "metric_type": "L2", "params": {"nlist": 1024}},
+        build_index_profile("HNSW", metric="COSINE"),
+    )
+
+    client.match_index_metric()
+
+    assert client.index_profile.metric == "L2"
+    assert client.index_profile.index_type == "HNSW"
+
+
+def test_profile_is_kept_for_a_new_collection():
+    profile = build_index_profile("HNSW", metric="COSINE")
+    client = IndexedCollection(None, profile)
+
+    client.match_index_metric()
+
+    assert client.index_profile is profile
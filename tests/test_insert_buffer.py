@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+
+import pytest
+from ingestion.insert_buffer import InsertBuffer
+
+
+class RecordingStore:
+    """Store rejecting any insert holding a row of a bad document"""
+
+    def __init__(self, bad_doc_ids=()):
+        self.bad_doc_ids = set(bad_doc_ids)
+        self.inserts = []
+
+    def insert_to_collection(self, data):
+        if any(row["doc_id"] in self.bad_doc_ids for row in data):
+            raise ValueError("document_name is too long")
+        self.inserts.append([row["doc_id"] for row in data])
+
+
+class StorePool:
+    def __init__(self, store):
+        self.store = store
+
+    @contextmanager
+    def acquire(self):
+        yield self.store
+
+
+def rows(doc_id, count):
+    return [{"doc_id": doc_id, "text": str(i)} for i in range(count)]
+
+
+def test_batches_are_merged_until_max_rows():
+    store = RecordingStore()
+    buffer = InsertBuffer(StorePool(store), max_rows=5)
+    first = buffer.add(rows("a", 2))
+    second = buffer.add(rows("b", 2))
+    assert store.inserts == []
+
+    third = buffer.add(rows("a", 1))
+    assert store.inserts == [["a", "a", "b", "b", "a"]]
+    assert first.done() and second.done() and third.done()
+
+
+def test_flush_inserts_pending_rows():
+    store = RecordingStore()
+    buffer = InsertBuffer(StorePool(store), max_rows=100)
+    future = buffer.add(rows("a", 3))
+    buffer.flush()
+
+    assert future.result() is None
+    assert store.inserts == [["a", "a", "a"]]
+
+
+def test_failed_merged_insert_only_fails_the_bad_document():
+    store = RecordingStore(bad_doc_ids={"bad"})
+    buffer = InsertBuffer(StorePool(store), max_rows=100)
+    good = [buffer.add(rows("a", 2)), buffer.add(rows("b", 1))]
+    bad = buffer.add(rows("bad", 2))
+    good.append(buffer.add(rows("a", 1)))
+    buffer.flush()
+
+    for future in good:
+        assert future.result() is None
+    with pytest.raises(ValueError):
+        bad.result()
+    assert sorted(store.inserts) == [["a", "a", "a"], ["b"]]
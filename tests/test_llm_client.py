@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+import openai
+import pytest
+from openai import AsyncOpenAI
+from vector_search.llm_client import LLMUnavailableError, ResilientLLMClient
+
+from tests.benchmarks.fixtures import StubOpenAIServer
+
+MESSAGES = [{"role": "user", "content": "What is the warranty period?"}]
+
+
+def make_client(stub, **kwargs):
+    openai_client = AsyncOpenAI(api_key="x", base_url=stub.base_url, max_retries=0)
+    return ResilientLLMClient(
+        openai_client, count_tokens=lambda text: len(text.split()), **kwargs
+    )
+
+
+def complete(client):
+    return client.create(model="gpt-4o-mini", messages=MESSAGES)
+
+
+def test_rate_limited_call_is_retried_after_the_server_wait():
+    with StubOpenAIServer(fail_first=1, failure_status=429, retry_after=0.3) as stub:
+        client = make_client(stub, backoff_base=0.01)
+        start = time.monotonic()
+        completion = asyncio.run(complete(client))
+        elapsed = time.monotonic() - start
+
+    assert completion.choices[0].message.content == stub.answer
+    assert stub.requests == 2
+    assert elapsed >= 0.3
+    assert stub.arrivals[1] - stub.arrivals[0] >= 0.3
+
+
+def test_bad_request_is_raised_without_retrying():
+    with StubOpenAIServer(fail_first=1, failure_status=400) as stub:
+        client = make_client(stub, backoff_base=0.01)
+        with pytest.raises(openai.BadRequestError):
+            asyncio.run(complete(client))
+
+    assert stub.requests == 1
+    assert client.breaker.state == "closed"
+
+
+def test_breaker_opens_after_consecutive_server_errors_then_lets_one_trial_through():
+    with StubOpenAIServer(fail_first=3, failure_status=500) as stub:
+        client = make_client(
+            stub, max_retries=0, circuit_failures=3, circuit_reset_seconds=0.2
+        )
+
+        async def scenario():
+            for _ in range(3):
+                with pytest.raises(LLMUnavailableError):
+                    await complete(client)
+            assert client.breaker.state == "open"
+            # Rejected without reaching the server
+            with pytest.raises(LLMUnavailableError, match="retry later"):
+                await complete(client)
+            assert stub.requests == 3
+
+            await asyncio.sleep(0.25)
+            assert client.breaker.state == "half_open"
+            stub.first_token_seconds = 0.2
+            return await asyncio.gather(
+                complete(client), complete(client), return_exceptions=True
+            )
+
+        trial, other = asyncio.run(scenario())
+
+    assert trial.choices[0].message.content == stub.answer
+    assert isinstance(other, LLMUnavailableError)
+    assert stub.requests == 4
+    assert client.breaker.state == "closed"
+
+
+def test_deadline_bounds_the_call_over_all_attempts():
+    with StubOpenAIServer(first_token_seconds=1.0) as stub:
+        client = make_client(stub, timeout=0.2, deadline=0.5, backoff_base=0.01)
+        start = time.monotonic()
+        with pytest.raises(LLMUnavailableError):
+            asyncio.run(complete(client))
+        elapsed = time.monotonic() - start
+
+    assert elapsed < 0.8
+    assert stub.requests >= 2
+
+
+def test_hedge_fires_only_after_the_quantile_delay():
+    with StubOpenAIServer() as stub:
+        client = make_client(stub, hedge=True, hedge_min_delay=0.2)
+
+        async def scenario():
+            # Latencies are needed before a hedge quantile is known
+            for _ in range(client.latencies.min_samples):
+                await complete(client)
+            fast = stub.requests
+            await complete(client)
+            assert stub.requests == fast + 1
+
+            stub.slow_rate = 1.0
+            stub.slow_seconds = 0.6
+            start = time.monotonic()
+            await complete(client)
+            return fast + 1, start
+
+        before_slow, start = asyncio.run(scenario())
+
+    assert stub.requests == before_slow + 2
+    primary, hedge = stub.arrivals[before_slow:]
+    assert primary - start < 0.2
+    assert 0.2 <= hedge - start < 0.6
@@ -0,0 +1,73 @@
+import pytest
+from vector_search.milvus_pool import MilvusPool
+
+
+class FakeClient:
+    def __init__(self):
+        self.healthy = True
+        self.closed = False
+
+    def list_collection(self):
+        if not self.healthy:
+            raise ConnectionError("Milvus is unreachable")
+        return ["pdf_documents"]
+
+    def close_connection(self):
+        self.closed = True
+
+
+class FakePool(MilvusPool):
+    def __init__(self, size=1):
+        super().__init__(
+            uri="",
+            token="",
+            collection_name="pdf_documents",
+            size=size,
+            acquire_timeout=1,
+        )
+        self.clients = []
+
+    def _connect(self):
+        client = FakeClient()
+        self.clients.append(client)
+        return client
+
+
+def test_client_is_reused_after_a_query_error():
+    pool = FakePool()
+    with pytest.raises(ValueError):
+        with pool.acquire():
+            raise ValueError("bad expression")
+
+    with pool.acquire() as client:
+        assert client is pool.clients[0]
+    assert not client.closed
+
+
+def test_client_is_discarded_when_the_connection_failed():
+    pool = FakePool()
+    with pytest.raises(ConnectionError):
+        with pool.acquire() as client:
+            client.healthy = False
+            client.list_collection()
+
+    assert client.closed
+    with pool.acquire() as other:
+        assert other is not client
+
+
+def test_client_of_a_closed_generator_is_discarded_and_its_slot_freed():
+    pool = FakePool()
+
+    def search():
+        with pool.acquire() as client:
+            yield client
+
+    results = search()
+    client = next(results)
+    results.close()
+
+    assert client.closed
+    assert pool._idle == []
+    with pool.acquire() as other:
+        assert other is not client
@@ -0,0 +1,153 @@
+import json
+
+import numpy as np
+import pytest
+from vector_search.numpy_store import NumpyVectorStore
+
+
+def chunk(doc_id, page_number, embeddings):
+    return {
+        "doc_id": doc_id,
+        "document_name": f"{doc_id}.pdf",
+        "page_number": page_number,
+        "text": f"{doc_id} page {page_number}",
+        "embeddings": embeddings,
+    }
+
+
+def texts(hits):
+    return [hit["entity"]["text"] for hit in hits]
+
+
+@pytest.fixture
+def store():
+    store = NumpyVectorStore(dimension=2, capacity=2)
+    store.insert_to_collection(
+        [
+            chunk("a", 1, [0.0, 0.0]),
+            chunk("a", 2, [1.0, 0.0]),
+            chunk("b", 1, [0.0, 3.0]),
+        ]
+    )
+    return store
+
+
+def test_search_orders_hits_by_squared_distance(store):
+    [hits] = store.vector_search([[0.9, 0.0]], limit=2)
+
+    assert texts(hits) == ["a page 2", "a page 1"]
+    assert hits[0]["distance"] == pytest.approx(0.01)
+    assert hits[1]["distance"] == pytest.approx(0.81)
+
+
+def test_search_is_restricted_to_the_documents(store):
+    [hits] = store.vector_search([[0.0, 0.0]], limit=5, doc_id="b")
+    [both] = store.vector_search([[0.0, 0.0]], limit=5, doc_id=["a", "b"])
+
+    assert texts(hits) == ["b page 1"]
+    assert len(both) == 3
+    assert store.vector_search([[0.0, 0.0]], doc_id="missing") == [[]]
+
+
+def test_cosine_search_ignores_the_vector_length():
+    store = NumpyVectorStore(dimension=2, metric="COSINE")
+    store.insert_to_collection([chunk("a", 1, [10.0, 1.0]), chunk("a", 2, [1.0, 10.0])])
+
+    [hits] = store.vector_search([[0.1, 1.0]], limit=1, include_embeddings=True)
+
+    assert texts(hits) == ["a page 2"]
+    assert hits[0]["distance"] == pytest.approx(0.99, abs=0.01)
+    assert np.linalg.norm(hits[0]["entity"]["embeddings"]) == pytest.approx(1.0)
+
+
+def test_deleted_chunks_are_not_found(store):
+    store.delete_pages("a", [2])
+    assert texts(store.vector_search([[1.0, 0.0]], limit=5)[0]) == [
+        "a page 1",
+        "b page 1",
+    ]
+
+    store.delete_entity("b")
+    assert texts(store.vector_search([[1.0, 0.0]], limit=5)[0]) == ["a page 1"]
+
+
+def test_compaction_keeps_the_remaining_chunks(store):
+    ids = [hit["id"] for hit in store.vector_search([[0.0, 0.0]], limit=3)[0]]
+    store.delete_entity("a")
+
+    assert store._size == 1
+    assert store._deleted == 0
+    [hits] = store.vector_search([[0.0, 0.0]], limit=5)
+    assert texts(hits) == ["b page 1"]
+    assert hits[0]["id"] == ids[2]
+    assert store.insert_to_collection([chunk("c", 1, [0.0, 0.0])]) == [3]
+
+
+def test_reopened_store_has_every_insert_and_delete(tmp_path):
+    path = str(tmp_path / "store")
+    store = NumpyVectorStore(dimension=2, path=path, capacity=1)
+    store.insert_to_collection([chunk("a", 1, [0.0, 0.0]), chunk("a", 2, [1.0, 0.0])])
+    store.insert_to_collection([chunk("b", 1, [0.0, 3.0])])
+    store.delete_pages("a", [1])
+
+    # Reopened without close_connection, like after a crash
+    reopened = NumpyVectorStore(dimension=2, path=path)
+    [hits] = reopened.vector_search([[0.0, 0.0]], limit=5)
+
+    assert texts(hits) == ["a page 2", "b page 1"]
+    assert [hit["id"] for hit in hits] == [1, 2]
+    assert reopened.insert_to_collection([chunk("c", 1, [0.0, 0.0])]) == [3]
+
+
+def test_matrix_without_metadata_is_not_overwritten(tmp_path):
+    path = str(tmp_path / "store")
+    store = NumpyVectorStore(dimension=2, path=path)
+    store.insert_to_collection([chunk("a", 1, [1.0, 2.0])])
+    (tmp_path / "store.json").unlink()
+    matrix = (tmp_path / "store.f32").read_bytes()
+
+    with pytest.raises(ValueError, match="no metadata"):
+        NumpyVectorStore(dimension=2, path=path)
+    assert (tmp_path / "store.f32").read_bytes() == matrix
+
+
+def test_writes_are_logged_without_rewriting_the_metadata(tmp_path):
+    path = str(tmp_path / "store")
+    store = NumpyVectorStore(dimension=2, path=path)
+    metadata = (tmp_path / "store.json").read_text()
+
+    store.insert_to_collection([chunk("a", 1, [0.0, 0.0])])
+    store.delete_pages("a", [2])
+
+    assert (tmp_path / "store.json").read_text() == metadata
+    assert len((tmp_path / "store.1.log").read_text().splitlines()) == 2
+
+
+def test_log_is_checkpointed_once_it_outgrows_the_metadata(tmp_path):
+    path = str(tmp_path / "store")
+    store = NumpyVectorStore(dimension=2, path=path, checkpoint_rows=2)
+
+    store.insert_to_collection([chunk("a", 1, [0.0, 0.0])])
+    store.insert_to_collection([chunk("a", 2, [1.0, 0.0])])
+    assert not (tmp_path / "store.2.log").exists()
+    store.insert_to_collection([chunk("a", 3, [2.0, 0.0])])
+
+    # The checkpoint holds every row and the next log starts empty
+    assert not (tmp_path / "store.1.log").exists()
+    assert len(json.loads((tmp_path / "store.json").read_text())["rows"]) == 3
+    store.insert_to_collection([chunk("a", 4, [3.0, 0.0])])
+    reopened = NumpyVectorStore(dimension=2, path=path)
+    [hits] = reopened.vector_search([[0.0, 0.0]], limit=5)
+    assert texts(hits) == ["a page 1", "a page 2", "a page 3", "a page 4"]
+
+
+def test_torn_last_log_write_is_ignored(tmp_path):
+    path = str(tmp_path / "store")
+    store = NumpyVectorStore(dimension=2, path=path)
+    store.insert_to_collection([chunk("a", 1, [0.0, 0.0])])
+    with open(tmp_path / "store.1.log", "a") as f:
+        f.write('{"op": "insert", "rows": [{"id": 1')
+
+    reopened = NumpyVectorStore(dimension=2, path=path)
+
+    assert texts(reopened.vector_search([[0.0, 0.0]], limit=5)[0]) == ["a page 1"]
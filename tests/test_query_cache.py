@@ -0,0 +1,104 @@
+import threading
+
+from vector_search.query_cache import QueryEmbeddingCache
+
+
+class CountingModel:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, text):
+        self.calls.append(text)
+        return [float(len(text))]
+
+
+def test_cached_embedding_is_reused_for_the_normalised_question():
+    cache = QueryEmbeddingCache()
+    model = CountingModel()
+
+    first = cache.get_or_compute("What is  the warranty?", model)
+    second = cache.get_or_compute("what is the WARRANTY?", model)
+
+    assert first == second
+    assert len(model.calls) == 1
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "coalesced": 0}
+
+
+def test_expired_embedding_is_computed_again():
+    cache = QueryEmbeddingCache(ttl=0)
+    model = CountingModel()
+
+    cache.get_or_compute("question", model)
+    cache.get_or_compute("question", model)
+
+    assert len(model.calls) == 2
+    assert cache.get_many(["question"]) == {}
+
+
+def test_least_recently_used_embedding_is_evicted():
+    cache = QueryEmbeddingCache(max_size=2)
+    model = CountingModel()
+    cache.put_many(["a", "bb"], [[1.0], [2.0]])
+
+    # Using "a" makes "bb" the least recently used
+    cache.get_or_compute("a", model)
+    cache.get_or_compute("ccc", model)
+
+    assert cache.get_many(["a", "bb", "ccc"]) == {0: [1.0], 2: [3.0]}
+
+
+def test_concurrent_misses_compute_the_embedding_once():
+    cache = QueryEmbeddingCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_model(text):
+        calls.append(text)
+        started.set()
+        release.wait(5)
+        return [1.0]
+
+    results = []
+    owner = threading.Thread(
+        target=lambda: results.append(cache.get_or_compute("q", slow_model))
+    )
+    owner.start()
+    started.wait(5)
+    waiter = threading.Thread(
+        target=lambda: results.append(cache.get_or_compute("q", slow_model))
+    )
+    waiter.start()
+    while cache.stats()["coalesced"] == 0:
+        threading.Event().wait(0.01)
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+
+    assert results == [[1.0], [1.0]]
+    assert calls == ["q"]
+
+
+def test_failed_computation_is_not_cached():
+    cache = QueryEmbeddingCache()
+    model = CountingModel()
+
+    def failing(text):
+        raise RuntimeError("model unavailable")
+
+    try:
+        cache.get_or_compute("q", failing)
+    except RuntimeError:
+        pass
+
+    assert cache.get_or_compute("q", model) == [1.0]
+    assert model.calls == ["q"]
+
+
+def test_clear_drops_every_embedding():
+    cache = QueryEmbeddingCache()
+    cache.put_many(["a"], [[1.0]])
+
+    cache.clear()
+
+    assert cache.get_many(["a"]) == {}
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+
+import pytest
+from vector_search.embedding_scheduler import EmbeddingScheduler
+from vector_search.text_embedders import TextEmbedding
+
+from tests.benchmarks.fixtures import FakeEmbeddings
+
+
+class RecordingEmbeddings(FakeEmbeddings):
+    """Slow fake model recording the texts it encodes"""
+
+    def __init__(self, fail=False):
+        super().__init__(dimension=4, seconds_per_text=0.1)
+        self.fail = fail
+        self.encoded = []
+
+    def encode(self, instruction_pairs, **kwargs):
+        self.encoded.extend(text for _, text in instruction_pairs)
+        vectors = super().encode(instruction_pairs, **kwargs)
+        if self.fail:
+            raise RuntimeError("model failed")
+        return vectors
+
+
+def embed_concurrently(embedder, questions, threads=4):
+    barrier = threading.Barrier(threads)
+    results, errors = [], []
+
+    def embed():
+        barrier.wait()
+        try:
+            results.append(embedder.embed_queries(questions))
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=embed) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(5)
+    return results, errors
+
+
+def test_identical_concurrent_questions_are_encoded_once():
+    model = RecordingEmbeddings()
+    embedder = TextEmbedding(model=model)
+
+    results, errors = embed_concurrently(
+        embedder, ["What is the warranty?", "what is the  WARRANTY?"]
+    )
+
+    assert not errors
+    assert model.encoded == ["What is the warranty?"]
+    assert all(result == results[0] for result in results)
+    assert results[0][0] == results[0][1]
+    # The repeat within each request and every other request waited
+    assert embedder.query_cache.stats()["coalesced"] == 7
+
+
+def test_waiting_questions_fail_with_the_encoding():
+    model = RecordingEmbeddings(fail=True)
+    embedder = TextEmbedding(model=model)
+
+    results, errors = embed_concurrently(embedder, ["What is the warranty?"])
+
+    assert results == []
+    assert len(errors) == 4
+    assert model.encoded == ["What is the warranty?"]
+    # Nothing is left claimed, the next request encodes the question again
+    with pytest.raises(RuntimeError):
+        embedder.embed_queries(["What is the warranty?"])
+    assert len(model.encoded) == 2
+
+
+def test_identical_concurrent_questions_share_a_scheduled_encoding():
+    model = RecordingEmbeddings()
+    embedder = TextEmbedding(model=model)
+    # Batches wait long enough for every request to join the first one
+    scheduler = EmbeddingScheduler(embedder.encode, max_batch_size=64, max_wait=0.05)
+    scheduler.start()
+    embedder.scheduler = scheduler
+
+    async def search_concurrently():
+        return await asyncio.gather(
+            *(embedder.aembed_queries(["What is the warranty?"]) for _ in range(4))
+        )
+
+    try:
+        results = asyncio.run(search_concurrently())
+    finally:
+        scheduler.close()
+
+    assert model.encoded == ["What is the warranty?"]
+    assert all(result == results[0] for result in results)
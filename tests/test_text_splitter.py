@@ -0,0 +1,32 @@
+import pytest
+from vector_search.text_splitter import (
+    ST_MAX_TOKENS_PER_CHUNK,
+    SplitStrategy,
+    check_split_params,
+    effective_chunk_size,
+)
+
+
+def test_sentence_transformers_chunks_are_capped():
+    assert effective_chunk_size(SplitStrategy.sentence_transformers, 1000) == 384
+    assert effective_chunk_size("sentence_transformers", 100) == 100
+    assert effective_chunk_size(SplitStrategy.tiktoken, 1000) == 1000
+
+
+@pytest.mark.parametrize(
+    "strategy, chunk_size, chunk_overlap",
+    [
+        (SplitStrategy.tiktoken, 0, 0),
+        (SplitStrategy.char, 100, -1),
+        (SplitStrategy.char, 100, 100),
+        (SplitStrategy.sentence_transformers, 500, ST_MAX_TOKENS_PER_CHUNK),
+    ],
+)
+def test_unusable_split_params_are_rejected(strategy, chunk_size, chunk_overlap):
+    with pytest.raises(ValueError):
+        check_split_params(strategy, chunk_size, chunk_overlap)
+
+
+def test_usable_split_params_are_accepted():
+    check_split_params(SplitStrategy.sentence_transformers, 500, 383)
+    check_split_params(SplitStrategy.tiktoken, 500, 450)